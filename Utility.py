@@ -1,10 +1,12 @@
-import concurrent.futures
 import json
 import logging
 import os
 import time
+import warnings
+from typing import Optional
+
+from benchmarks import QueryBenchmark
 
-import numpy as np
 
 def delete_bad_pdfs(filename: str = 'delete.txt'):
     dir_path = os.getcwd() + "\\data\\"
@@ -29,62 +31,31 @@ def dump_to_json(filename: str, data) -> None:
         json.dump(data, file)
 
 
-def test_database(testing_prompts: list[str], database_name: str, iterations: int = 100, database=None):
+def test_database(testing_prompts: list[str], database_name: str, iterations: Optional[int] = None, database=None, *,
+                  concurrencies: tuple = (1, 8, 50), duration: float = 30.0, warmup: float = 5.0) -> dict:
+    if iterations is not None:
+        # Kept in place so positional callers still work, but the load is now time based
+        warnings.warn("test_database no longer runs a fixed amount of iterations, each level of load runs for "
+                      "duration seconds instead", DeprecationWarning, stacklevel=2)
     logging.info(f"Testing {database_name} database")
 
-    vectorized_prompts = []
-    for prompt in testing_prompts:
-        vectorized_prompts.append(database.encode(prompt))
-    initial_time = time.time()
+    vectorized_prompts = [database.encode(prompt) for prompt in testing_prompts]
     quality_times = []
     with open(f"./results/{database_name}-results.json", "a") as file:
         # For testing quality of results, checking manually for quality in queried data.
         for s in testing_prompts:
-            starting_time = time.time()
+            starting_time = time.perf_counter()
             json.dump(database.query(s, postprocess=True), file)
-            quality_times.append(time.time() - starting_time)
-
-    # For testing speed of results, checking time taken to query data.
-    start_time_iterations = time.time()
-    count = 0
-    for i in range(iterations):
-        for s in vectorized_prompts:
-            database.query(s, postprocess=False, pre_vectorized=True)
-            count = count + 1
-    end_time_iterations = time.time()
-    all_items = []
-    for i in range(iterations):
-        for s in vectorized_prompts:
-            all_items.append(s)
+            quality_times.append(time.perf_counter() - starting_time)
 
-    multithreaded_times = []
-    start_time_multithreaded = time.time()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=50) as executor:
-        futures = [executor.submit(api_request_time, database=database, prompt=s) for s in all_items]
-        for future in concurrent.futures.as_completed(futures):
-            result = future.result()
-            logging.debug(f"Result: {result}")
-            multithreaded_times.append(result)
-    end_time_multithreaded = time.time()
+    # For testing speed of results, closed loop load at every level of concurrency.
+    results = QueryBenchmark.sweep(database, vectorized_prompts, concurrencies=concurrencies, duration=duration,
+                                   warmup=warmup)
+    report = QueryBenchmark.report(database_name, results, prompts=len(testing_prompts),
+                                   average_quality_time_ms=round(sum(quality_times) / len(quality_times) * 1000, 4))
+    with open(f"./results/{database_name}-benchmark.json", "w") as file:
+        json.dump(report, file, indent=2)
 
     print(f"DONE! {database_name}")
-    sig_fig = lambda num: np.format_float_positional(num, precision=3, unique=False, fractional=False, trim='k')
-    print(sig_fig(time.time()-initial_time))
-    return {
-        "database": database_name,
-        "Average Quality Time": sig_fig(sum(quality_times) / len(quality_times)),
-        "Average Iterations Time": sig_fig((end_time_iterations - start_time_iterations) / count),
-        "Average Multi-threaded Time Sim": sig_fig(sum(multithreaded_times) / len(multithreaded_times)),
-        "Average Multi-threaded Time Real": sig_fig(
-            (end_time_multithreaded - start_time_multithreaded) / len(multithreaded_times)),
-        "Total Quality Time": sig_fig(sum(quality_times)),
-        "Total Iterations Time": sig_fig(end_time_iterations - start_time_iterations),
-        "Time Multi-threaded Time": sig_fig(end_time_multithreaded - start_time_multithreaded),
-        "Total All Time": sig_fig(time.time() - initial_time)
-    }
-
-
-def api_request_time(database, prompt):
-    start_time = time.time()
-    database.query(prompt, postprocess=False, pre_vectorized=True)
-    return time.time() - start_time
+    print(QueryBenchmark.to_markdown([report]))
+    return report
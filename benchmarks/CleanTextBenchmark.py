@@ -0,0 +1,110 @@
+import argparse
+import json
+import logging
+import random
+import re
+import time
+from typing import Optional
+
+from benchmarks.IngestBenchmark import synthetic_text
+from loaders.TextNormalizer import normalize_pages
+
+
+def recursive_clean_text(text: str) -> str:
+    """The cleaner MacLoader used before TextNormalizer, kept as the baseline
+    """
+    fixed = text.replace("  ", " ")
+    if "  " in fixed:
+        return recursive_clean_text(fixed)
+    else:
+        fixed = fixed.replace("\n", "").replace(".,", ".").replace("\t", "")
+        fixed = re.sub(r'\b(\w+)-(\w+)\b', r'\1\2', fixed)
+        fixed = re.sub(r'\(cid:\d+\)', ' ', fixed)
+        if "  " in fixed:
+            return recursive_clean_text(fixed)
+        if fixed.startswith(" "):
+            fixed = fixed[1:]
+        return fixed
+
+
+def synthetic_pages(size: int, page_size: int = 3000, seed: int = 0) -> list:
+    """Raw page text resembling PyPDF2 output: line breaks, tabs, runs of spaces, split words and (cid:N) glyphs
+
+    :param size: Total amount of characters
+    :param page_size: Characters per page
+    :param seed: Random seed
+    :return: List of page strings
+    """
+    rng = random.Random(seed)
+    pages = []
+    total = 0
+    while total < size:
+        lines = synthetic_text(rng, page_size // 8)
+        for i in range(len(lines)):
+            if rng.random() < 0.05:
+                lines[i] += f" (cid:{rng.randrange(200)})"
+            if rng.random() < 0.02:
+                lines[i] += "\t" + " " * rng.randrange(2, 40)
+        page = "\n".join(lines)[:page_size]
+        pages.append(page)
+        total += len(page)
+    return pages
+
+
+def throughput(function, argument, size: int, repeat: int) -> float:
+    """Best of repeat runs, in MB/s
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - start_time)
+    return size / best / 1e6
+
+
+def run(sizes: list = (10_000, 100_000, 1_000_000, 10_000_000), repeat: int = 3) -> list:
+    """Throughput of the old recursive cleaner and TextNormalizer on the same text
+
+    :param sizes: Document sizes in characters
+    :param repeat: Runs per measurement, the fastest counts
+    :return: One result dict per size
+    """
+    results = []
+    for size in sizes:
+        pages = synthetic_pages(size)
+        text = "".join(pages)
+        old = recursive_clean_text(text)
+        new = normalize_pages(pages)
+        result = {
+            "characters": len(text),
+            "recursive_mb_per_second": round(throughput(recursive_clean_text, text, len(text), repeat), 2),
+            "normalizer_mb_per_second": round(throughput(normalize_pages, pages, len(text), repeat), 2),
+            "same_output": old == new,
+        }
+        result["speedup"] = round(result["normalizer_mb_per_second"] / result["recursive_mb_per_second"], 2)
+        logging.info(result)
+        results.append(result)
+    return results
+
+
+def main(arguments: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Text cleaning throughput, old recursive cleaner vs TextNormalizer")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(arguments)
+
+    results = run(args.sizes, args.repeat)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    print("| characters | recursive (MB/s) | TextNormalizer (MB/s) | speedup | same output |")
+    print("|------------|------------------|-----------------------|---------|-------------|")
+    for result in results:
+        print(f"| {result['characters']} | {result['recursive_mb_per_second']} | {result['normalizer_mb_per_second']} "
+              f"| {result['speedup']} | {result['same_output']} |")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
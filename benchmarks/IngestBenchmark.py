@@ -0,0 +1,176 @@
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+from typing import Optional
+
+from benchmarks import QueryBenchmark
+
+_WORDS = ("vector", "database", "query", "index", "embedding", "latency", "throughput", "document", "search", "model",
+          "quantization", "cluster", "neighbour", "distance", "memory", "storage", "benchmark", "result", "metric",
+          "the", "of", "and", "to", "in", "is", "for", "with", "on", "that", "by", "this", "are", "from", "as")
+
+
+def minimal_pdf(pages: list) -> bytes:
+    """Write a bare-bones PDF with one Helvetica text block per page, enough for PyPDF2 to extract the text
+
+    :param pages: List of pages, each a list of text lines
+    :return: Bytes of the PDF file
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = ("BT /F1 10 Tf 12 TL 50 780 Td " + " T* ".join(f"({line}) Tj" for line in escaped) + " ET")
+        stream = stream.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+def synthetic_text(rng: random.Random, words: int, words_per_line: int = 14) -> list:
+    """Lines of random words with the kind of noise real PDFs have: split hyphenated words and doubled spaces
+
+    :return: List of lines
+    """
+    lines = []
+    for _ in range(0, words, words_per_line):
+        line = []
+        for _ in range(words_per_line):
+            word = rng.choice(_WORDS)
+            if rng.random() < 0.03 and len(word) > 5:
+                word = f"{word[:3]}-{word[3:]}"
+            line.append(word)
+        lines.append(("  " if rng.random() < 0.1 else " ").join(line))
+    return lines
+
+
+def synthetic_corpus(directory: str, metadata_file: str, documents: int = 100, pages: int = 5,
+                     words_per_page: int = 400, seed: int = 0) -> list:
+    """Generate a reproducible corpus of PDFs and the metadata.csv the loader expects
+
+    :param directory: Directory to write the PDFs to, relative to the working directory like MacLoader's data_directory
+    :param metadata_file: CSV to write the digest, file_size and date of every PDF to
+    :param documents: Amount of PDFs
+    :param pages: Pages per PDF
+    :param words_per_page: Words per page
+    :param seed: Random seed
+    :return: Filenames of the PDFs
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    rows = ["digest,file_size,date"]
+    for _ in range(documents):
+        pdf = minimal_pdf([synthetic_text(rng, words_per_page) for _ in range(pages)])
+        digest = hashlib.sha1(pdf).hexdigest()
+        with open(os.path.join(directory, f"{digest}.pdf"), "wb") as file:
+            file.write(pdf)
+        filenames.append(f"{digest}.pdf")
+        rows.append(f"{digest},{len(pdf)},{datetime.date(2023, 1, 1) + datetime.timedelta(days=rng.randrange(365))}")
+    with open(metadata_file, "w") as file:
+        file.write("\n".join(rows) + "\n")
+    return filenames
+
+
+def run(database, directory: str, metadata_file: str, max_num_files: Optional[int] = None, batch_size: int = 500,
+        **loader_settings) -> dict:
+    """Load a directory of PDFs into a database and return the per-stage breakdown
+
+    :param database: Any Database
+    :param directory: Directory of PDFs, relative to the working directory
+    :param metadata_file: CSV with the metadata of every PDF
+    :param max_num_files: Max amount of PDFs to load
+    :param batch_size: Amount of chunks per upload
+    :param loader_settings: Passed on to MacLoader, e.g. extraction_workers or encode_batch_size
+    :return: IngestStats summary of the run
+    """
+    from loaders.Loader import MacLoader
+    loader = MacLoader(data_directory=directory, metadata_file=metadata_file, **loader_settings)
+    try:
+        return loader.encode_docs(database=database, max_num_files=max_num_files, batch_size=batch_size)
+    finally:
+        loader.close()
+
+
+def to_markdown(report: dict) -> str:
+    """Render an ingestion report as Markdown, totals first and then one row per stage
+    """
+    result = report["results"][0]
+    lines = [
+        f"{result['documents']} documents, {result['chunks']} chunks, {result['bytes']} bytes in "
+        f"{result['wall_seconds']}s: {result['documents_per_second']} docs/s, {result['chunks_per_second']} chunks/s, "
+        f"{result['bytes_per_second']} bytes/s",
+        "",
+        "| stage | calls | items | busy seconds | mean (ms) | max (ms) | share |",
+        "|-------|-------|-------|--------------|-----------|----------|-------|",
+    ]
+    for stage, timing in result["stages"].items():
+        lines.append(f"| {stage} | {timing['calls']} | {timing['items']} | {timing['seconds']} | {timing['mean_ms']} | "
+                     f"{timing['max_ms']} | {timing['share']} |")
+    lines += ["", "| queue | mean depth | max depth |", "|-------|------------|-----------|"]
+    for name, depth in result["queues"].items():
+        lines.append(f"| {name} | {depth['mean']} | {depth['max']} |")
+    return "\n".join(lines)
+
+
+def main(arguments: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Ingestion throughput with a per-stage breakdown")
+    parser.add_argument("--database", default="local",
+                        help='"local" for an in-memory NumpyDB, or a "module:Class" path')
+    parser.add_argument("--directory", default="benchmark_corpus", help="Directory for the synthetic PDFs")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--words", type=int, default=400, help="Words per page")
+    parser.add_argument("--extraction-workers", type=int)
+    parser.add_argument("--encoders", type=int, default=1, help="Amount of encoding threads")
+    parser.add_argument("--encode-batch-size", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=500, help="Amount of chunks per upload")
+    parser.add_argument("--sequential", action="store_true", help="Run without the extraction process pool")
+    parser.add_argument("--output", help="JSON file to write the report to")
+    args = parser.parse_args(arguments)
+
+    metadata_file = os.path.join(args.directory, "metadata.csv")
+    filenames = synthetic_corpus(os.path.join(args.directory, "pdfs"), metadata_file, args.documents, args.pages,
+                                 args.words)
+    if args.database == "local":
+        from databases.NumpyDB import NumpyDB
+        database = NumpyDB(index_name="ingest-benchmark")
+    else:
+        database = QueryBenchmark.load_database(args.database)
+        database.clear()
+
+    summary = run(database, os.path.join(args.directory, "pdfs"), metadata_file, max_num_files=len(filenames),
+                  batch_size=args.batch_size, extraction_workers=args.extraction_workers,
+                  max_workers_num=args.encoders, encode_batch_size=args.encode_batch_size,
+                  multithreading=not args.sequential)
+    report = QueryBenchmark.report(args.database, [summary], corpus={
+        "documents": args.documents, "pages": args.pages, "words_per_page": args.words
+    })
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+    print(to_markdown(report))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import datetime
+import importlib
+import itertools
+import json
+import logging
+import math
+import platform
+from typing import Optional
+
+import numpy as np
+
+from databases.batch import VectorBatch
+
+
+class LatencyHistogram:
+    """HDR style latency histogram. Values are counted in logarithmic buckets, so every percentile is within
+    precision of the real value while memory stays constant no matter how many requests are recorded.
+
+    Args:
+        lowest (float): Smallest latency that can be told apart, in seconds.
+        highest (float): Largest latency that can be recorded, in seconds. Anything above is counted as highest.
+        precision (float): Relative width of each bucket, 0.01 keeps percentiles within 1%.
+    """
+
+    def __init__(self,
+                 lowest: float = 1e-6,
+                 highest: float = 3600.0,
+                 precision: float = 0.01
+                 ) -> None:
+        self.lowest = lowest
+        self.highest = highest
+        self._log_base = math.log1p(precision)
+        self.counts = np.zeros(self._bucket(highest) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.lowest:
+            return 0
+        return int(math.log(min(value, self.highest) / self.lowest) / self._log_base)
+
+    def record(self, seconds: float) -> None:
+        self.counts[self._bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        self.counts += other.counts
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> float:
+        """Latency below which percent of the recorded values fall
+
+        :param percent: Percentile between 0 and 100
+        :return: Latency in seconds
+        """
+        if self.count == 0:
+            return math.nan
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        bucket = int(np.searchsorted(np.cumsum(self.counts), rank))
+        # Upper edge of the bucket, never more than the largest value actually seen
+        return min(self.lowest * math.exp((bucket + 1) * self._log_base), self.max)
+
+    def summary(self) -> dict:
+        """Percentiles in milliseconds
+
+        :return: Dict of count, mean, min, p50, p95, p99, p999 and max
+        """
+        to_ms = lambda seconds: round(seconds * 1000, 4) if self.count else None
+        return {
+            "count": self.count,
+            "mean_ms": to_ms(self.total / self.count) if self.count else None,
+            "min_ms": to_ms(self.min),
+            "p50_ms": to_ms(self.percentile(50)),
+            "p95_ms": to_ms(self.percentile(95)),
+            "p99_ms": to_ms(self.percentile(99)),
+            "p999_ms": to_ms(self.percentile(99.9)),
+            "max_ms": to_ms(self.max),
+        }
+
+
+async def closed_loop(database, vectors: list, concurrency: int = 8, duration: float = 10.0, warmup: float = 2.0,
+                      top_k: int = 5) -> dict:
+    """Closed loop load. concurrency clients each send their next query as soon as the last one returns.
+
+    :param database: Any Database
+    :param vectors: Query vectors, sent round robin
+    :param concurrency: Amount of simulated clients
+    :param duration: Seconds to measure for, after the warmup
+    :param warmup: Seconds of load before measuring starts
+    :param top_k: How many results to ask for
+    :return: Result dict with throughput and latency percentiles
+    """
+    loop = asyncio.get_running_loop()
+    histogram = LatencyHistogram()
+    errors = 0
+    counter = itertools.count()
+    measure_from = loop.time() + warmup
+    end = measure_from + duration
+
+    async def client():
+        nonlocal errors
+        while loop.time() < end:
+            vector = vectors[next(counter) % len(vectors)]
+            start = loop.time()
+            try:
+                await database.aquery(vector, top_k=top_k, pre_vectorized=True)
+            except Exception as e:
+                if start >= measure_from:
+                    errors += 1
+                    logging.debug(f"Query failed: {e}")
+                continue
+            if start >= measure_from:
+                histogram.record(loop.time() - start)
+
+    try:
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    finally:
+        # Every run gets its own loop from asyncio.run, clients made for this one are closed with it
+        await database.aclose()
+    return _result("closed", histogram, errors, duration, concurrency=concurrency)
+
+
+async def open_loop(database, vectors: list, qps: float = 100.0, duration: float = 10.0, warmup: float = 2.0,
+                    top_k: int = 5) -> dict:
+    """Open loop load. Queries are sent on a fixed schedule whether or not earlier ones returned, and latency is
+    measured from when a query was supposed to be sent, so a stalled database can't hide its own queueing delay.
+
+    :param database: Any Database
+    :param vectors: Query vectors, sent round robin
+    :param qps: Queries per second to send
+    :param duration: Seconds to measure for, after the warmup
+    :param warmup: Seconds of load before measuring starts
+    :param top_k: How many results to ask for
+    :return: Result dict with throughput and latency percentiles
+    """
+    loop = asyncio.get_running_loop()
+    histogram = LatencyHistogram()
+    errors = 0
+    interval = 1 / qps
+    warmup_requests = int(warmup * qps)
+    total_requests = warmup_requests + int(duration * qps)
+    start = loop.time()
+
+    async def send(number: int, intended: float):
+        nonlocal errors
+        try:
+            await database.aquery(vectors[number % len(vectors)], top_k=top_k, pre_vectorized=True)
+        except Exception as e:
+            if number >= warmup_requests:
+                errors += 1
+                logging.debug(f"Query failed: {e}")
+            return
+        if number >= warmup_requests:
+            histogram.record(loop.time() - intended)
+
+    tasks = []
+    try:
+        for number in range(total_requests):
+            intended = start + number * interval
+            delay = intended - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(number, intended)))
+        await asyncio.gather(*tasks)
+    finally:
+        await database.aclose()
+    return _result("open", histogram, errors, duration, qps=qps)
+
+
+def _result(mode: str, histogram: LatencyHistogram, errors: int, duration: float, **settings) -> dict:
+    return {
+        "mode": mode,
+        **settings,
+        "duration_s": duration,
+        "requests": histogram.count,
+        "errors": errors,
+        "throughput_qps": round(histogram.count / duration, 2),
+        "latency": histogram.summary(),
+    }
+
+
+def sweep(database, vectors: list, concurrencies: list = (1, 2, 4, 8, 16, 32, 64), duration: float = 10.0,
+          warmup: float = 2.0, top_k: int = 5) -> list:
+    """Throughput and latency at every level of concurrency, closed loop
+
+    :param database: Any Database
+    :param vectors: Query vectors
+    :param concurrencies: Amounts of clients to try
+    :param duration: Seconds to measure each level for
+    :param warmup: Seconds of warmup before each level
+    :param top_k: How many results to ask for
+    :return: One result dict per level
+    """
+    results = []
+    for concurrency in concurrencies:
+        result = asyncio.run(closed_loop(database, vectors, concurrency=concurrency, duration=duration,
+                                         warmup=warmup, top_k=top_k))
+        logging.info(f"Concurrency {concurrency}: {result['throughput_qps']} qps, {result['latency']}")
+        results.append(result)
+    return results
+
+
+def report(database_name: str, results: list, **extra) -> dict:
+    """Wrap results with enough context to compare runs across machines and releases
+
+    :param database_name: Name shown in the report
+    :param results: Result dicts from closed_loop, open_loop or sweep
+    :return: Report dict, JSON serializable
+    """
+    return {
+        "database": database_name,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+        **extra,
+        "results": results,
+    }
+
+
+def to_markdown(reports: list) -> str:
+    """Render reports as a Markdown table in the style of Benchmarks.md
+
+    :param reports: Reports from report()
+    :return: Markdown table, one row per database and load level
+    """
+    lines = [
+        "| database | mode | load | throughput (qps) | p50 (ms) | p95 (ms) | p99 (ms) | p999 (ms) | errors |",
+        "|----------|------|------|------------------|----------|----------|----------|-----------|--------|",
+    ]
+    for entry in reports:
+        for result in entry["results"]:
+            load = f"{result['concurrency']} clients" if result["mode"] == "closed" else f"{result['qps']} qps"
+            latency = result["latency"]
+            lines.append(f"| {entry['database']} | {result['mode']} | {load} | {result['throughput_qps']} | "
+                         f"{latency['p50_ms']} | {latency['p95_ms']} | {latency['p99_ms']} | {latency['p999_ms']} | "
+                         f"{result['errors']} |")
+    return "\n".join(lines)
+
+
+def random_vectors(amount: int, dimensions: int = 768, seed: int = 0) -> np.ndarray:
+    """Normalized random float32 vectors, stand-ins for real embeddings
+
+    :param amount: Amount of vectors
+    :param dimensions: Size of each vector
+    :param seed: Random seed
+    :return: 2D float32 array
+    """
+    vectors = np.random.default_rng(seed).standard_normal((amount, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def local_database(vectors: np.ndarray, batch_size: int = 10000, **kwargs):
+    """NumpyDB filled with the given vectors, a local stand-in for the hosted databases
+
+    :param vectors: Vectors to store, IDs are their positions
+    :param batch_size: Amount of vectors per upload
+    :param kwargs: Passed on to NumpyDB, e.g. index=HNSWIndex(...)
+    :return: NumpyDB
+    """
+    from databases.NumpyDB import NumpyDB
+    database = NumpyDB(dimensions=vectors.shape[1], initial_capacity=len(vectors), **kwargs)
+    for start in range(0, len(vectors), batch_size):
+        ids = np.arange(start, min(start + batch_size, len(vectors)))
+        asyncio.run(database.upload(VectorBatch.from_arrays(ids, vectors[start:start + batch_size])))
+    return database
+
+
+def load_database(path: str):
+    """Create a database from a "module:Class" path, e.g. "databases.QDrantDB:QDrantDB"
+    """
+    module_name, class_name = path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def main(arguments: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Query load generator for any Database")
+    parser.add_argument("--database", default="local",
+                        help='"local" for an in-memory NumpyDB of random vectors, or a "module:Class" path')
+    parser.add_argument("--vectors", type=int, default=100000, help="Amount of vectors in the local database")
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=1000, help="Amount of distinct query vectors")
+    parser.add_argument("--mode", choices=["closed", "open", "sweep"], default="sweep")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--qps", type=float, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--output", help="JSON file to write the report to")
+    parser.add_argument("--markdown", action="store_true", help="Also print a Markdown table")
+    args = parser.parse_args(arguments)
+
+    if args.database == "local":
+        database = local_database(random_vectors(args.vectors, args.dimensions, seed=0))
+        name = f"NumpyDB ({args.vectors} vectors)"
+    else:
+        database = load_database(args.database)
+        name = args.database
+    queries = random_vectors(args.queries, database.model_dimensions, seed=1).tolist()
+
+    if args.mode == "sweep":
+        results = sweep(database, queries, args.concurrency, args.duration, args.warmup, args.top_k)
+    elif args.mode == "closed":
+        results = [asyncio.run(closed_loop(database, queries, concurrency, args.duration, args.warmup, args.top_k))
+                   for concurrency in args.concurrency]
+    else:
+        results = [asyncio.run(open_loop(database, queries, qps, args.duration, args.warmup, args.top_k))
+                   for qps in args.qps]
+
+    output = report(name, results, top_k=args.top_k, queries=args.queries)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+    print(json.dumps(output, indent=2))
+    if args.markdown:
+        print(to_markdown([output]))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
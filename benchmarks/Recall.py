@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+from typing import Optional
+
+import numpy as np
+
+from benchmarks import QueryBenchmark
+from databases.batch import VectorBatch
+
+
+def ground_truth(vectors: np.ndarray, queries: np.ndarray, top_k: int = 10, metric: str = "cosine") -> list:
+    """Exact top_k neighbours of every query by brute force
+
+    :param vectors: 2D array of the vectors stored in the databases, IDs are their positions
+    :param queries: 2D array of query vectors
+    :param top_k: How many neighbours to find per query
+    :param metric: "cosine" or "ip", must match the databases being measured
+    :return: List of ID lists, best first
+    """
+    reference = QueryBenchmark.local_database(np.asarray(vectors, dtype=np.float32), metric=metric)
+    results = reference.exact_search_batch(queries, top_k)
+    return [list(reference.lookup_ids(rows)) for rows, _ in results]
+
+
+def recall_at_k(retrieved: list, relevant: list, k: int) -> float:
+    """Share of the true top k that shows up in the retrieved top k
+    """
+    return len(set(retrieved[:k]) & set(relevant[:k])) / k
+
+
+def reciprocal_rank(retrieved: list, relevant: list) -> float:
+    """1 / rank of the true nearest neighbour in the retrieved results, 0 if it is missing
+    """
+    if relevant and relevant[0] in retrieved:
+        return 1 / (retrieved.index(relevant[0]) + 1)
+    return 0.0
+
+
+def ndcg_at_k(retrieved: list, relevant: list, k: int) -> float:
+    """Normalized discounted cumulative gain. The true neighbour at rank r is worth k - r, so missing or misordering
+    the closest neighbours costs more than the far ones.
+    """
+    gains = {doc_id: k - rank for rank, doc_id in enumerate(relevant[:k])}
+    dcg = sum(gains.get(doc_id, 0) / math.log2(rank + 2) for rank, doc_id in enumerate(retrieved[:k]))
+    ideal = sum((k - rank) / math.log2(rank + 2) for rank in range(min(k, len(relevant))))
+    return dcg / ideal if ideal else 0.0
+
+
+def evaluate(database, queries: list, truth: list, top_k: int = 10, batch_size: int = 64) -> dict:
+    """Recall@k, MRR and nDCG@k of a database against exact ground truth
+
+    :param database: Any Database holding the same vectors the ground truth was computed over
+    :param queries: Query vectors
+    :param truth: Output of ground_truth for the same queries
+    :param top_k: k for every metric
+    :param batch_size: Amount of queries per query_batch call
+    :return: Dict of mean recall, MRR and nDCG, plus the worst recall of any query
+    """
+    results = database.query_batch(list(queries), top_k=top_k, postprocess=True, pre_vectorized=True,
+                                   batch_size=batch_size)
+    recalls, reciprocal_ranks, ndcgs = [], [], []
+    for documents, relevant in zip(results, truth):
+        retrieved = [str(document['id']) for document in documents]
+        relevant = [str(doc_id) for doc_id in relevant]
+        recalls.append(recall_at_k(retrieved, relevant, top_k))
+        reciprocal_ranks.append(reciprocal_rank(retrieved, relevant))
+        ndcgs.append(ndcg_at_k(retrieved, relevant, top_k))
+    return {
+        "k": top_k,
+        "queries": len(recalls),
+        f"recall@{top_k}": round(float(np.mean(recalls)), 4),
+        "min_recall": round(float(np.min(recalls)), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        f"ndcg@{top_k}": round(float(np.mean(ndcgs)), 4),
+    }
+
+
+def compare(databases: dict, queries: np.ndarray, truth: list, top_k: int = 10, concurrency: int = 8,
+            duration: float = 10.0, warmup: float = 2.0) -> list:
+    """Quality and speed of every database or index setting side by side
+
+    :param databases: Dict of name -> Database, all holding the vectors the ground truth was computed over
+    :param queries: Query vectors
+    :param truth: Output of ground_truth for the same queries
+    :param top_k: k for every metric and query
+    :param concurrency: Amount of closed loop clients for the latency run
+    :param duration: Seconds to measure latency for
+    :param warmup: Seconds of warmup before measuring latency
+    :return: One report per database, as produced by QueryBenchmark.report with the quality metrics added
+    """
+    queries = np.asarray(queries, dtype=np.float32).tolist()
+    reports = []
+    for name, database in databases.items():
+        quality = evaluate(database, queries, truth, top_k)
+        speed = asyncio.run(QueryBenchmark.closed_loop(database, queries, concurrency=concurrency, duration=duration,
+                                                       warmup=warmup, top_k=top_k))
+        logging.info(f"{name}: {quality}, {speed['throughput_qps']} qps")
+        reports.append(QueryBenchmark.report(name, [speed], quality=quality))
+    return reports
+
+
+def to_markdown(reports: list) -> str:
+    """Render compare() output as a Markdown table, quality next to latency
+
+    :param reports: Reports from compare()
+    :return: Markdown table, one row per database
+    """
+    k = reports[0]["quality"]["k"] if reports else 10
+    lines = [
+        f"| database | recall@{k} | min recall | MRR | nDCG@{k} | throughput (qps) | p50 (ms) | p99 (ms) |",
+        "|----------|-----------|------------|-----|---------|------------------|----------|----------|",
+    ]
+    for entry in reports:
+        quality = entry["quality"]
+        speed = entry["results"][0]
+        lines.append(f"| {entry['database']} | {quality[f'recall@{k}']} | {quality['min_recall']} | {quality['mrr']} | "
+                     f"{quality[f'ndcg@{k}']} | {speed['throughput_qps']} | {speed['latency']['p50_ms']} | "
+                     f"{speed['latency']['p99_ms']} |")
+    return "\n".join(lines)
+
+
+def upload_corpus(database, vectors: np.ndarray, batch_size: int = 1000) -> None:
+    """Upload vectors to a hosted database as the VectorBatches the loader produces, IDs are their positions
+
+    :param database: Any Database, cleared beforehand
+    :param vectors: 2D array of vectors
+    :param batch_size: Amount of vectors per upload
+    :return:
+    """
+    database.indexing(False)
+    for start in range(0, len(vectors), batch_size):
+        ids = np.arange(start, min(start + batch_size, len(vectors)))
+        asyncio.run(database.upload(VectorBatch.from_arrays(
+            ids=ids,
+            vectors=vectors[start:start + batch_size],
+            texts=[""] * len(ids),
+            metadata={'filename': "synthetic", 'size': 0, 'created_at': ""},
+            chunks=ids + 1
+        )))
+    database.indexing(True)
+
+
+def local_settings(vectors: np.ndarray) -> dict:
+    """NumpyDB with exact search and a few HNSW and IVF-PQ settings, all over the same vectors
+    """
+    from indexes.HNSW import HNSWIndex
+    from indexes.IVFPQ import IVFPQIndex
+
+    dimensions = vectors.shape[1]
+    subvectors = next(n for n in (96, 64, 48, 32, 16, 8, 4, 2, 1) if dimensions % n == 0)
+    databases = {"NumpyDB exact": QueryBenchmark.local_database(vectors)}
+    hnsw = QueryBenchmark.local_database(vectors, index=HNSWIndex(dimensions))
+    for ef_search in (16, 64, 256):
+        databases[f"HNSW ef_search={ef_search}"] = _IndexSettings(hnsw, "ef_search", ef_search)
+    ivfpq = QueryBenchmark.local_database(vectors, index=IVFPQIndex(
+        dimensions, n_lists=max(1, int(math.sqrt(len(vectors)))), n_subvectors=subvectors,
+        train_size=len(vectors)))
+    for n_probe, rerank in ((4, 0), (16, 0), (16, 100)):
+        databases[f"IVF-PQ n_probe={n_probe} rerank={rerank}"] = _IndexSettings(ivfpq, "n_probe", n_probe,
+                                                                             rerank=rerank)
+    return databases
+
+
+class _IndexSettings:
+    """Database proxy that applies index settings before every call, so one built index can be measured at several
+    search time settings without rebuilding it
+    """
+
+    def __init__(self, database, name: str, value, **settings) -> None:
+        self._database = database
+        self._settings = {name: value, **settings}
+
+    def _apply(self) -> None:
+        for name, value in self._settings.items():
+            setattr(self._database.index, name, value)
+
+    def query_batch(self, *args, **kwargs):
+        self._apply()
+        return self._database.query_batch(*args, **kwargs)
+
+    async def aquery(self, *args, **kwargs):
+        self._apply()
+        return await self._database.aquery(*args, **kwargs)
+
+    async def aclose(self) -> None:
+        await self._database.aclose()
+
+
+def main(arguments: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Recall, MRR and nDCG against exact ground truth, next to latency")
+    parser.add_argument("--database", nargs="*", default=[],
+                        help='"module:Class" paths of hosted databases to measure, local index settings if empty')
+    parser.add_argument("--upload", action="store_true", help="Clear the hosted databases and upload the corpus")
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--output", help="JSON file to write the reports to")
+    args = parser.parse_args(arguments)
+
+    vectors = QueryBenchmark.random_vectors(args.vectors, args.dimensions, seed=0)
+    # Queries close to stored vectors, so there are real nearest neighbours to find
+    noise = QueryBenchmark.random_vectors(args.queries, args.dimensions, seed=2)
+    queries = vectors[np.random.default_rng(1).choice(len(vectors), args.queries)] + 0.5 * noise
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = ground_truth(vectors, queries, args.top_k)
+
+    if args.database:
+        databases = {path: QueryBenchmark.load_database(path) for path in args.database}
+        if args.upload:
+            for database in databases.values():
+                database.clear()
+                upload_corpus(database, vectors)
+    else:
+        databases = local_settings(vectors)
+
+    reports = compare(databases, queries, truth, args.top_k, args.concurrency, args.duration, args.warmup)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(reports, file, indent=2)
+    print(json.dumps(reports, indent=2))
+    print(to_markdown(reports))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,29 +1,99 @@
-from copy import deepcopy
-from typing import Optional
+import asyncio
+import logging
+import time
+from typing import Optional, Union
 
 from databases.MilvusDB import MilvusDB
 from databases.PineconeDB import PineconeDB
 from databases.QDrantDB import QDrantDB
+from databases.batch import VectorBatch
 from databases.database import Database
 
 
+class UploadError(Exception):
+    """Raised by AllDB.upload when at least one database failed, after every other database has finished
+
+    Args:
+        failures (dict): Database name -> exception it raised.
+    """
+
+    def __init__(self, failures: dict) -> None:
+        self.failures = failures
+        super().__init__("Upload failed for " + ", ".join(f"{name} ({error!r})" for name, error in failures.items()))
+
+
 class AllDB(Database):
-    """Class for uploading text to every database
+    """Class for uploading text to every database. Each batch is turned into one immutable VectorBatch that every
+    database reads from, and all databases upload it at the same time, so a slow one doesn't hold the others back.
+
+    Args:
+        databases (list): Databases to upload to. Defaults to Milvus, Pinecone and QDrant.
     """
 
     def __init__(self,
                  databases: Optional[list] = None
                  ) -> None:
         super().__init__()
+        self.logger = logging.getLogger(__name__)
         if databases is None:
             databases = [MilvusDB(), PineconeDB(), QDrantDB()]
         self.databases = databases
+        self.names = self._names(databases)
+        # Database name -> {'uploaded', 'failed', 'docs', 'seconds'}, over every upload so far
+        self.upload_stats = {name: {'uploaded': 0, 'failed': 0, 'docs': 0, 'seconds': 0.0} for name in self.names}
+        # Database name -> {'ok', 'seconds', 'error'} of the most recent upload
+        self.last_upload = {}
 
-    async def upload(self, batch):
-        for db in self.databases:
-            temp_batch = deepcopy(batch)
-            await db.upload(temp_batch)
+    @staticmethod
+    def _names(databases: list) -> list:
+        names = []
+        counts = {}
+        for db in databases:
+            name = type(db).__name__
+            counts[name] = counts.get(name, 0) + 1
+            names.append(name if counts[name] == 1 else f"{name}-{counts[name]}")
+        return names
+
+    async def _upload_one(self, name: str, db: Database, batch: VectorBatch) -> dict:
+        start_time = time.perf_counter()
+        try:
+            await db.upload(batch)
+            error = None
+        except Exception as e:
+            error = e
+        elapsed = time.perf_counter() - start_time
+
+        stats = self.upload_stats[name]
+        stats['seconds'] += elapsed
+        if error is None:
+            stats['uploaded'] += 1
+            stats['docs'] += len(batch)
+            self.logger.debug(f"{name} uploaded {len(batch)} docs in {elapsed}")
+        else:
+            stats['failed'] += 1
+            self.logger.error(f"{name} failed to upload {len(batch)} docs after {elapsed}. See error: {error}")
+        return {'ok': error is None, 'seconds': elapsed, 'error': error}
+
+    async def upload(self, batch: Union[VectorBatch, list]) -> dict:
+        """Method to upload a batch to every database concurrently. Every database gets to finish, even if others fail.
+
+        :param batch: Batch to upload, a VectorBatch or a list of documents
+        :return: Database name -> {'ok', 'seconds', 'error'}
+        :raises UploadError: If any database failed, once all of them are done
+        """
+        batch = VectorBatch.of(batch)
+        results = await asyncio.gather(
+            *(self._upload_one(name, db, batch) for name, db in zip(self.names, self.databases))
+        )
+        self.last_upload = dict(zip(self.names, results))
+        failures = {name: result['error'] for name, result in self.last_upload.items() if not result['ok']}
+        if failures:
+            raise UploadError(failures)
+        return self.last_upload
 
     def clear(self):
         for db in self.databases:
             db.clear()
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(db.aclose() for db in self.databases))
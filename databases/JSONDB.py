@@ -1,6 +1,10 @@
+import asyncio
 import json
 import os
+import threading
+from typing import Union
 
+from databases.batch import VectorBatch
 from databases.database import Database
 
 
@@ -16,15 +20,24 @@ class JSONDB(Database):
                  filename: str = "data",
                  home_directory: str = os.getcwd()
                  ) -> None:
-        super().__init__()
+        # Every upload rewrites the whole file, running them one at a time keeps the last batch the one that is kept
+        super().__init__(upload_concurrency=1)
         self.filename = filename
         self.home_directory = home_directory
+        self._lock = threading.Lock()
 
-    async def upload(self, batch: list) -> None:
+    async def upload(self, batch: Union[VectorBatch, list]) -> None:
         """Method to dump list data into a JSON file
 
-        :param batch: List of documents to dump
+        :param batch: List of documents or VectorBatch to dump
         """
         directory_path = self.home_directory + self.filename
-        with open(directory_path, "w") as file:
-            json.dump(batch, file)
+        if isinstance(batch, VectorBatch):
+            batch = batch.to_documents()
+        await asyncio.to_thread(self._dump, directory_path, batch)
+
+    def _dump(self, directory_path: str, batch: list) -> None:
+        # Uploads not going through the loader can still overlap, only one thread writes the file at a time
+        with self._lock:
+            with open(directory_path, "w") as file:
+                json.dump(batch, file)
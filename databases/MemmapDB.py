@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import shutil
+from typing import Optional, Union
+
+import numpy as np
+
+from databases.NumpyDB import NumpyDB
+from databases.batch import VectorBatch
+from databases.filters import MetadataColumns
+from indexes.index import Index
+
+
+class MemmapDB(NumpyDB):
+    """On-disk vector store. Vectors are appended to fixed size float32 segment files that are memory-mapped,
+    so reopening an existing store reads nothing up front and queries run straight off the page cache.
+
+    Layout of directory/index_name:
+        manifest.json: Dimensions, metric, segment size and vector count.
+        segment-N.f32: Vectors of segment N, shape (segment_size, dimensions).
+        segment-N.ids: int64 ID of every row in segment N.
+        segment-N.pos: int64 byte offset of every row's metadata within metadata.jsonl.
+        metadata.jsonl: Append-only metadata and text, one JSON document per line.
+
+    The first filtered query reads metadata.jsonl once into in-memory columns, later uploads keep them current.
+
+    Args:
+        index_name (str): Name of the store, used as the folder name within directory.
+        directory (str): Directory the store is kept in.
+        metric (str): "cosine" or "ip" (inner product). Must match the metric of an existing store.
+        segment_size (int): Amount of vectors per segment file.
+        index (Index): Optional approximate index to search with instead of brute force. Vectors already in the store are added to it.
+        dimensions (int): Size of the vectors. If not specified it is taken from the model, which loads it.
+    """
+
+    def __init__(self,
+                 index_name: str = "pdf-flood",
+                 directory: str = os.getcwd() + "/vectors",
+                 metric: str = "cosine",
+                 segment_size: int = 65536,
+                 index: Optional[Index] = None,
+                 dimensions: Optional[int] = None
+                 ) -> None:
+        self.path = os.path.join(directory, index_name)
+        self.segment_size = segment_size
+        self._segments = []
+        self._metadata_file = None
+        super().__init__(index_name=index_name, metric=metric, initial_capacity=segment_size, index=index,
+                         dimensions=dimensions)
+        self.logger = logging.getLogger(__name__)
+
+    def create(self) -> None:
+        """Open the store, creating it if it does not exist. Existing segments are mapped, not read.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._close_files()
+        self._segments = []
+        self._columns = None
+        self._rows = {}
+        self._size = 0
+
+        manifest = self._read_manifest()
+        if manifest is None:
+            self._write_manifest()
+        else:
+            if manifest['dimensions'] != self.model_dimensions:
+                raise ValueError(f"Store at {self.path} has {manifest['dimensions']} dimensions, "
+                                 f"model has {self.model_dimensions}")
+            if manifest['metric'] != self.metric:
+                raise ValueError(f"Store at {self.path} uses metric {manifest['metric']}, not {self.metric}")
+            self.segment_size = manifest['segment_size']
+            self._size = manifest['count']
+
+        segments = -(-self._size // self.segment_size)
+        for number in range(segments):
+            self._segments.append(self._open_segment(number, mode="r+"))
+        for number, segment in enumerate(self._segments):
+            count = min(self.segment_size, self._size - number * self.segment_size)
+            first_row = number * self.segment_size
+            for offset, doc_id in enumerate(segment['ids'][:count].tolist()):
+                self._rows[doc_id] = first_row + offset
+
+        self._metadata_file = open(os.path.join(self.path, "metadata.jsonl"), "a+b")
+
+    def clear(self) -> None:
+        """Delete every segment and all metadata
+        """
+        with self._lock:
+            self._close_files()
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.create()
+            if self.index is not None:
+                self.index.reset()
+        self.logger.info(f"All vectors have been deleted")
+
+    def close(self) -> None:
+        """Flush and release every mapped segment, the metadata file and the shared encoder
+        """
+        self._close_files()
+        super().close()
+
+    def _close_files(self) -> None:
+        for segment in self._segments:
+            for array in segment.values():
+                array.flush()
+        self._segments = []
+        if self._metadata_file is not None:
+            self._metadata_file.close()
+            self._metadata_file = None
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.path, "manifest.json"), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self) -> None:
+        """Write the manifest to a temporary file first so a crash never leaves a half written one behind
+        """
+        manifest_path = os.path.join(self.path, "manifest.json")
+        with open(manifest_path + ".tmp", "w") as file:
+            json.dump({
+                'dimensions': self.model_dimensions,
+                'metric': self.metric,
+                'segment_size': self.segment_size,
+                'count': self._size
+            }, file)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _open_segment(self, number: int, mode: str) -> dict:
+        prefix = os.path.join(self.path, f"segment-{number}")
+        return {
+            'vectors': np.memmap(prefix + ".f32", dtype=np.float32, mode=mode,
+                                 shape=(self.segment_size, self.model_dimensions)),
+            'ids': np.memmap(prefix + ".ids", dtype=np.int64, mode=mode, shape=(self.segment_size,)),
+            'positions': np.memmap(prefix + ".pos", dtype=np.int64, mode=mode, shape=(self.segment_size,)),
+        }
+
+    def _locate(self, row: int) -> tuple:
+        number, offset = divmod(int(row), self.segment_size)
+        return self._segments[number], offset
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Every stored vector in insertion order. Copies when the store spans more than one segment.
+        """
+        views = [segment['vectors'][:count] for segment, count in self._segment_counts()]
+        if len(views) == 1:
+            return views[0]
+        if not views:
+            return np.empty((0, self.model_dimensions), dtype=np.float32)
+        return np.concatenate(views)
+
+    @property
+    def ids(self) -> np.ndarray:
+        """Every stored ID in insertion order
+        """
+        views = [segment['ids'][:count] for segment, count in self._segment_counts()]
+        return np.concatenate(views) if views else np.empty(0, dtype=np.int64)
+
+    def _segment_counts(self) -> list:
+        counts = []
+        for number, segment in enumerate(self._segments):
+            count = min(self.segment_size, self._size - number * self.segment_size)
+            if count <= 0:
+                break
+            counts.append((segment, count))
+        return counts
+
+    async def upload(self, batch: Union[VectorBatch, list]) -> None:
+        """Method to append vectors to the store. Documents with an ID that already exists are overwritten in place.
+
+        :param batch: Batch to upload, a VectorBatch or a list of documents
+        :return:
+        """
+        self.logger.info(f"Uploading {len(batch)} docs to MemmapDB")
+
+        batch = VectorBatch.of(batch)
+        vectors = self._prepare(batch.vectors)
+        lines = []
+        new_vectors = []
+        updated_rows = []
+        updated_vectors = []
+        with self._lock:
+            self._metadata_file.seek(0, os.SEEK_END)
+            position = self._metadata_file.tell()
+            touched = set()
+            for doc_id, metadata, text, vector in zip(batch.int_ids(), batch.metadata_dicts(), batch.texts(), vectors):
+                row = self._rows.get(doc_id)
+                if row is None:
+                    row = self._size
+                    if row // self.segment_size == len(self._segments):
+                        self._segments.append(self._open_segment(len(self._segments), mode="w+"))
+                    self._rows[doc_id] = row
+                    self._size += 1
+                    new_vectors.append(vector)
+                else:
+                    updated_rows.append(row)
+                    updated_vectors.append(vector)
+
+                line = json.dumps({
+                    'metadata': metadata,
+                    'text': text
+                }).encode() + b"\n"
+                lines.append(line)
+
+                segment, offset = self._locate(row)
+                segment['vectors'][offset] = vector
+                segment['ids'][offset] = doc_id
+                segment['positions'][offset] = position
+                position += len(line)
+                if self._columns is not None:
+                    self._columns.set(row, metadata)
+                touched.add(row // self.segment_size)
+
+            self._metadata_file.write(b"".join(lines))
+            self._metadata_file.flush()
+            for number in touched:
+                for array in self._segments[number].values():
+                    array.flush()
+            self._write_manifest()
+            self._update_index(new_vectors, updated_rows, updated_vectors)
+
+    def _blocks(self) -> list:
+        """Every mapped segment with the row number of its first vector, searched one at a time
+        """
+        return [(segment['vectors'][:count], number * self.segment_size)
+                for number, (segment, count) in enumerate(self._segment_counts())]
+
+    def lookup_ids(self, rows: np.ndarray) -> np.ndarray:
+        """IDs stored at the given rows
+        """
+        ids = np.empty(len(rows), dtype=np.int64)
+        for i, row in enumerate(rows):
+            segment, offset = self._locate(row)
+            ids[i] = segment['ids'][offset]
+        return ids
+
+    def fetch_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Vectors stored at the given rows
+        """
+        vectors = np.empty((len(rows), self.model_dimensions), dtype=np.float32)
+        for i, row in enumerate(rows):
+            segment, offset = self._locate(row)
+            vectors[i] = segment['vectors'][offset]
+        return vectors
+
+    def _metadata_columns(self) -> MetadataColumns:
+        """Metadata columns, built by reading metadata.jsonl front to back the first time they are needed.
+        Lines replaced by a later upload of the same ID are skipped. Called with the lock held.
+        """
+        if self._columns is None:
+            rows = {}
+            for number, (segment, count) in enumerate(self._segment_counts()):
+                first_row = number * self.segment_size
+                for offset, position in enumerate(segment['positions'][:count].tolist()):
+                    rows[position] = first_row + offset
+            columns = MetadataColumns(self._size)
+            self._metadata_file.seek(0)
+            position = 0
+            for line in self._metadata_file:
+                row = rows.get(position)
+                if row is not None:
+                    columns.set(row, json.loads(line)['metadata'])
+                position += len(line)
+            self._columns = columns
+        return self._columns
+
+    def _document(self, row: int) -> tuple:
+        """Metadata and text stored at the given row, read from the sidecar file
+        """
+        segment, offset = self._locate(row)
+        with self._lock:
+            self._metadata_file.seek(int(segment['positions'][offset]))
+            document = json.loads(self._metadata_file.readline())
+        return document['metadata'], document['text']
@@ -1,7 +1,8 @@
+import asyncio
 import logging
 import os
 import time
-from typing import Optional
+from typing import Optional, Union
 
 from dotenv import load_dotenv, find_dotenv
 from pymilvus import (
@@ -10,7 +11,9 @@ from pymilvus import (
     FieldSchema, CollectionSchema, DataType,
     Collection,
 )
+from databases.batch import VectorBatch
 from databases.database import Database
+from databases.filters import to_milvus
 
 
 class MilvusDB(Database):
@@ -129,23 +132,21 @@ class MilvusDB(Database):
         self.create()
         self.logger.info(f"All vectors have been deleted")
 
-    async def upload(self, batch: list) -> None:
+    async def upload(self, batch: Union[VectorBatch, list]) -> None:
         """Method to upload vectors to Milvus
 
-        :param batch: Batch to upload
+        :param batch: Batch to upload, a VectorBatch or a list of documents
         :return:
         """
         self.logger.info(f"Uploading {len(batch)} docs to Milvus")
 
-        start_time = time.time()
         batch = self.preprocess(batch)
 
-        self.collection.insert(batch)
-
-        self.logger.info(f"Uploaded to Milvus in {time.time() - start_time}")
+        await asyncio.to_thread(self.collection.insert, batch)
 
     def query(self, text: Optional[str], top_k: int = 5, include_metadata: bool = True,
-              include_vectors: bool = False, postprocess: bool = False, pre_vectorized: bool = False):
+              include_vectors: bool = False, postprocess: bool = False, pre_vectorized: bool = False,
+              query_filter: any = None):
         """Method to query Milvus database
 
         :param postprocess: Whether to process the results or not
@@ -153,45 +154,89 @@ class MilvusDB(Database):
         :param top_k: How many results to return
         :param include_metadata: Whether to include payload within the response to the search
         :param include_vectors: Whether to include vectors within the response to the search
+        :param query_filter: Filter or dict on the metadata, compiled to a Milvus expr on the metadata JSON field
         :return:
         """
-        output_fields = ["id"]
-        if include_metadata:
-            output_fields.append("metadata")
-            output_fields.append("text")
-        if include_vectors:
-            output_fields.append("embedding")
-
         results = self.collection.search(
             data=[text if pre_vectorized else self.encode(text)],
             limit=top_k,
-            output_fields=output_fields,
+            output_fields=self._output_fields(include_metadata, include_vectors),
+            anns_field="embedding",
+            param={},
+            expr=to_milvus(query_filter)
+        )
+        return self.postprocess(results[0]) if postprocess else results[0]
+
+    async def _asearch(self, vector: list, top_k: int = 5, postprocess: bool = False, query_filter: any = None):
+        """Search without blocking the event loop. The request is sent right away over Milvus' gRPC channel, but
+        pymilvus has no asyncio future, so a thread of the query thread pool waits for each response. At most
+        query_threads searches are in flight at once, the rest queue for a thread.
+
+        :param vector: Query vector
+        :param top_k: How many results to return
+        :param postprocess: Whether to process the results or not
+        :param query_filter: Filter or dict on the metadata
+        :return: Same as query
+        """
+        future = self.collection.search(
+            data=[vector],
+            limit=top_k,
+            output_fields=self._output_fields(),
             anns_field="embedding",
             param={},
-            expr=None
+            expr=to_milvus(query_filter),
+            _async=True
         )
+        results = await self._run_blocking(future.result)
         return self.postprocess(results[0]) if postprocess else results[0]
 
+    def _search_batch(self, vectors: list, top_k: int = 5, postprocess: bool = False, query_filter: any = None) -> list:
+        """Search several vectors in a single Milvus request
+
+        :param vectors: Query vectors
+        :param top_k: How many results to return per query
+        :param postprocess: Whether to process the results or not
+        :param query_filter: Filter or dict on the metadata, applied to every query
+        :return: Results in the same order as vectors
+        """
+        results = self.collection.search(
+            data=list(vectors),
+            limit=top_k,
+            output_fields=self._output_fields(),
+            anns_field="embedding",
+            param={},
+            expr=to_milvus(query_filter)
+        )
+        return [self.postprocess(hits) if postprocess else hits for hits in results]
+
+    @staticmethod
+    def _output_fields(include_metadata: bool = True, include_vectors: bool = False) -> list:
+        output_fields = ["id"]
+        if include_metadata:
+            output_fields.append("metadata")
+            output_fields.append("text")
+        if include_vectors:
+            output_fields.append("embedding")
+        return output_fields
+
     def preprocess(self, batch):
-        """Method to be used within the Milvus class in order to change the format of the batch to be uploaded
+        """Method to be used within the Milvus class in order to change the format of the batch to be uploaded.
+        The batch is left untouched.
 
-        :param batch: Batch to be uploaded
+        :param batch: Batch to be uploaded, a VectorBatch or a list of documents
         :return:
         """
-        ids = []
-        vectors = []
-        metadata = []
-        text = []
-        for doc in batch:
-            ids.append(int(doc['id']))
-            vectors.append(doc['values'])
-            text.append(doc['metadata']['text'])
-            del doc['metadata']['text']
-            del doc['metadata']['created_at']
-            metadata.append(doc['metadata'])
+        batch = VectorBatch.of(batch)
+        # created_at is kept in the metadata so it can be filtered on
+        columns = [
+            batch.int_ids(),
+            batch.vector_lists(),
+            batch.metadata_dicts(),
+            batch.texts()
+        ]
         self.logger.info("Milvus preprocessing complete")
 
-        return [ids, vectors, metadata, text]
+        return columns
 
     def postprocess(self, query, include_metadata: bool = True, include_text: bool = True):
         """Method to change the format of the query results
@@ -206,7 +251,8 @@ class MilvusDB(Database):
             results.append({
                 'id': doc.id,
                 'score': doc.distance,
-                'metadata': doc.entity.metadata if include_metadata else None,
+                'metadata': {key: value for key, value in doc.entity.metadata.items() if key != 'created_at'}
+                if include_metadata else None,
                 'text': doc.entity.text if include_text else None,
             })
         self.logger.info("Milvus postprocessing complete")
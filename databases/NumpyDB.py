@@ -0,0 +1,331 @@
+import logging
+import threading
+from typing import Optional, Union
+
+import numpy as np
+
+from databases.batch import VectorBatch
+from databases.database import Database
+from databases.filters import MetadataColumns, as_filter
+from indexes.index import Index, top_k_indices
+
+
+class NumpyDB(Database):
+    """In-process brute force vector store backed by a NumPy matrix. Exact search, used as a baseline for recall
+    measurements and for running benchmarks without any external service.
+
+    Args:
+        index_name (str): Name of the store, only used for logging.
+        metric (str): "cosine" or "ip" (inner product). Vectors are normalized on upload for cosine.
+        initial_capacity (int): Amount of vectors to preallocate room for. The matrix doubles whenever it fills up.
+        index (Index): Optional approximate index (e.g. HNSWIndex) to search with instead of brute force. Vectors already in the store are added to it.
+        dimensions (int): Size of the vectors. If not specified it is taken from the model, which loads it.
+    """
+
+    def __init__(self,
+                 index_name: str = "pdf-flood",
+                 metric: str = "cosine",
+                 initial_capacity: int = 1024,
+                 index: Optional[Index] = None,
+                 dimensions: Optional[int] = None
+                 ) -> None:
+        super().__init__()
+        self._dimensions = dimensions
+        if metric not in ("cosine", "ip"):
+            raise ValueError(f"Unsupported metric {metric}, use 'cosine' or 'ip'")
+        self.logger = logging.getLogger(__name__)
+        self.index_name = index_name
+        self.metric = metric
+        self.initial_capacity = initial_capacity
+        self.index = index
+        self._lock = threading.Lock()
+        self.create()
+        self._sync_index()
+
+    @property
+    def model_dimensions(self) -> int:
+        if self._dimensions is None:
+            self._dimensions = self.encoder.get_sentence_embedding_dimension()
+        return self._dimensions
+
+    def create(self) -> None:
+        """Allocate an empty store
+        """
+        self._vectors = np.empty((self.initial_capacity, self.model_dimensions), dtype=np.float32)
+        self._ids = np.empty(self.initial_capacity, dtype=np.int64)
+        self._metadata = []
+        self._text = []
+        self._columns = MetadataColumns(self.initial_capacity)
+        self._rows = {}
+        self._size = 0
+
+    def clear(self) -> None:
+        """Delete all vectors in the store
+        """
+        with self._lock:
+            self.create()
+            if self.index is not None:
+                self.index.reset()
+        self.logger.info(f"All vectors have been deleted")
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """View of every stored vector, in insertion order
+        """
+        return self._vectors[:self._size]
+
+    @property
+    def ids(self) -> np.ndarray:
+        """View of every stored ID, in insertion order
+        """
+        return self._ids[:self._size]
+
+    def _reserve(self, amount: int) -> None:
+        """Grow the preallocated arrays so at least amount more vectors fit
+        """
+        needed = self._size + amount
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        vectors = np.empty((capacity, self.model_dimensions), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._vectors, self._ids = vectors, ids
+
+    def _sync_index(self) -> None:
+        """Add any stored vectors the index does not have yet, e.g. after reopening a store with a fresh index
+        """
+        if self.index is None or len(self.index) >= self._size:
+            return
+        self.logger.info(f"Adding {self._size - len(self.index)} stored vectors to the index")
+        self.index.add(self.vectors[len(self.index):])
+
+    def _update_index(self, new_vectors: list, updated_rows: list, updated_vectors: list) -> None:
+        """Mirror an upload into the index. New vectors must be in the same order their rows were assigned.
+        """
+        if self.index is None:
+            return
+        if updated_rows:
+            self.index.update(np.array(updated_rows), np.array(updated_vectors))
+        if new_vectors:
+            self.index.add(np.array(new_vectors))
+
+    def _prepare(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    async def upload(self, batch: Union[VectorBatch, list]) -> None:
+        """Method to add vectors to the store. Documents with an ID that already exists are overwritten.
+
+        :param batch: Batch to upload, a VectorBatch or a list of documents
+        :return:
+        """
+        self.logger.info(f"Uploading {len(batch)} docs to NumpyDB")
+
+        batch = VectorBatch.of(batch)
+        vectors = self._prepare(batch.vectors)
+        new_vectors = []
+        updated_rows = []
+        updated_vectors = []
+        with self._lock:
+            self._reserve(len(batch))
+            for doc_id, metadata, text, vector in zip(batch.int_ids(), batch.metadata_dicts(), batch.texts(), vectors):
+                row = self._rows.get(doc_id)
+                if row is None:
+                    row = self._size
+                    self._rows[doc_id] = row
+                    self._metadata.append(metadata)
+                    self._text.append(text)
+                    self._size += 1
+                    new_vectors.append(vector)
+                else:
+                    self._metadata[row] = metadata
+                    self._text[row] = text
+                    updated_rows.append(row)
+                    updated_vectors.append(vector)
+                self._columns.set(row, metadata)
+                self._vectors[row] = vector
+                self._ids[row] = doc_id
+            self._update_index(new_vectors, updated_rows, updated_vectors)
+
+    def search(self, vector, top_k: int = 5, mask: Optional[np.ndarray] = None) -> tuple:
+        """Top_k search, through the index if there is one, otherwise exact over every stored vector
+
+        :param vector: Query vector
+        :param top_k: How many results to return
+        :param mask: Bool per stored row, only rows set to True are searched. Masked searches are always exact.
+        :return: Tuple of (rows, scores), best first
+        """
+        if self.index is not None and mask is None:
+            return self.index.search(self._prepare(vector), top_k, vectors=self)
+        return self.exact_search(vector, top_k, mask)
+
+    def search_batch(self, vectors, top_k: int = 5, mask: Optional[np.ndarray] = None) -> list:
+        """Top_k search for several queries, through the index if there is one, otherwise exact
+
+        :param vectors: Query vectors
+        :param top_k: How many results to return per query
+        :param mask: Bool per stored row, only rows set to True are searched. Masked searches are always exact.
+        :return: List of (rows, scores) tuples, one per query
+        """
+        if self.index is not None and mask is None:
+            return [self.index.search(query, top_k, vectors=self) for query in self._prepare(vectors)]
+        return self.exact_search_batch(vectors, top_k, mask)
+
+    def exact_search(self, vector, top_k: int = 5, mask: Optional[np.ndarray] = None) -> tuple:
+        """Exact top_k search over every stored vector, ignoring any index
+
+        :param vector: Query vector
+        :param top_k: How many results to return
+        :param mask: Bool per stored row, only rows set to True are searched
+        :return: Tuple of (rows, scores), best first
+        """
+        return self.exact_search_batch([vector], top_k, mask)[0]
+
+    def exact_search_batch(self, vectors, top_k: int = 5, mask: Optional[np.ndarray] = None) -> list:
+        """Exact top_k search for several queries with one matrix product per block of stored vectors
+
+        :param vectors: Query vectors
+        :param top_k: How many results to return per query
+        :param mask: Bool per stored row, only rows set to True are searched
+        :return: List of (rows, scores) tuples, one per query
+        """
+        queries = self._prepare(vectors).reshape(-1, self.model_dimensions)
+        rows = [[] for _ in queries]
+        scores = [[] for _ in queries]
+        for block, first_row in self._blocks():
+            if mask is None:
+                selected = None
+            else:
+                selected = np.flatnonzero(mask[first_row:first_row + len(block)])
+                if not len(selected):
+                    continue
+                block = block[selected]
+            block_scores = queries @ block.T
+            for i, query_scores in enumerate(block_scores):
+                best = top_k_indices(query_scores, top_k)
+                rows[i].append((best if selected is None else selected[best]) + first_row)
+                scores[i].append(query_scores[best])
+
+        results = []
+        for query_rows, query_scores in zip(rows, scores):
+            if not query_rows:
+                results.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+            elif len(query_rows) == 1:
+                results.append((query_rows[0], query_scores[0]))
+            else:
+                query_rows = np.concatenate(query_rows)
+                query_scores = np.concatenate(query_scores)
+                best = top_k_indices(query_scores, top_k)
+                results.append((query_rows[best], query_scores[best]))
+        return results
+
+    def _blocks(self) -> list:
+        """Contiguous blocks of stored vectors with the row number of their first vector
+        """
+        return [(self.vectors, 0)]
+
+    def lookup_ids(self, rows: np.ndarray) -> np.ndarray:
+        """IDs stored at the given rows
+        """
+        return self._ids[rows]
+
+    def fetch_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Vectors stored at the given rows
+        """
+        return self._vectors[rows]
+
+    def _document(self, row: int) -> tuple:
+        """Metadata and text stored at the given row
+        """
+        return self._metadata[row], self._text[row]
+
+    def _metadata_columns(self) -> MetadataColumns:
+        """Metadata of every stored row as columns, called with the lock held
+        """
+        return self._columns
+
+    def filter_mask(self, query_filter) -> Optional[np.ndarray]:
+        """Bool per stored row of whether its metadata passes query_filter, None if there is no filter.
+        Evaluated with array comparisons over the metadata columns, no document is read.
+
+        :param query_filter: Filter or dict on the metadata
+        :return: 1D bool array or None
+        """
+        query_filter = as_filter(query_filter)
+        if query_filter is None:
+            return None
+        with self._lock:
+            return query_filter.mask(self._metadata_columns())
+
+    def query(self, text: Optional[str], top_k: int = 5, include_metadata: bool = True,
+              include_vectors: bool = False, postprocess: bool = False, pre_vectorized: bool = False,
+              query_filter=None):
+        """Method to query the store
+
+        :param text: Text to query with, or a vector if pre_vectorized
+        :param top_k: How many results to return
+        :param include_metadata: Whether to include metadata within the processed results
+        :param include_vectors: Whether to include vectors within the raw results
+        :param postprocess: Whether to process the results or not
+        :param pre_vectorized: Whether text is already a vector
+        :param query_filter: Filter or dict on the metadata. Filtered queries are exact over the matching rows.
+        :return: Dict of ids, scores and rows (plus vectors if requested), or a list of documents if postprocessed
+        """
+        rows, scores = self.search(text if pre_vectorized else self.encode(text), top_k, self.filter_mask(query_filter))
+        result = self._result(rows, scores, include_vectors)
+        return self.postprocess(result, include_metadata=include_metadata) if postprocess else result
+
+    def _search_batch(self, vectors: list, top_k: int = 5, postprocess: bool = False, query_filter=None) -> list:
+        """Search several vectors with a single matrix product
+
+        :param vectors: Query vectors
+        :param top_k: How many results to return per query
+        :param postprocess: Whether to process the results or not
+        :param query_filter: Filter or dict on the metadata, applied to every query
+        :return: Results in the same order as vectors
+        """
+        mask = self.filter_mask(query_filter)
+        results = [self._result(rows, scores) for rows, scores in self.search_batch(vectors, top_k, mask)]
+        return [self.postprocess(result) for result in results] if postprocess else results
+
+    def _result(self, rows: np.ndarray, scores: np.ndarray, include_vectors: bool = False) -> dict:
+        result = {
+            'ids': self.lookup_ids(rows),
+            'scores': scores,
+            'rows': rows,
+        }
+        if include_vectors:
+            result['vectors'] = self.fetch_vectors(rows)
+        return result
+
+    def postprocess(self, query, include_metadata: bool = True, include_text: bool = True):
+        """Method to change the format of the query results
+
+        :param include_text: Whether to include the text of the document in the results
+        :param include_metadata: Whether to include the metadata of the document in the results
+        :param query: Query results
+        :return:
+        """
+        results = []
+        for doc_id, score, row in zip(query['ids'], query['scores'], query['rows']):
+            metadata, text = self._document(row)
+            if include_metadata:
+                metadata = {key: value for key, value in metadata.items() if key != 'created_at'}
+            results.append({
+                'id': int(doc_id),
+                'score': float(score),
+                'metadata': metadata if include_metadata else None,
+                'text': text if include_text else None,
+            })
+        self.logger.info("NumpyDB postprocessing complete")
+        return results
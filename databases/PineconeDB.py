@@ -1,12 +1,14 @@
+import asyncio
 import logging
 import os
-import time
-from typing import Optional
+from typing import Optional, Union
 
 import pinecone
 from dotenv import load_dotenv, find_dotenv
 
+from databases.batch import VectorBatch
 from databases.database import Database
+from databases.filters import DAYS_SUFFIX, to_pinecone, with_date_numbers
 
 
 class PineconeDB(Database):
@@ -34,6 +36,7 @@ class PineconeDB(Database):
         self.logger = logging.getLogger(__name__)
         self.index_name = index_name
         self.default_namespace = default_namespace
+        self.GRPC = GRPC
 
         _ = load_dotenv(find_dotenv())
         if api_key is None:
@@ -88,37 +91,92 @@ class PineconeDB(Database):
         )
         self.logger.info(f"All vectors in namespace {namespace} have been deleted")
 
-    async def upload(self, batch: list, namespace: str = None) -> None:
+    async def upload(self, batch: Union[VectorBatch, list], namespace: str = None) -> None:
         """Method to upload vectors to pinecone
 
-        :param batch: Batch to upload
+        :param batch: Batch to upload, a VectorBatch or a list of documents
         :param namespace: Namespace to upload vectors under
         :return:
         """
         self.logger.info(f"Uploading {len(batch)} docs to pinecone")
-        start_time = time.time()
         if namespace is None:
             namespace = self.default_namespace
-        self.index.upsert(
-            vectors=batch,
+        if isinstance(batch, VectorBatch):
+            batch = batch.to_documents()
+        # Dates are also stored as numbers, Pinecone can only filter ranges of numbers
+        documents = [{**doc, 'metadata': with_date_numbers(doc['metadata'])} for doc in batch]
+        await asyncio.to_thread(
+            self.index.upsert,
+            vectors=documents,
             namespace=namespace,
             async_req=False,
             show_progress=False,
             batch_size=None  # What is the upper limit? Find the absolute max before the API rejects due to 2MB+ uploads
         )
 
-        self.logger.info(f"Uploaded to pinecone in {time.time() - start_time}")
-
-    def query(self, text: Optional[str], top_k: int = 5, include_values: bool = False, include_metadata: bool = True, postprocess: bool = False, pre_vectorized=False):
+    def query(self, text: Optional[str], top_k: int = 5, include_values: bool = False, include_metadata: bool = True, postprocess: bool = False, pre_vectorized=False,
+              query_filter: any = None):
         result = self.index.query(
             vector=text if pre_vectorized else self.encode(text),
             top_k=top_k,
             namespace=self.default_namespace,
             include_metadata=include_metadata,
-            include_values=include_values
+            include_values=include_values,
+            filter=to_pinecone(query_filter)
+        )
+        return self.postprocess(result) if postprocess else result
+
+    async def _asearch(self, vector: list, top_k: int = 5, postprocess: bool = False, query_filter: any = None):
+        """Search without blocking the event loop. The Pinecone client is thread based: the request runs on one of
+        the index's pool_threads and a thread of the query thread pool waits for it. At most
+        min(pool_threads, query_threads) searches are in flight at once, the rest queue for a thread.
+
+        :param vector: Query vector
+        :param top_k: How many results to return
+        :param postprocess: Whether to process the results or not
+        :param query_filter: Filter or dict on the metadata
+        :return: Same as query
+        """
+        if self.GRPC:
+            return await super()._asearch(vector, top_k=top_k, postprocess=postprocess, query_filter=query_filter)
+        request = self.index.query(
+            vector=list(vector),
+            top_k=top_k,
+            namespace=self.default_namespace,
+            include_metadata=True,
+            filter=to_pinecone(query_filter),
+            async_req=True
         )
+        result = await self._run_blocking(request.get)
         return self.postprocess(result) if postprocess else result
 
+    def _search_batch(self, vectors: list, top_k: int = 5, postprocess: bool = False, query_filter: any = None) -> list:
+        """Search several vectors at once. Pinecone takes one vector per query, so every query is sent
+        without waiting on the others through the index's thread pool, then collected in order.
+
+        :param vectors: Query vectors
+        :param top_k: How many results to return per query
+        :param postprocess: Whether to process the results or not
+        :param query_filter: Filter or dict on the metadata, applied to every query
+        :return: Results in the same order as vectors
+        """
+        if self.GRPC:
+            return super()._search_batch(vectors, top_k=top_k, postprocess=postprocess, query_filter=query_filter)
+        metadata_filter = to_pinecone(query_filter)
+        pending = [
+            self.index.query(
+                vector=list(vector),
+                top_k=top_k,
+                namespace=self.default_namespace,
+                include_metadata=True,
+                filter=metadata_filter,
+                async_req=True
+            )
+            for vector in vectors
+        ]
+        results = [request.get() for request in pending]
+        return [self.postprocess(result) if postprocess else result for result in results]
+
     def postprocess(self, query, include_metadata: bool = True, include_text: bool = True):
         """Method to change the format of the query results
 
@@ -130,14 +188,14 @@ class PineconeDB(Database):
 
         results = []
         for doc in query['matches']:
-            txt = doc['metadata']['text']
-            del doc['metadata']['text']
-            del doc['metadata']['created_at']
+            metadata = doc['metadata']
             results.append({
                 'id': doc['id'],
                 'score': doc['score'],
-                'metadata': doc['metadata'] if include_metadata else None,
-                'text': txt if include_text else None,
+                'metadata': {key: value for key, value in metadata.items()
+                             if key not in ('text', 'created_at', 'created_at' + DAYS_SUFFIX)}
+                if include_metadata else None,
+                'text': metadata['text'] if include_text else None,
             })
         self.logger.info("Pinecone postprocessing complete")
         return results
@@ -1,13 +1,17 @@
+import asyncio
 import logging
 import os
+import threading
 import time
-from typing import Optional
+from typing import Optional, Union
 
 from dotenv import load_dotenv, find_dotenv
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 from qdrant_client.http.models import Distance
 
+from databases.batch import VectorBatch
 from databases.database import Database
+from databases.filters import FILTER_FIELDS, as_filter, to_qdrant
 
 class QDrantDB(Database):
     """ QDrant Database Class for interacting with a defined QDrant collection
@@ -40,6 +44,11 @@ class QDrantDB(Database):
             url=url,
             prefer_grpc=True
         )
+        self._api_key = api_key
+        self._url = url
+        self._async_client = None
+        self._indexed_fields = set()
+        self._indexed_fields_lock = threading.Lock()
         if ensure_exists:
             self.create()
 
@@ -72,6 +81,40 @@ class QDrantDB(Database):
             logging.info("Created new QDrant Collection")
         except Exception as e:
             logging.info(f"Error, there is likely already an existing QDrant database with that name. See error:{e}")
+        self.create_payload_indexes(FILTER_FIELDS)
+
+    def create_payload_indexes(self, fields: dict) -> None:
+        """Index metadata fields so filters on them are resolved by QDrant's payload index instead of a scan.
+        Fields already indexed by this object are skipped.
+
+        :param fields: Metadata field -> "keyword", "integer", "float", "bool" or "datetime"
+        :return:
+        """
+        with self._indexed_fields_lock:
+            for field, field_type in fields.items():
+                if field in self._indexed_fields:
+                    continue
+                try:
+                    self.client.create_payload_index(
+                        collection_name=self.index_name,
+                        field_name=f"metadata.{field}",
+                        field_schema=models.PayloadSchemaType(field_type)
+                    )
+                    logging.info(f"Created {field_type} payload index on metadata.{field}")
+                except Exception as e:
+                    logging.warning(f"Could not create payload index on metadata.{field}. See error: {e}")
+                self._indexed_fields.add(field)
+
+    def _compile_filter(self, query_filter: any):
+        """QDrant Filter for query_filter, indexing any field that is filtered on for the first time
+        """
+        query_filter = as_filter(query_filter)
+        if query_filter is None:
+            return None
+        fields = query_filter.field_types()
+        if not fields.keys() <= self._indexed_fields:
+            self.create_payload_indexes(fields)
+        return to_qdrant(query_filter)
 
     def clear(self) -> None:
         """Delete all vectors in a collection. The fastest way to do this is by deleting and recreating the collection
@@ -83,33 +126,32 @@ class QDrantDB(Database):
         )
         time.sleep(1)
 
+        self._indexed_fields.clear()
         self.create()
         logging.info(f"All vectors have been deleted")
 
-    async def upload(self, batch: list) -> None:
+    async def upload(self, batch: Union[VectorBatch, list]) -> None:
         """Method to upload vectors to QDrant
 
-        :param batch: Batch to upload
+        :param batch: Batch to upload, a VectorBatch or a list of documents
         :return:
         """
         logging.info(f"Uploading {len(batch)} docs to QDrant")
 
-        start_time = time.time()
         batch = self.preprocess(batch)
-        self.client.upsert(
+        await asyncio.to_thread(
+            self.client.upsert,
             collection_name=self.index_name,
             points=batch
         )
 
-        logging.info(f"Uploaded to QDrant in {time.time() - start_time}")
-
     def query(self, text: Optional[str], top_k: int = 5, query_filter: any = None, include_metadata: bool = True,
               include_vectors: bool = False, postprocess: bool = False, pre_vectorized=False):
         """Method to query QDrant database
 
         :param text: Text to query with
         :param top_k: How many results to return
-        :param query_filter: Filter associated with the search, ignore this part until properly implemented
+        :param query_filter: Filter or dict on the metadata, compiled to a QDrant Filter. Filtered fields get a payload index.
         :param include_metadata: Whether to include payload within the response to the search
         :param include_vectors: Whether to include vectors within the response to the search
         :return:
@@ -117,33 +159,106 @@ class QDrantDB(Database):
         result = self.client.search(
             collection_name=self.index_name,
             query_vector=text if pre_vectorized else self.encode(text),
+            query_filter=self._compile_filter(query_filter),
             limit=top_k,
             with_payload=include_metadata,
             with_vectors=include_vectors
         )
         return self.postprocess(result, include_metadata=include_metadata) if postprocess else result
 
+    async def _asearch(self, vector: list, top_k: int = 5, postprocess: bool = False, query_filter: any = None):
+        """Search through the async QDrant client, all queries share its gRPC channel
+
+        :param vector: Query vector
+        :param top_k: How many results to return
+        :param postprocess: Whether to process the results or not
+        :param query_filter: Filter or dict on the metadata
+        :return: Same as query
+        """
+        if query_filter is not None and not as_filter(query_filter).field_types().keys() <= self._indexed_fields:
+            # Index creation uses the blocking client
+            compiled = await self._run_blocking(self._compile_filter, query_filter)
+        else:
+            compiled = to_qdrant(query_filter)
+        result = await self._get_async_client().search(
+            collection_name=self.index_name,
+            query_vector=list(vector),
+            query_filter=compiled,
+            limit=top_k,
+            with_payload=True
+        )
+        return self.postprocess(result) if postprocess else result
+
+    def _get_async_client(self) -> AsyncQdrantClient:
+        """Async client of the running event loop. gRPC channels can't be shared between loops, the client of a
+        previous loop is closed when it is replaced.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client[0] is not loop:
+            if self._async_client is not None:
+                self._discard_async_client(*self._async_client)
+            self._async_client = (loop, AsyncQdrantClient(
+                api_key=self._api_key,
+                url=self._url,
+                prefer_grpc=True
+            ))
+        return self._async_client[1]
+
+    @staticmethod
+    def _discard_async_client(loop: asyncio.AbstractEventLoop, client: AsyncQdrantClient) -> None:
+        # Its channel can only be closed on the loop it was made on
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+        else:
+            logging.warning("QDrant async client of a finished event loop was left open, "
+                            "await aclose() before the loop ends")
+
+    async def aclose(self) -> None:
+        """Close the async client of the running event loop
+        """
+        if self._async_client is not None and self._async_client[0] is asyncio.get_running_loop():
+            client = self._async_client[1]
+            self._async_client = None
+            await client.close()
+
+    def _search_batch(self, vectors: list, top_k: int = 5, postprocess: bool = False, query_filter: any = None) -> list:
+        """Search several vectors in a single QDrant request
+
+        :param vectors: Query vectors
+        :param top_k: How many results to return per query
+        :param postprocess: Whether to process the results or not
+        :param query_filter: Filter or dict on the metadata, applied to every query
+        :return: Results in the same order as vectors
+        """
+        compiled = self._compile_filter(query_filter)
+        results = self.client.search_batch(
+            collection_name=self.index_name,
+            requests=[
+                models.SearchRequest(vector=list(vector), filter=compiled, limit=top_k, with_payload=True)
+                for vector in vectors
+            ]
+        )
+        return [self.postprocess(result) if postprocess else result for result in results]
+
     def preprocess(self, batch):
         """Method to be used within the QDrantDB class in order to process data via the other format
 
-        :param batch:
+        :param batch: Batch to be uploaded, a VectorBatch or a list of documents. The batch is left untouched.
         :return:
         """
-        ids = []
-        vectors = []
-        payloads = []
-        for doc in batch:
-            ids.append(int(doc['id']))
-            vectors.append(doc['values'])
-            payloads.append({
-                "metadata": doc['metadata'],
-                "chunk_part": doc['metadata']['chunk'],
-                "document_id": doc['metadata']['filename']
-            })
+        batch = VectorBatch.of(batch)
+        payloads = [
+            {
+                "metadata": metadata,
+                "chunk_part": metadata.get('chunk', 0),
+                "document_id": metadata['filename']
+            }
+            for metadata in batch.metadata_dicts(include_text=True)
+        ]
         logging.info("QDrant preprocessing complete")
         return models.Batch.construct(
-            ids=ids,
-            vectors=vectors,
+            ids=batch.int_ids(),
+            vectors=batch.vector_lists(),
             payloads=payloads
         )
 
@@ -177,14 +292,13 @@ class QDrantDB(Database):
         """
         results = []
         for doc in query:
-            txt = doc.payload['metadata']['text']
-            del doc.payload['metadata']['text']
-            del doc.payload['metadata']['created_at']
+            metadata = doc.payload['metadata']
             results.append({
                 'id': doc.id,
                 'score': doc.score,
-                'metadata': doc.payload['metadata'] if include_metadata else None,
-                'text': txt if include_text else None,
+                'metadata': {key: value for key, value in metadata.items() if key not in ('text', 'created_at')}
+                if include_metadata else None,
+                'text': metadata['text'] if include_text else None,
             })
         self.logger.info("QDrant postprocessing complete")
         return results
@@ -0,0 +1,331 @@
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from databases.AllDB import AllDB
+
+# Hedges that can be saved up in the budget
+_HEDGE_BURST = 10.0
+
+
+class RecentLatency:
+    """Sliding window of the latest latencies of one database
+
+    Args:
+        window (int): Amount of latencies kept, older ones are forgotten.
+    """
+
+    def __init__(self,
+                 window: int = 200
+                 ) -> None:
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.last_recorded = 0.0
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self.last_recorded = time.monotonic()
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Percentile of the window in seconds, None while it is empty
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+        if not latencies:
+            return None
+        return float(np.percentile(latencies, percentile))
+
+
+class RouterDB(AllDB):
+    """Serves queries from several databases holding the same documents. Each query goes to the database with the
+    lowest recent p95 latency. If it hasn't answered once its recent hedge_percentile latency has passed, the same
+    query is sent to the next best database and whichever answers first wins, so an occasional multi-second stall
+    of one database doesn't become the caller's latency. Failed queries are retried on the next database.
+    Uploads and clear go to every database, as with AllDB.
+
+    Databases with fewer than min_samples recent latencies, or none in the last stale_after seconds, are ranked
+    first so their numbers stay current after they recover.
+
+    Args:
+        databases (list): Databases to route between. Defaults to Milvus, Pinecone and QDrant.
+        window (int): Amount of recent latencies kept per database.
+        hedge_percentile (float): Latency percentile of the chosen database after which a hedged request is sent.
+        max_hedges (int): Max amount of extra requests per query sent because of slowness, 0 disables hedging.
+        hedge_budget (float): Max share of queries that get hedged. Every query adds this much to a bucket of up to 10 hedges, so when every database slows down at once hedging can't pile on more load.
+        min_hedge_delay (float): Seconds to wait at least before hedging, keeps fast databases from being hedged constantly.
+        initial_hedge_delay (float): Seconds to wait before hedging while the chosen database has fewer than min_samples latencies.
+        min_samples (int): Amount of latencies needed before a database's percentiles are trusted.
+        stale_after (float): Seconds after which a database without new latencies is tried again first.
+        failure_penalty (float): Latency in seconds recorded for a failed query, pushes failing databases down the ranking.
+    """
+
+    def __init__(self,
+                 databases: Optional[list] = None,
+                 window: int = 200,
+                 hedge_percentile: float = 95,
+                 max_hedges: int = 1,
+                 hedge_budget: float = 0.1,
+                 min_hedge_delay: float = 0.002,
+                 initial_hedge_delay: float = 0.25,
+                 min_samples: int = 20,
+                 stale_after: float = 30.0,
+                 failure_penalty: float = 5.0
+                 ) -> None:
+        super().__init__(databases)
+        self.logger = logging.getLogger(__name__)
+        self.hedge_percentile = hedge_percentile
+        self.max_hedges = max_hedges
+        self.hedge_budget = hedge_budget
+        self.min_hedge_delay = min_hedge_delay
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_samples = min_samples
+        self.stale_after = stale_after
+        self.failure_penalty = failure_penalty
+
+        self._by_name = dict(zip(self.names, self.databases))
+        self.latency = {name: RecentLatency(window) for name in self.names}
+        # Database name -> {'primary', 'hedges', 'throttled', 'wins', 'errors'}, throttled counts hedges the budget refused
+        self.route_stats = {name: {'primary': 0, 'hedges': 0, 'throttled': 0, 'wins': 0, 'errors': 0}
+                            for name in self.names}
+        self._stats_lock = threading.Lock()
+        self._hedge_tokens = _HEDGE_BURST
+
+    def ranked(self) -> list:
+        """Names of the databases in the order queries should try them, best first
+        """
+        now = time.monotonic()
+
+        def rank(name: str) -> tuple:
+            latency = self.latency[name]
+            if len(latency) < self.min_samples or now - latency.last_recorded > self.stale_after:
+                return 0, len(latency)
+            return 1, latency.percentile(95)
+
+        return sorted(self.names, key=rank)
+
+    def hedge_delay(self, name: str) -> float:
+        """Seconds to wait for a database before sending the same query to the next one
+        """
+        latency = self.latency[name]
+        if len(latency) < self.min_samples:
+            return self.initial_hedge_delay
+        return max(self.min_hedge_delay, latency.percentile(self.hedge_percentile))
+
+    def _count(self, name: str, event: str) -> None:
+        with self._stats_lock:
+            self.route_stats[name][event] += 1
+
+    def _start_query(self, name: str) -> None:
+        with self._stats_lock:
+            self.route_stats[name]['primary'] += 1
+            self._hedge_tokens = min(_HEDGE_BURST, self._hedge_tokens + self.hedge_budget)
+
+    def _allow_hedge(self, name: str) -> bool:
+        """Take a hedge out of the budget, counting a throttled hedge against name if there is none left
+        """
+        with self._stats_lock:
+            if self._hedge_tokens >= 1:
+                self._hedge_tokens -= 1
+                return True
+            self.route_stats[name]['throttled'] += 1
+            return False
+
+    def _query_one(self, name: str, vector: list, top_k: int, postprocess: bool, query_filter=None):
+        start_time = time.perf_counter()
+        try:
+            result = self._by_name[name].query(vector, top_k=top_k, postprocess=postprocess, pre_vectorized=True,
+                                               query_filter=query_filter)
+        except Exception:
+            self.latency[name].record(self.failure_penalty)
+            self._count(name, 'errors')
+            raise
+        self.latency[name].record(time.perf_counter() - start_time)
+        return result
+
+    async def _aquery_one(self, name: str, vector: list, top_k: int, postprocess: bool, query_filter=None):
+        start_time = time.perf_counter()
+        try:
+            result = await self._by_name[name].aquery(vector, top_k=top_k, postprocess=postprocess,
+                                                      pre_vectorized=True, query_filter=query_filter)
+        except asyncio.CancelledError:
+            # Lost to a faster database, the time it took so far is still a lower bound of its latency
+            self.latency[name].record(time.perf_counter() - start_time)
+            raise
+        except Exception:
+            self.latency[name].record(self.failure_penalty)
+            self._count(name, 'errors')
+            raise
+        self.latency[name].record(time.perf_counter() - start_time)
+        return result
+
+    def query(self, text: Optional[str], top_k: int = 5, postprocess: bool = False, pre_vectorized: bool = False,
+              query_filter=None):
+        """Method to query the fastest database, hedging to the next one if it is slow
+
+        :param text: Text to query with, or a vector if pre_vectorized
+        :param top_k: How many results to return
+        :param postprocess: Whether to process the results or not. Raw results differ between databases, postprocess if several are used.
+        :param pre_vectorized: Whether text is already a vector
+        :param query_filter: Filter or dict on the metadata, passed on to whichever database is queried
+        :return: Results of whichever database answered first
+        """
+        vector = text if pre_vectorized else self.encode(text)
+        remaining = self.ranked()
+        executor = self._executor()
+        pending = {}
+        hedges = 0
+        error = None
+
+        def send(hedge: bool) -> None:
+            name = remaining.pop(0)
+            if hedge:
+                self._count(name, 'hedges')
+            else:
+                self._start_query(name)
+            pending[executor.submit(self._query_one, name, vector, top_k, postprocess, query_filter)] = name
+
+        send(hedge=False)
+        first = next(iter(pending.values()))
+        while pending:
+            can_hedge = remaining and hedges < self.max_hedges
+            done, _ = concurrent.futures.wait(pending, timeout=self.hedge_delay(first) if can_hedge else None,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                hedges += 1
+                if self._allow_hedge(remaining[0]):
+                    send(hedge=True)
+                else:
+                    hedges = self.max_hedges
+                continue
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.logger.warning(f"Query to {name} failed. See error: {e}")
+                    error = e
+                    continue
+                # Slower requests can't be interrupted, they finish in the background and still record their latency
+                for other in pending:
+                    other.cancel()
+                self._count(name, 'wins')
+                return result
+            if not pending and remaining:
+                send(hedge=False)
+        raise error
+
+    async def aquery(self, text: Optional[str], top_k: int = 5, postprocess: bool = False,
+                     pre_vectorized: bool = False, query_filter=None):
+        """Method to query the fastest database from an event loop, hedging to the next one if it is slow.
+        Requests that lose are cancelled.
+
+        :param text: Text to query with, or a vector if pre_vectorized
+        :param top_k: How many results to return
+        :param postprocess: Whether to process the results or not
+        :param pre_vectorized: Whether text is already a vector
+        :param query_filter: Filter or dict on the metadata
+        :return: Results of whichever database answered first
+        """
+        async with self._limiter():
+            vector = text if pre_vectorized else await self._run_blocking(self.encode, text)
+            remaining = self.ranked()
+            pending = {}
+            hedges = 0
+            error = None
+
+            def send(hedge: bool) -> None:
+                name = remaining.pop(0)
+                if hedge:
+                    self._count(name, 'hedges')
+                else:
+                    self._start_query(name)
+                pending[asyncio.ensure_future(self._aquery_one(name, vector, top_k, postprocess, query_filter))] = name
+
+            send(hedge=False)
+            first = next(iter(pending.values()))
+            try:
+                while pending:
+                    can_hedge = remaining and hedges < self.max_hedges
+                    done, _ = await asyncio.wait(pending, timeout=self.hedge_delay(first) if can_hedge else None,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        hedges += 1
+                        if self._allow_hedge(remaining[0]):
+                            send(hedge=True)
+                        else:
+                            hedges = self.max_hedges
+                        continue
+                    for task in done:
+                        name = pending.pop(task)
+                        if task.exception() is not None:
+                            self.logger.warning(f"Query to {name} failed. See error: {task.exception()}")
+                            error = task.exception()
+                            continue
+                        self._count(name, 'wins')
+                        return task.result()
+                    if not pending and remaining:
+                        send(hedge=False)
+            finally:
+                for task in pending:
+                    task.cancel()
+            raise error
+
+    def query_batch(self, queries: list, top_k: int = 5, postprocess: bool = False, pre_vectorized: bool = False,
+                    batch_size: int = 64, query_filter=None) -> list:
+        """Method to run many queries on the fastest database, moving on to the next one if it fails. Not hedged,
+        a batch waits for its slowest request either way.
+
+        :param queries: Texts to query with, or vectors if pre_vectorized
+        :param top_k: How many results to return per query
+        :param postprocess: Whether to process the results or not
+        :param pre_vectorized: Whether queries are already vectors
+        :param batch_size: Max amount of queries per request to the database
+        :param query_filter: Filter or dict on the metadata, applied to every query
+        :return: Results in the same order as queries
+        """
+        vectors = queries if pre_vectorized else self.encode_batch(queries)
+        error = None
+        for name in self.ranked():
+            self._count(name, 'primary')
+            try:
+                results = self._by_name[name].query_batch(vectors, top_k=top_k, postprocess=postprocess,
+                                                          pre_vectorized=True, batch_size=batch_size,
+                                                          query_filter=query_filter)
+            except Exception as e:
+                self.logger.warning(f"Batch query to {name} failed. See error: {e}")
+                self.latency[name].record(self.failure_penalty)
+                self._count(name, 'errors')
+                error = e
+                continue
+            self._count(name, 'wins')
+            return results
+        raise error
+
+    def routing_summary(self) -> dict:
+        """Recent latency and routing counts of every database
+
+        :return: Database name -> dict with samples, p50_ms, p95_ms, hedge_delay_ms and the route_stats counts
+        """
+        summary = {}
+        for name in self.names:
+            latency = self.latency[name]
+            p50 = latency.percentile(50)
+            p95 = latency.percentile(95)
+            summary[name] = {
+                'samples': len(latency),
+                'p50_ms': round(p50 * 1000, 3) if p50 is not None else None,
+                'p95_ms': round(p95 * 1000, 3) if p95 is not None else None,
+                'hedge_delay_ms': round(self.hedge_delay(name) * 1000, 3),
+                **self.route_stats[name]
+            }
+        return summary
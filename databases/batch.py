@@ -0,0 +1,302 @@
+from types import MappingProxyType
+from typing import Iterable, Iterator, Optional, Union
+
+import numpy as np
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    # A read-only view, the caller's array stays writeable
+    array = array.view()
+    array.flags.writeable = False
+    return array
+
+
+class VectorBatch:
+    """Immutable columnar batch of documents, the format the loader produces and every database uploads.
+    Row i is the document with ID ids[i], vector vectors[i] and text text_buffer[text_offsets[i]:text_offsets[i + 1]].
+    Its metadata is sources[source_index[i]] plus its chunk number, so the chunks of one PDF share a single mapping
+    instead of carrying a dict each. Every array is read-only, databases share a batch without copying it and
+    only convert to lists at their client's boundary.
+
+    Args:
+        ids (np.ndarray): int64 ID of every row.
+        vectors (np.ndarray): Matrix of shape (rows, dimensions). Only copied if it is not already contiguous float32.
+        text_buffer (str): Text of every row, back to back.
+        text_offsets (np.ndarray): rows + 1 positions within text_buffer where each row's text starts, the last one is where the final text ends.
+        sources (tuple): Metadata shared by rows, usually one mapping per source file.
+        source_index (np.ndarray): Position within sources of every row's metadata.
+        chunks (np.ndarray): Chunk number of every row within its source, starting at 1. 0 means the row has no chunk number.
+    """
+
+    __slots__ = ("ids", "vectors", "text_buffer", "text_offsets", "sources", "source_index", "chunks")
+
+    def __init__(self,
+                 ids: np.ndarray,
+                 vectors: np.ndarray,
+                 text_buffer: str,
+                 text_offsets: np.ndarray,
+                 sources: tuple,
+                 source_index: np.ndarray,
+                 chunks: np.ndarray
+                 ) -> None:
+        ids = _read_only(np.asarray(ids, dtype=np.int64))
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1 and vectors.size == 0:
+            vectors = vectors.reshape(0, 0)
+        columns = {
+            "ids": ids,
+            "vectors": _read_only(vectors),
+            "text_buffer": text_buffer,
+            "text_offsets": _read_only(np.asarray(text_offsets, dtype=np.int64)),
+            "sources": tuple(source if isinstance(source, MappingProxyType) else MappingProxyType(dict(source))
+                             for source in sources),
+            "source_index": _read_only(np.asarray(source_index, dtype=np.int32)),
+            "chunks": _read_only(np.asarray(chunks, dtype=np.int32)),
+        }
+        rows = len(ids)
+        if not (len(columns["vectors"]) == len(columns["source_index"]) == len(columns["chunks"]) == rows
+                and len(columns["text_offsets"]) == rows + 1):
+            raise ValueError(f"Columns differ in length: {rows} ids, {len(columns['vectors'])} vectors, "
+                             f"{len(columns['text_offsets'])} text offsets, {len(columns['source_index'])} source "
+                             f"indexes and {len(columns['chunks'])} chunk numbers")
+        for name, value in columns.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("VectorBatch is immutable")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, rows: slice) -> "VectorBatch":
+        """Rows start:stop as a new batch sharing this batch's arrays and text, nothing is copied
+        """
+        if not isinstance(rows, slice) or rows.step not in (None, 1):
+            raise TypeError("VectorBatch only supports contiguous slices")
+        start, stop, _ = rows.indices(len(self))
+        stop = max(start, stop)
+        return VectorBatch(
+            ids=self.ids[start:stop],
+            vectors=self.vectors[start:stop],
+            text_buffer=self.text_buffer,
+            text_offsets=self.text_offsets[start:stop + 1],
+            sources=self.sources,
+            source_index=self.source_index[start:stop],
+            chunks=self.chunks[start:stop]
+        )
+
+    @property
+    def dimensions(self) -> int:
+        return self.vectors.shape[1]
+
+    @classmethod
+    def from_arrays(cls,
+                    ids: Iterable,
+                    vectors: np.ndarray,
+                    texts: Optional[list] = None,
+                    metadata: Optional[dict] = None,
+                    chunks: Optional[Iterable] = None
+                    ) -> "VectorBatch":
+        """Batch whose rows all share the same metadata, e.g. the chunks of one PDF
+
+        :param ids: ID of every row, anything convertible to int
+        :param vectors: Matrix of shape (rows, dimensions), not copied if already contiguous float32
+        :param texts: Text of every row, empty if not specified
+        :param metadata: Metadata of every row, without text or chunk number
+        :param chunks: Chunk number of every row, 0 if not specified
+        :return: VectorBatch
+        """
+        ids = np.fromiter((int(doc_id) for doc_id in ids), dtype=np.int64) if not isinstance(ids, np.ndarray) else ids
+        rows = len(ids)
+        if texts is None:
+            text_buffer = ""
+            text_offsets = np.zeros(rows + 1, dtype=np.int64)
+        else:
+            text_buffer = "".join(texts)
+            text_offsets = np.zeros(rows + 1, dtype=np.int64)
+            np.cumsum([len(text) for text in texts], out=text_offsets[1:])
+        return cls(
+            ids=ids,
+            vectors=vectors,
+            text_buffer=text_buffer,
+            text_offsets=text_offsets,
+            sources=(metadata or {},),
+            source_index=np.zeros(rows, dtype=np.int32),
+            chunks=np.zeros(rows, dtype=np.int32) if chunks is None else np.asarray(chunks, dtype=np.int32)
+        )
+
+    @classmethod
+    def from_documents(cls, batch: list) -> "VectorBatch":
+        """Build a batch from a list of {'id', 'values', 'metadata'} dicts with the text and chunk number in metadata
+
+        :param batch: List of documents, IDs must be convertible to int
+        :return: VectorBatch
+        """
+        sources = []
+        known = {}
+        source_index = np.empty(len(batch), dtype=np.int32)
+        for i, doc in enumerate(batch):
+            source = {key: value for key, value in doc['metadata'].items() if key not in ('text', 'chunk')}
+            try:
+                key = tuple(source.items())
+                position = known.get(key)
+            except TypeError:  # Unhashable metadata values, nothing to share
+                key, position = None, None
+            if position is None:
+                position = len(sources)
+                sources.append(source)
+                if key is not None:
+                    known[key] = position
+            source_index[i] = position
+
+        texts = [doc['metadata'].get('text') or "" for doc in batch]
+        text_offsets = np.zeros(len(batch) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in texts], out=text_offsets[1:])
+        return cls(
+            ids=np.fromiter((int(doc['id']) for doc in batch), dtype=np.int64, count=len(batch)),
+            vectors=np.array([doc['values'] for doc in batch], dtype=np.float32),
+            text_buffer="".join(texts),
+            text_offsets=text_offsets,
+            sources=tuple(sources),
+            source_index=source_index,
+            chunks=np.fromiter((doc['metadata'].get('chunk') or 0 for doc in batch), dtype=np.int32, count=len(batch))
+        )
+
+    @classmethod
+    def of(cls, batch: Union["VectorBatch", list]) -> "VectorBatch":
+        """The batch itself if it already is a VectorBatch, otherwise one built from a list of documents
+        """
+        return batch if isinstance(batch, cls) else cls.from_documents(batch)
+
+    @classmethod
+    def concatenate(cls, batches: list) -> "VectorBatch":
+        """Join batches into one, copying each vector exactly once. A single batch is returned as is.
+
+        :param batches: Batches with vectors of the same dimensions
+        :return: VectorBatch
+        """
+        batches = [batch for batch in batches if len(batch)]
+        if len(batches) == 1:
+            return batches[0]
+        if not batches:
+            return cls.from_arrays(np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32))
+
+        text_parts = []
+        text_offsets = [np.zeros(1, dtype=np.int64)]
+        text_length = 0
+        sources = []
+        source_index = []
+        for batch in batches:
+            first, last = batch.text_offsets[0], batch.text_offsets[-1]
+            text_parts.append(batch.text_buffer[first:last])
+            text_offsets.append(batch.text_offsets[1:] - first + text_length)
+            text_length += last - first
+            # Only keep the sources this batch's rows use, slices share their parent's full tuple
+            used, position = np.unique(batch.source_index, return_inverse=True)
+            source_index.append(position.astype(np.int32) + len(sources))
+            sources.extend(batch.sources[i] for i in used)
+
+        return cls(
+            ids=np.concatenate([batch.ids for batch in batches]),
+            vectors=np.concatenate([batch.vectors for batch in batches]),
+            text_buffer="".join(text_parts),
+            text_offsets=np.concatenate(text_offsets),
+            sources=tuple(sources),
+            source_index=np.concatenate(source_index),
+            chunks=np.concatenate([batch.chunks for batch in batches])
+        )
+
+    def text_at(self, row: int) -> str:
+        return self.text_buffer[self.text_offsets[row]:self.text_offsets[row + 1]]
+
+    def texts(self) -> list:
+        """Text of every row
+        """
+        offsets = self.text_offsets.tolist()
+        buffer = self.text_buffer
+        return [buffer[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def metadata_at(self, row: int, include_text: bool = False, exclude: Iterable = ()) -> dict:
+        """New metadata dict of one row, the caller is free to change it
+
+        :param row: Row number
+        :param include_text: Whether to put the text in under 'text', as the old list of dicts format had it
+        :param exclude: Keys to leave out
+        :return: Dict
+        """
+        return self.metadata_dicts(include_text, exclude, rows=range(row, row + 1))[0]
+
+    def metadata_dicts(self, include_text: bool = False, exclude: Iterable = (), rows: Optional[range] = None) -> list:
+        """New metadata dicts the caller is free to change
+
+        :param include_text: Whether to put the text in under 'text', as the old list of dicts format had it
+        :param exclude: Keys to leave out
+        :param rows: Rows to build dicts for, all of them if not specified
+        :return: List of dicts
+        """
+        exclude = set(exclude)
+        sources = [{key: value for key, value in source.items() if key not in exclude} for source in self.sources]
+        rows = range(len(self)) if rows is None else rows
+        source_index = self.source_index[rows.start:rows.stop].tolist()
+        chunks = self.chunks[rows.start:rows.stop].tolist()
+        texts = self[rows.start:rows.stop].texts() if include_text else None
+        with_chunk = 'chunk' not in exclude
+        dicts = []
+        for i, (source, chunk) in enumerate(zip(source_index, chunks)):
+            metadata = dict(sources[source])
+            if with_chunk and chunk:
+                metadata['chunk'] = chunk
+            if include_text:
+                metadata['text'] = texts[i]
+            dicts.append(metadata)
+        return dicts
+
+    def int_ids(self) -> list:
+        """IDs as Python ints, for clients with integer primary keys
+        """
+        return self.ids.tolist()
+
+    def str_ids(self) -> list:
+        """IDs as strings, for clients with string IDs like Pinecone
+        """
+        return [str(doc_id) for doc_id in self.ids.tolist()]
+
+    def vector_lists(self) -> list:
+        """Vectors as lists of floats, for clients that only accept lists
+        """
+        return self.vectors.tolist()
+
+    def to_documents(self) -> list:
+        """The batch as a list of {'id', 'values', 'metadata'} dicts with the text in metadata, the old loader format
+
+        :return: List of new dicts
+        """
+        return [
+            {'id': doc_id, 'values': values, 'metadata': metadata}
+            for doc_id, values, metadata in zip(self.str_ids(), self.vector_lists(), self.metadata_dicts(include_text=True))
+        ]
+
+
+def rebatch(batches: Iterable[VectorBatch], batch_size: int) -> Iterator[VectorBatch]:
+    """Regroup a stream of batches (e.g. one per PDF) into batches of exactly batch_size rows, splitting batches where
+    needed. Only one batch worth of rows is held at a time.
+
+    :param batches: Batches to regroup
+    :param batch_size: Amount of rows per batch
+    :return: Generator of batches, the last one may be smaller
+    """
+    pending = []
+    size = 0
+    for batch in batches:
+        start = 0
+        while start < len(batch):
+            take = min(batch_size - size, len(batch) - start)
+            pending.append(batch[start:start + take])
+            size += take
+            start += take
+            if size == batch_size:
+                yield VectorBatch.concatenate(pending)
+                pending = []
+                size = 0
+    if pending:
+        yield VectorBatch.concatenate(pending)
@@ -0,0 +1,385 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import inspect
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+# Marks a missing entry, so None can still be cached
+_MISSING = object()
+
+# Ids of the databases with a cached query running in this context, so the query aquery falls back to isn't
+# looked up a second time
+_caching = contextvars.ContextVar("cached_calls", default=())
+
+
+def estimate_size(value) -> int:
+    """Rough amount of memory held by a value and everything in it, in bytes
+
+    :param value: Any value, containers are walked recursively
+    :return: Size in bytes
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class LRUCache:
+    """Thread safe least recently used cache with an optional time to live per entry and an optional memory cap
+
+    Args:
+        capacity (int): Max amount of entries.
+        ttl (float): If specified, seconds after which an entry expires.
+        max_bytes (int): If specified, max estimated memory of all keys and values. Entries larger than this are not cached.
+        sizeof (Callable): Estimates the bytes of a key and value, only used with max_bytes. Defaults to estimate_size of both.
+    """
+
+    def __init__(self,
+                 capacity: int = 1024,
+                 ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable] = None
+                 ) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda key, value: estimate_size(key) + estimate_size(value))
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get a value and mark it as recently used
+
+        :param key: Key to look up
+        :param default: Returned when the key is missing or expired
+        :return: Cached value or default
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        """Add or replace a value, evicting the least recently used entries if over capacity
+
+        :param key: Key to store under
+        :param value: Value to store
+        :return:
+        """
+        if self.capacity <= 0:
+            return
+        size = self.sizeof(key, value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._insert(key, value, size)
+
+    def _insert(self, key, value, size: int) -> None:
+        """Store an entry, the lock must be held
+        """
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[2]
+        self._entries[key] = (value, expires_at, size)
+        self.bytes += size
+        while len(self._entries) > self.capacity or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            self.bytes -= self._entries.popitem(last=False)[1][2]
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Counters since the cache was created
+
+        :return: Dict of hits, misses, evictions, expirations, hit rate, size and estimated bytes (0 without max_bytes)
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self.bytes
+        }
+
+
+_query_caches = {}
+_query_caches_lock = threading.Lock()
+
+
+def shared_query_cache(model_name: str, capacity: int = 1024, ttl: Optional[float] = None) -> LRUCache:
+    """Query embedding cache shared by every database using the same model, so the same prompt sent to
+    several backends is only encoded once. The first caller decides the capacity and ttl.
+
+    :param model_name: Sentence Transformer model the embeddings come from
+    :param capacity: Max amount of cached query embeddings
+    :param ttl: If specified, seconds after which a cached embedding expires
+    :return: LRUCache
+    """
+    with _query_caches_lock:
+        cache = _query_caches.get(model_name)
+        if cache is None:
+            cache = LRUCache(capacity=capacity, ttl=ttl)
+            _query_caches[model_name] = cache
+        return cache
+
+
+class ResultCache(LRUCache):
+    """Cache of postprocessed query results for a single database, see Database.enable_result_cache.
+    Emptied whenever the database is written to. A query that was running during a write can't put its result back,
+    since it may have read data from before the write.
+
+    Args:
+        capacity (int): Max amount of cached queries.
+        max_bytes (int): Max estimated memory of all cached results.
+        ttl (float): If specified, seconds after which a result expires, for data changed outside this process.
+    """
+
+    def __init__(self,
+                 capacity: int = 10000,
+                 max_bytes: Optional[int] = 64 * 1024 * 1024,
+                 ttl: Optional[float] = None
+                 ) -> None:
+        super().__init__(capacity=capacity, ttl=ttl, max_bytes=max_bytes)
+        self.generation = 0
+        self.invalidations = 0
+        self._writes = 0
+
+    def invalidate(self) -> None:
+        """Drop every cached result
+        """
+        with self._lock:
+            self._invalidate()
+
+    def _invalidate(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+        self.generation += 1
+        self.invalidations += 1
+
+    def begin_write(self) -> None:
+        with self._lock:
+            self._writes += 1
+            self._invalidate()
+
+    def end_write(self) -> None:
+        with self._lock:
+            self._writes -= 1
+            self._invalidate()
+
+    def put_if_current(self, key, value, generation: int) -> None:
+        """Cache a result unless the database was written to since generation was read, or still is
+
+        :param key: Key of the query
+        :param value: Results of the query
+        :param generation: Value of generation from before the query was sent
+        :return:
+        """
+        if self.capacity <= 0:
+            return
+        size = self.sizeof(key, value) if self.max_bytes is not None else 0
+        with self._lock:
+            if self._writes == 0 and generation == self.generation:
+                self._insert(key, value, size)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "invalidations": self.invalidations}
+
+
+def _freeze(value):
+    """Hashable stand-in for a query argument
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, np.ndarray):
+        return value.tobytes()
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+def _is_default(value, default) -> bool:
+    if value is default:
+        return True
+    try:
+        return bool(value == default)
+    except Exception:  # e.g. arrays, which don't compare to a single bool
+        return False
+
+
+def _copy_results(results):
+    """Copy of postprocessed results deep enough that callers can't change the cached ones
+    """
+    if not isinstance(results, list):
+        return results
+    return [
+        {key: dict(value) if isinstance(value, dict) else value for key, value in result.items()}
+        if isinstance(result, dict) else result
+        for result in results
+    ]
+
+
+def _key_function(method: Callable) -> Callable:
+    """Build the function turning a query method's arguments into a cache key: the text, or a hash of the vector if
+    pre_vectorized, plus every other argument (top_k, filters, ...) that differs from its default.
+    Returns None for calls that are not postprocessed, raw client results are never cached.
+    """
+    signature = inspect.signature(method)
+    defaults = {name: parameter.default for name, parameter in signature.parameters.items()}
+
+    def key(self, args: tuple, kwargs: dict) -> Optional[tuple]:
+        arguments = signature.bind(self, *args, **kwargs).arguments
+        if not arguments.get('postprocess', defaults.get('postprocess', False)):
+            return None
+        text = arguments.get('text')
+        if arguments.get('pre_vectorized', False):
+            query = hashlib.blake2b(np.asarray(text, dtype=np.float32).tobytes(), digest_size=16).digest()
+        else:
+            query = _freeze(text)
+        extra = tuple(sorted(
+            (name, _freeze(value)) for name, value in arguments.items()
+            if name not in ('self', 'text', 'pre_vectorized') and not _is_default(value, defaults[name])
+        ))
+        return query, extra
+
+    return key
+
+
+def _enter(database) -> Optional[contextvars.Token]:
+    active = _caching.get()
+    if id(database) in active:
+        return None
+    return _caching.set(active + (id(database),))
+
+
+def cached_query(method: Callable) -> Callable:
+    """Wrap a query method so postprocessed results are served from the database's result_cache, if it has one
+    """
+    key_of = _key_function(method)
+
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'result_cache', None)
+            if cache is None:
+                return await method(self, *args, **kwargs)
+            token = _enter(self)
+            if token is None:
+                return await method(self, *args, **kwargs)
+            try:
+                key = key_of(self, args, kwargs)
+                if key is None:
+                    return await method(self, *args, **kwargs)
+                results = cache.get(key, _MISSING)
+                if results is not _MISSING:
+                    return _copy_results(results)
+                generation = cache.generation
+                results = await method(self, *args, **kwargs)
+                cache.put_if_current(key, _copy_results(results), generation)
+                return results
+            finally:
+                _caching.reset(token)
+    else:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'result_cache', None)
+            if cache is None:
+                return method(self, *args, **kwargs)
+            token = _enter(self)
+            if token is None:
+                return method(self, *args, **kwargs)
+            try:
+                key = key_of(self, args, kwargs)
+                if key is None:
+                    return method(self, *args, **kwargs)
+                results = cache.get(key, _MISSING)
+                if results is not _MISSING:
+                    return _copy_results(results)
+                generation = cache.generation
+                results = method(self, *args, **kwargs)
+                cache.put_if_current(key, _copy_results(results), generation)
+                return results
+            finally:
+                _caching.reset(token)
+
+    wrapper._result_cached = True
+    return wrapper
+
+
+def invalidating(method: Callable) -> Callable:
+    """Wrap a write method so the database's result_cache is emptied before and after it runs
+    """
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'result_cache', None)
+            if cache is None:
+                return await method(self, *args, **kwargs)
+            cache.begin_write()
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                cache.end_write()
+    else:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'result_cache', None)
+            if cache is None:
+                return method(self, *args, **kwargs)
+            cache.begin_write()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                cache.end_write()
+
+    wrapper._result_cached = True
+    return wrapper
+
+
+def cache_class(cls) -> None:
+    """Route query and aquery of the class through the result cache, and make upload and clear invalidate it.
+    Only methods the class itself defines are wrapped.
+    """
+    for name, wrap in (("query", cached_query), ("aquery", cached_query), ("upload", invalidating),
+                       ("clear", invalidating)):
+        method = cls.__dict__.get(name)
+        if callable(method) and not getattr(method, '_result_cached', False):
+            setattr(cls, name, wrap(method))
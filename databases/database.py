@@ -1,28 +1,183 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import threading
 from typing import Optional
 
-import torch
-from sentence_transformers import SentenceTransformer
+from databases.cache import ResultCache, cache_class, shared_query_cache
+from databases.encoder import SharedEncoder
+from databases.metrics import instrument_class
 
 
 class Database:
     """Abstract class for other classes to use. Do not use directly.
+
+    Args:
+        device (str): Selected device to encode queries with. If not specified it will pick CUDA if available, cpu if not.
+        model_name (str): Sentence Transformer model to use.
+        upload_concurrency (int): Max amount of batches the loader keeps uploading to this database at the same time.
+        query_cache_size (int): Max amount of query embeddings kept in the cache shared by every database using this model, 0 to disable.
+        query_cache_ttl (float): If specified, seconds after which a cached query embedding expires.
+        max_concurrent_queries (int): Max amount of aquery calls in flight at once per event loop, the rest wait their turn.
+        query_threads (int): Size of the thread pool aquery falls back to for blocking clients.
+
+    encode, query, upload, preprocess and postprocess (and their batch/async versions) of every subclass are timed
+    through databases.metrics once metrics are enabled. query and aquery of every subclass are served from the
+    result cache once enable_result_cache is called, upload and clear empty it.
     """
 
     def __init__(self,
-                 device: str = 'cuda' if torch.cuda.is_available() else 'cpu',
-                 model_name: str = "all-mpnet-base-v2"
+                 device: Optional[str] = None,
+                 model_name: str = "all-mpnet-base-v2",
+                 upload_concurrency: int = 4,
+                 query_cache_size: int = 1024,
+                 query_cache_ttl: Optional[float] = None,
+                 max_concurrent_queries: int = 256,
+                 query_threads: int = 32
                  ) -> None:
-        self.device = device
         self.model_name = model_name
-        self.encoder = SentenceTransformer(model_name_or_path=model_name, device=device)
-        self.model_dimensions = self.encoder.get_sentence_embedding_dimension()
+        self.upload_concurrency = upload_concurrency
+        # Shared with every other database and loader using the same model, only loaded on first use
+        self.encoder = SharedEncoder(model_name=model_name, device=device)
+        self.query_cache = shared_query_cache(model_name, query_cache_size, query_cache_ttl) if query_cache_size else None
+        self.max_concurrent_queries = max_concurrent_queries
+        self.query_threads = query_threads
+        self._query_limiter = None
+        self._query_executor = None
+        self._query_executor_lock = threading.Lock()
+        self.result_cache = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Cache first so metrics time cache hits too
+        cache_class(cls)
+        instrument_class(cls)
+
+    def enable_result_cache(self, capacity: int = 10000, max_bytes: Optional[int] = 64 * 1024 * 1024,
+                            ttl: Optional[float] = None) -> ResultCache:
+        """Cache postprocessed query results of this database. Identical queries (same text or vector, top_k,
+        filter and other arguments) are answered from memory until the next upload or clear through this object.
+        Writes made any other way, e.g. to one of a RouterDB's databases directly, are only picked up after ttl.
+
+        :param capacity: Max amount of cached queries
+        :param max_bytes: Max estimated memory of all cached results, None for no limit
+        :param ttl: If specified, seconds after which a cached result expires
+        :return: The ResultCache, see its stats()
+        """
+        self.result_cache = ResultCache(capacity=capacity, max_bytes=max_bytes, ttl=ttl)
+        return self.result_cache
+
+    def disable_result_cache(self) -> None:
+        self.result_cache = None
+
+    @property
+    def device(self) -> str:
+        return self.encoder.device
+
+    @property
+    def model_dimensions(self) -> int:
+        return self.encoder.get_sentence_embedding_dimension()
+
+    def close(self) -> None:
+        """Release this database's handle on the shared encoder and its query threads
+        """
+        self.encoder.release()
+        if self._query_executor is not None:
+            self._query_executor.shutdown(wait=False)
+            self._query_executor = None
+
+    def query(self, text: Optional[str], top_k: int = 5, postprocess=False, pre_vectorized=False, query_filter=None):
+        """Method to query the database for data. query_filter (a databases.filters.Filter or a dict of
+        field -> value) is compiled to the backend's own filter, so only matching documents are searched.
+        """
+        pass
+
+    async def aquery(self, text: Optional[str], top_k: int = 5, postprocess: bool = False,
+                     pre_vectorized: bool = False, query_filter=None):
+        """Method to query the database from an event loop. At most max_concurrent_queries run at once, so thousands
+        of concurrent callers queue up instead of exhausting threads or connections.
+
+        :param text: Text to query with, or a vector if pre_vectorized
+        :param top_k: How many results to return
+        :param postprocess: Whether to process the results or not
+        :param pre_vectorized: Whether text is already a vector
+        :param query_filter: If specified, only documents whose metadata matches are searched, see databases.filters
+        :return: Same as query
+        """
+        async with self._limiter():
+            vector = text if pre_vectorized else await self._run_blocking(self.encode, text)
+            return await self._asearch(vector, top_k=top_k, postprocess=postprocess, query_filter=query_filter)
+
+    async def _asearch(self, vector: list, top_k: int = 5, postprocess: bool = False, query_filter=None):
+        """Method to search a single vector without blocking the event loop. Backends with async clients should
+        override this, the fallback runs query on the bounded query thread pool.
+        """
+        return await self._run_blocking(self.query, vector, top_k=top_k, postprocess=postprocess, pre_vectorized=True,
+                                        query_filter=query_filter)
 
-    def query(self, text: Optional[str], postprocess=False, pre_vectorized=False):
-        """Method to query the database for data
+    async def aclose(self) -> None:
+        """Release what this database holds for the running event loop, e.g. async clients. Call it before the loop
+        ends, asyncio.run closes the loop as soon as its coroutine returns.
         """
         pass
 
-    def upload(self, batch: list) -> None:
+    def _limiter(self) -> asyncio.Semaphore:
+        """Semaphore limiting concurrent aquery calls, recreated when used from a different event loop
+        """
+        loop = asyncio.get_running_loop()
+        if self._query_limiter is None or self._query_limiter[0] is not loop:
+            self._query_limiter = (loop, asyncio.Semaphore(self.max_concurrent_queries))
+        return self._query_limiter[1]
+
+    def _executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Query thread pool of this database, created on first use
+        """
+        with self._query_executor_lock:
+            if self._query_executor is None:
+                self._query_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.query_threads,
+                                                                             thread_name_prefix="query")
+            return self._query_executor
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """Run a blocking call on the query thread pool, which is shared by every aquery on this database
+        """
+        loop = asyncio.get_running_loop()
+        # Carry context variables over to the thread, as asyncio.to_thread does
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor(), functools.partial(context.run, func, *args, **kwargs))
+
+    def query_batch(self, queries: list, top_k: int = 5, postprocess: bool = False, pre_vectorized: bool = False,
+                    batch_size: int = 64, query_filter=None) -> list:
+        """Method to run many queries at once. Texts are encoded in a single model call and every batch_size
+        queries are sent to the database in one request.
+
+        :param queries: Texts to query with, or vectors if pre_vectorized
+        :param top_k: How many results to return per query
+        :param postprocess: Whether to process the results or not
+        :param pre_vectorized: Whether queries are already vectors
+        :param batch_size: Max amount of queries per request to the database
+        :param query_filter: If specified, only documents whose metadata matches are searched, the same for every query
+        :return: Results in the same order as queries
+        """
+        vectors = queries if pre_vectorized else self.encode_batch(queries)
+        results = []
+        for start in range(0, len(vectors), batch_size):
+            results.extend(self._search_batch(vectors[start:start + batch_size], top_k=top_k, postprocess=postprocess,
+                                              query_filter=query_filter))
+        return results
+
+    def _search_batch(self, vectors: list, top_k: int = 5, postprocess: bool = False, query_filter=None) -> list:
+        """Method to search several vectors in one request. Backends that support it should override this,
+        the fallback runs one query per vector.
+        """
+        return [self.query(vector, top_k=top_k, postprocess=postprocess, pre_vectorized=True, query_filter=query_filter)
+                for vector in vectors]
+
+    async def upload(self, batch: list) -> None:
+        """Method to upload a batch of documents. Blocking client calls should be run outside the event loop
+        (e.g. asyncio.to_thread) so several batches can be in flight at once.
+        """
         pass
 
     def clear(self, *args) -> None:
@@ -32,10 +187,42 @@ class Database:
         pass
 
     def encode(self, text: str) -> list:
-        return self.encoder.encode(text, show_progress_bar=False).tolist()
+        """Method to embed a query. Repeated queries are served from the query cache without touching the model.
+
+        :param text: Text to embed
+        :return: Embedding as a list of floats
+        """
+        if self.query_cache is None:
+            return self.encoder.encode(text, show_progress_bar=False).tolist()
+        vector = self.query_cache.get(text)
+        if vector is None:
+            vector = self.encoder.encode(text, show_progress_bar=False).tolist()
+            self.query_cache.put(text, vector)
+        # Copy so callers can't change the cached embedding
+        return list(vector)
+
+    def encode_batch(self, texts: list) -> list:
+        """Method to embed many queries with a single model call, skipping any found in the query cache
+
+        :param texts: Texts to embed
+        :return: Embedding of each text as a list of floats
+        """
+        vectors = [self.query_cache.get(text) for text in texts] if self.query_cache is not None else [None] * len(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = self.encoder.encode([texts[i] for i in missing], show_progress_bar=False).tolist()
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+                if self.query_cache is not None:
+                    self.query_cache.put(texts[i], vector)
+        return [list(vector) for vector in vectors]
 
     def indexing(self, enable: bool) -> None:
         pass
 
     def postprocess(self, query, include_metadata: bool = True, include_text: bool = True):
         pass
+
+
+cache_class(Database)
+instrument_class(Database)
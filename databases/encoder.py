@@ -0,0 +1,107 @@
+import functools
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# (model_name, device) -> [SentenceTransformer or None until first use, reference count, lock held while loading]
+_models = {}
+_models_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def default_device() -> str:
+    """CUDA if available, cpu if not. Imports torch only when called, checked once per process.
+    """
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+class SharedEncoder:
+    """Handle to a Sentence Transformer shared across the whole process by (model_name, device).
+    A handle joins the registry and the model is loaded the first time it is used, so handles that never encode
+    don't import torch. The model is dropped once every handle that used it has been released.
+    Anything not defined here (tokenizer, max_seq_length, ...) is forwarded to the model.
+
+    Args:
+        model_name (str): Sentence Transformer model to use.
+        device (str): Device to encode with. If not specified it will pick CUDA if available, cpu if not.
+    """
+
+    def __init__(self,
+                 model_name: str = "all-mpnet-base-v2",
+                 device: Optional[str] = None
+                 ) -> None:
+        self.model_name = model_name
+        self._device = device
+        self._key = None
+        self._entry = None
+        self._released = False
+
+    @property
+    def device(self) -> str:
+        if self._device is None:
+            self._device = default_device()
+        return self._device
+
+    def _acquire(self) -> list:
+        """Registry entry of this handle, joined on first use. The device is resolved before building the key,
+        so device=None shares the model with handles naming that device.
+        """
+        with _models_lock:
+            if self._entry is None:
+                self._key = (self.model_name, self.device)
+                self._entry = _models.setdefault(self._key, [None, 0, threading.Lock()])
+                self._entry[1] += 1
+            return self._entry
+
+    @property
+    def model(self):
+        """The shared Sentence Transformer, loading it if no handle has used it yet
+        """
+        entry = self._entry or self._acquire()
+        if entry[0] is None:
+            with entry[2]:
+                if entry[0] is None:
+                    from sentence_transformers import SentenceTransformer
+                    logger.info(f"Loading {self.model_name} on {self.device}")
+                    entry[0] = SentenceTransformer(model_name_or_path=self.model_name, device=self.device)
+        return entry[0]
+
+    def encode(self, *args, **kwargs):
+        return self.model.encode(*args, **kwargs)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def release(self) -> None:
+        """Give up this handle. The model is unloaded once no handle is left.
+        """
+        if self._released:
+            return
+        self._released = True
+        with _models_lock:
+            entry = self._entry
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0 and _models.get(self._key) is entry:
+                del _models[self._key]
+                if entry[0] is not None:
+                    logger.info(f"Unloading {self.model_name}")
+                    entry[0] = None
+
+
+def loaded_models() -> dict:
+    """Reference counts of every shared model, for debugging
+
+    :return: Dict of (model_name, device) -> (loaded, reference count)
+    """
+    with _models_lock:
+        return {key: (entry[0] is not None, entry[1]) for key, entry in _models.items()}
@@ -0,0 +1,605 @@
+import datetime
+import json
+import operator
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+# Metadata the loader uploads and the payload index type QDrant gets for each field
+FILTER_FIELDS = {
+    'filename': "keyword",
+    'size': "integer",
+    'created_at': "datetime",
+    'chunk': "integer",
+}
+
+# Engines that only compare numbers also get every datetime field as days since 1970 under <field>_days
+DAYS_SUFFIX = "_days"
+
+_MISSING = object()
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+def date_number(value) -> Optional[int]:
+    """Days since 1970-01-01 of a YYYY-MM-DD date, anything after the 10th character is ignored
+
+    :param value: Date string, or anything else
+    :return: Int, None if value is not a date
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        return (datetime.date.fromisoformat(value[:10]) - _EPOCH).days
+    except ValueError:
+        return None
+
+
+def with_date_numbers(metadata: dict) -> dict:
+    """Metadata with <field>_days added next to every datetime field of FILTER_FIELDS that holds a date
+
+    :param metadata: Metadata of one document, left untouched
+    :return: New dict
+    """
+    metadata = dict(metadata)
+    for field, field_type in FILTER_FIELDS.items():
+        day = date_number(metadata.get(field)) if field_type == "datetime" else None
+        if day is not None:
+            metadata[field + DAYS_SUFFIX] = day
+    return metadata
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (bool, int, float, np.number))
+
+
+class MetadataColumns:
+    """Scalar metadata of every row of a store kept as NumPy columns, so filters are evaluated with array
+    comparisons instead of a lookup per document. Every field that is uploaded gets a column: numbers as float64
+    (NaN where the row has none) and strings as int32 codes into the field's vocabulary (-1 where the row has none).
+    Other values, e.g. lists, can't be filtered on.
+
+    Args:
+        capacity (int): Amount of rows to preallocate room for. Columns double whenever they fill up.
+    """
+
+    def __init__(self,
+                 capacity: int = 1024
+                 ) -> None:
+        self._capacity = max(1, capacity)
+        self._size = 0
+        self._numbers = {}
+        self._codes = {}
+        # Field -> {string: code} and the strings in code order
+        self._vocabularies = {}
+        self._strings = {}
+        # Field -> days since 1970 of every string in the vocabulary, NaN if it is not a date. Filled on demand.
+        self._days = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, rows: int) -> None:
+        if rows <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < rows:
+            capacity *= 2
+        for columns, fill in ((self._numbers, np.nan), (self._codes, -1)):
+            for field, column in columns.items():
+                grown = np.full(capacity, fill, dtype=column.dtype)
+                grown[:self._size] = column[:self._size]
+                columns[field] = grown
+        self._capacity = capacity
+
+    def _column(self, columns: dict, field: str, fill, dtype) -> np.ndarray:
+        column = columns.get(field)
+        if column is None:
+            column = columns[field] = np.full(self._capacity, fill, dtype=dtype)
+        return column
+
+    def set(self, row: int, metadata: dict) -> None:
+        """Store the metadata of a row, replacing whatever the row had
+
+        :param row: Row number, rows past the end are added
+        :param metadata: Metadata of the row
+        """
+        if row >= self._size:
+            self._grow(row + 1)
+            self._size = row + 1
+        for column in self._numbers.values():
+            column[row] = np.nan
+        for column in self._codes.values():
+            column[row] = -1
+        for field, value in metadata.items():
+            if _is_number(value):
+                self._column(self._numbers, field, np.nan, np.float64)[row] = value
+            elif isinstance(value, str):
+                vocabulary = self._vocabularies.setdefault(field, {})
+                code = vocabulary.get(value)
+                if code is None:
+                    code = vocabulary[value] = len(vocabulary)
+                    self._strings.setdefault(field, []).append(value)
+                self._column(self._codes, field, -1, np.int32)[row] = code
+
+    def _nothing(self) -> np.ndarray:
+        return np.zeros(self._size, dtype=bool)
+
+    def equal(self, field: str, value) -> np.ndarray:
+        """Mask of the rows where field == value
+        """
+        return self.isin(field, (value,))
+
+    def isin(self, field: str, values: Iterable) -> np.ndarray:
+        """Mask of the rows where field is any of values
+        """
+        mask = self._nothing()
+        numbers = [value for value in values if _is_number(value)]
+        if numbers and field in self._numbers:
+            mask |= np.isin(self._numbers[field][:self._size], numbers)
+        vocabulary = self._vocabularies.get(field, {})
+        codes = [vocabulary[value] for value in values if isinstance(value, str) and value in vocabulary]
+        if codes:
+            mask |= np.isin(self._codes[field][:self._size], codes)
+        return mask
+
+    def compare(self, field: str, operator: str, value) -> np.ndarray:
+        """Mask of the rows where field is gt/gte/lt/lte value. A date string compares the field's dates by day.
+        """
+        compare = {"gt": np.greater, "gte": np.greater_equal, "lt": np.less, "lte": np.less_equal}[operator]
+        if isinstance(value, str):
+            column = self._day_numbers(field)
+            value = date_number(value)
+        else:
+            column = self._numbers.get(field)
+        if column is None or value is None:
+            return self._nothing()
+        # NaN compares False, rows without a value never match
+        return compare(column[:self._size], value)
+
+    def _day_numbers(self, field: str) -> Optional[np.ndarray]:
+        codes = self._codes.get(field)
+        if codes is None:
+            return None
+        days = self._days.get(field, np.empty(0))
+        strings = self._strings[field]
+        if len(days) < len(strings):
+            new = [date_number(value) for value in strings[len(days):]]
+            days = self._days[field] = np.concatenate(
+                [days, np.array([np.nan if day is None else day for day in new], dtype=np.float64)])
+        codes = codes[:self._size]
+        return np.where(codes >= 0, days[np.maximum(codes, 0)], np.nan)
+
+
+class Filter:
+    """Metadata filter that every database can run inside its engine. Build one from Field and combine them with
+    & (and), | (or) and ~ (not):
+
+        (Field("filename") == "abc") & (Field("size") >= 1000)
+        Field("created_at").between("2020-01-01", "2020-12-31") | Field("filename").isin(["a", "b"])
+
+    A plain dict like {"filename": "abc"} is also accepted anywhere a filter is, every key must match
+    (list values match any of their items). Pass filters to query, aquery or query_batch as query_filter.
+    """
+
+    def __and__(self, other) -> "Filter":
+        return And(self, as_filter(other))
+
+    def __or__(self, other) -> "Filter":
+        return Or(self, as_filter(other))
+
+    def __invert__(self) -> "Filter":
+        return Not(self)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Filter) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}{self._key()[1:]}"
+
+    def _key(self) -> tuple:
+        pass
+
+    def matches(self, metadata: dict) -> bool:
+        """Whether a document's metadata passes the filter
+        """
+        pass
+
+    def negated(self) -> "Filter":
+        """Equivalent of ~self without a Not at the top, for engines without a not operator
+        """
+        pass
+
+    def field_types(self) -> dict:
+        """Field name -> payload index type ("keyword", "integer", "float", "bool" or "datetime") of every field used
+        """
+        pass
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        """Boolean mask of the rows passing the filter, computed with array operations
+
+        :param columns: Metadata of every row
+        :return: 1D bool array with one entry per row
+        """
+        pass
+
+
+def _value_type(value) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "float"
+    return "keyword"
+
+
+class Eq(Filter):
+    def __init__(self, field: str, value) -> None:
+        self.field = field
+        self.value = value
+
+    def _key(self) -> tuple:
+        return "eq", self.field, self.value
+
+    def matches(self, metadata: dict) -> bool:
+        return metadata.get(self.field, _MISSING) == self.value
+
+    def negated(self) -> Filter:
+        return Ne(self.field, self.value)
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        return columns.equal(self.field, self.value)
+
+    def field_types(self) -> dict:
+        return {self.field: _value_type(self.value)}
+
+
+class Ne(Eq):
+    def _key(self) -> tuple:
+        return "ne", self.field, self.value
+
+    def matches(self, metadata: dict) -> bool:
+        return not super().matches(metadata)
+
+    def negated(self) -> Filter:
+        return Eq(self.field, self.value)
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        return ~super().mask(columns)
+
+
+class In(Filter):
+    def __init__(self, field: str, values: Iterable) -> None:
+        self.field = field
+        self.values = tuple(values)
+
+    def _key(self) -> tuple:
+        return "in", self.field, self.values
+
+    def matches(self, metadata: dict) -> bool:
+        return metadata.get(self.field, _MISSING) in self.values
+
+    def negated(self) -> Filter:
+        return NotIn(self.field, self.values)
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        return columns.isin(self.field, self.values)
+
+    def field_types(self) -> dict:
+        return {self.field: _value_type(self.values[0]) if self.values else "keyword"}
+
+
+class NotIn(In):
+    def _key(self) -> tuple:
+        return "not_in", self.field, self.values
+
+    def matches(self, metadata: dict) -> bool:
+        return not super().matches(metadata)
+
+    def negated(self) -> Filter:
+        return In(self.field, self.values)
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        return ~super().mask(columns)
+
+
+class Range(Filter):
+    """Bounds on one field, at least one of them has to be set. Numbers compare as numbers, strings have to be
+    YYYY-MM-DD dates (e.g. for created_at) and compare by day.
+    """
+
+    def __init__(self, field: str, gt=None, gte=None, lt=None, lte=None) -> None:
+        self.field = field
+        self.gt = gt
+        self.gte = gte
+        self.lt = lt
+        self.lte = lte
+        bounds = self.bounds()
+        if not bounds:
+            raise ValueError(f"Range on {field} needs at least one of gt, gte, lt or lte")
+        for name, value in bounds.items():
+            if isinstance(value, str) and date_number(value) is None:
+                raise ValueError(f"Range bound {name}={value!r} on {field} is not a YYYY-MM-DD date")
+            if not isinstance(value, str) and not _is_number(value):
+                raise ValueError(f"Range bound {name}={value!r} on {field} has to be a number or a date")
+
+    def _key(self) -> tuple:
+        return "range", self.field, self.gt, self.gte, self.lt, self.lte
+
+    def bounds(self) -> dict:
+        """The bounds that are set, as {"gt": ..., "lte": ...}
+        """
+        return {name: value for name, value in (("gt", self.gt), ("gte", self.gte), ("lt", self.lt),
+                                                 ("lte", self.lte)) if value is not None}
+
+    def is_date(self) -> bool:
+        return any(isinstance(value, str) for value in self.bounds().values())
+
+    def matches(self, metadata: dict) -> bool:
+        value = metadata.get(self.field)
+        bounds = self.bounds()
+        if self.is_date():
+            value = date_number(value)
+            bounds = {name: date_number(bound) for name, bound in bounds.items()}
+        elif not _is_number(value):  # e.g. a size stored as a string by an older upload
+            return False
+        if value is None or None in bounds.values():
+            return False
+        compare = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+        return all(compare[name](value, bound) for name, bound in bounds.items())
+
+    def negated(self) -> Filter:
+        complements = {"gt": "lte", "gte": "lt", "lt": "gte", "lte": "gt"}
+        parts = [Range(self.field, **{complements[name]: value}) for name, value in self.bounds().items()]
+        return parts[0] if len(parts) == 1 else Or(*parts)
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        return np.logical_and.reduce([columns.compare(self.field, name, value)
+                                      for name, value in self.bounds().items()])
+
+    def field_types(self) -> dict:
+        if self.is_date():
+            return {self.field: "datetime"}
+        return {self.field: "float" if any(isinstance(value, float) for value in self.bounds().values())
+                else "integer"}
+
+
+class And(Filter):
+    def __init__(self, *filters: Filter) -> None:
+        # Flatten nested ands, a & b & c is a single And
+        self.filters = tuple(part for item in filters
+                             for part in (item.filters if type(item) is And else (item,)))
+
+    def _key(self) -> tuple:
+        return ("and",) + tuple(item._key() for item in self.filters)
+
+    def matches(self, metadata: dict) -> bool:
+        return all(item.matches(metadata) for item in self.filters)
+
+    def negated(self) -> Filter:
+        return Or(*(item.negated() for item in self.filters))
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        return np.logical_and.reduce([item.mask(columns) for item in self.filters])
+
+    def field_types(self) -> dict:
+        types = {}
+        for item in self.filters:
+            types.update(item.field_types())
+        return types
+
+
+class Or(And):
+    def __init__(self, *filters: Filter) -> None:
+        self.filters = tuple(part for item in filters
+                             for part in (item.filters if type(item) is Or else (item,)))
+
+    def _key(self) -> tuple:
+        return ("or",) + tuple(item._key() for item in self.filters)
+
+    def matches(self, metadata: dict) -> bool:
+        return any(item.matches(metadata) for item in self.filters)
+
+    def negated(self) -> Filter:
+        return And(*(item.negated() for item in self.filters))
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        return np.logical_or.reduce([item.mask(columns) for item in self.filters])
+
+
+class Not(Filter):
+    def __init__(self, inner: Filter) -> None:
+        self.inner = inner
+
+    def _key(self) -> tuple:
+        return "not", self.inner._key()
+
+    def matches(self, metadata: dict) -> bool:
+        return not self.inner.matches(metadata)
+
+    def negated(self) -> Filter:
+        return self.inner
+
+    def mask(self, columns: MetadataColumns) -> np.ndarray:
+        return ~self.inner.mask(columns)
+
+    def field_types(self) -> dict:
+        return self.inner.field_types()
+
+
+class Field:
+    """Metadata field to build filters from, e.g. Field("size") >= 1000
+
+    Args:
+        name (str): Metadata key, e.g. filename, size, created_at or chunk.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __eq__(self, value) -> Filter:
+        return Eq(self.name, value)
+
+    def __ne__(self, value) -> Filter:
+        return Ne(self.name, value)
+
+    def __gt__(self, value) -> Filter:
+        return Range(self.name, gt=value)
+
+    def __ge__(self, value) -> Filter:
+        return Range(self.name, gte=value)
+
+    def __lt__(self, value) -> Filter:
+        return Range(self.name, lt=value)
+
+    def __le__(self, value) -> Filter:
+        return Range(self.name, lte=value)
+
+    def between(self, low, high) -> Filter:
+        """low <= field <= high
+        """
+        return Range(self.name, gte=low, lte=high)
+
+    def isin(self, values: Iterable) -> Filter:
+        return In(self.name, values)
+
+    def not_in(self, values: Iterable) -> Filter:
+        return NotIn(self.name, values)
+
+    __hash__ = None
+
+
+def as_filter(query_filter: Union[Filter, dict, None]) -> Optional[Filter]:
+    """Turn whatever was passed as query_filter into a Filter
+
+    :param query_filter: Filter, dict of field -> value (or list of values) that must all match, or None
+    :return: Filter, None if there is nothing to filter on
+    """
+    if query_filter is None or isinstance(query_filter, Filter):
+        return query_filter
+    if isinstance(query_filter, dict):
+        if not query_filter:
+            return None
+        parts = [In(field, value) if isinstance(value, (list, tuple, set)) else Eq(field, value)
+                 for field, value in query_filter.items()]
+        return parts[0] if len(parts) == 1 else And(*parts)
+    raise TypeError(f"Unsupported filter {query_filter!r}, use databases.filters.Field or a dict")
+
+
+def to_milvus(query_filter: Union[Filter, dict, None], json_field: str = "metadata") -> Optional[str]:
+    """Milvus boolean expression (expr) for a filter on the metadata JSON field
+
+    :param query_filter: Filter to compile
+    :param json_field: JSON field the metadata is stored in
+    :return: Expression string, None without a filter
+    """
+    query_filter = as_filter(query_filter)
+    if query_filter is None:
+        return None
+    operators = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+    def compile_node(node: Filter) -> str:
+        field = f'{json_field}[{json.dumps(node.field)}]' if hasattr(node, "field") else None
+        if isinstance(node, Ne):
+            return f"{field} != {json.dumps(node.value)}"
+        if isinstance(node, Eq):
+            return f"{field} == {json.dumps(node.value)}"
+        if isinstance(node, NotIn):
+            return f"{field} not in {json.dumps(list(node.values))}"
+        if isinstance(node, In):
+            return f"{field} in {json.dumps(list(node.values))}"
+        if isinstance(node, Range):
+            return " and ".join(f"{field} {operators[name]} {json.dumps(value)}"
+                                for name, value in node.bounds().items())
+        if isinstance(node, Or):
+            return " or ".join(f"({compile_node(item)})" for item in node.filters)
+        if isinstance(node, And):
+            return " and ".join(f"({compile_node(item)})" for item in node.filters)
+        if isinstance(node, Not):
+            return f"not ({compile_node(node.inner)})"
+        raise TypeError(f"Unsupported filter {node!r}")
+
+    return compile_node(query_filter)
+
+
+def to_pinecone(query_filter: Union[Filter, dict, None]) -> Optional[dict]:
+    """Pinecone metadata filter. Pinecone has no not operator and only compares numbers, so negations are pushed
+    down to the fields and date ranges compare the <field>_days number stored next to the date at upload.
+
+    :param query_filter: Filter to compile
+    :return: Filter dict, None without a filter
+    """
+    query_filter = as_filter(query_filter)
+    if query_filter is None:
+        return None
+
+    def compile_node(node: Filter) -> dict:
+        if isinstance(node, Ne):
+            return {node.field: {"$ne": node.value}}
+        if isinstance(node, Eq):
+            return {node.field: {"$eq": node.value}}
+        if isinstance(node, NotIn):
+            return {node.field: {"$nin": list(node.values)}}
+        if isinstance(node, In):
+            return {node.field: {"$in": list(node.values)}}
+        if isinstance(node, Range):
+            if node.is_date():
+                return {node.field + DAYS_SUFFIX: {f"${name}": date_number(value)
+                                                   for name, value in node.bounds().items()}}
+            return {node.field: {f"${name}": value for name, value in node.bounds().items()}}
+        if isinstance(node, Or):
+            return {"$or": [compile_node(item) for item in node.filters]}
+        if isinstance(node, And):
+            return {"$and": [compile_node(item) for item in node.filters]}
+        if isinstance(node, Not):
+            return compile_node(node.inner.negated())
+        raise TypeError(f"Unsupported filter {node!r}")
+
+    return compile_node(query_filter)
+
+
+def to_qdrant(query_filter: Union[Filter, dict, None], prefix: str = "metadata."):
+    """QDrant Filter for metadata stored under prefix in the payload. qdrant_client is only imported here.
+
+    :param query_filter: Filter to compile
+    :param prefix: Payload path of the metadata
+    :return: qdrant_client.models.Filter, None without a filter
+    """
+    query_filter = as_filter(query_filter)
+    if query_filter is None:
+        return None
+    from qdrant_client import models
+
+    def match(node: Eq):
+        if isinstance(node.value, float):
+            # MatchValue only takes keywords, ints and bools
+            return models.FieldCondition(key=prefix + node.field, range=models.Range(gte=node.value, lte=node.value))
+        return models.FieldCondition(key=prefix + node.field, match=models.MatchValue(value=node.value))
+
+    def compile_node(node: Filter):
+        if isinstance(node, Ne):
+            return models.Filter(must_not=[match(node)])
+        if isinstance(node, Eq):
+            return match(node)
+        if isinstance(node, NotIn):
+            return models.FieldCondition(key=prefix + node.field,
+                                         match=models.MatchExcept(**{"except": list(node.values)}))
+        if isinstance(node, In):
+            return models.FieldCondition(key=prefix + node.field, match=models.MatchAny(any=list(node.values)))
+        if isinstance(node, Range):
+            bounds = node.bounds()
+            range_type = models.DatetimeRange if node.is_date() else models.Range
+            return models.FieldCondition(key=prefix + node.field, range=range_type(**bounds))
+        if isinstance(node, Or):
+            return models.Filter(should=[compile_node(item) for item in node.filters])
+        if isinstance(node, And):
+            return models.Filter(must=[compile_node(item) for item in node.filters])
+        if isinstance(node, Not):
+            return models.Filter(must_not=[compile_node(node.inner)])
+        raise TypeError(f"Unsupported filter {node!r}")
+
+    compiled = compile_node(query_filter)
+    return compiled if isinstance(compiled, models.Filter) else models.Filter(must=[compiled])
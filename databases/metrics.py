@@ -0,0 +1,252 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import http.server
+import inspect
+import threading
+import time
+from typing import Callable, Optional
+
+# Upper bounds in seconds, same spirit as the Prometheus client defaults but finer below 10ms
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Database methods timed by instrument_class
+INSTRUMENTED = ("encode", "encode_batch", "query", "query_batch", "aquery", "upload", "preprocess", "postprocess")
+
+# (id of the database, operation) of every instrumented call running in this context, so an override calling
+# super() is only counted once
+_active = contextvars.ContextVar("instrumented_calls", default=())
+
+
+class Metrics:
+    """Process wide call counts, error counts and latency histograms per (backend, operation).
+    Disabled by default, in which case an instrumented call costs one attribute check.
+
+    Args:
+        buckets (tuple): Upper bounds of the histogram buckets, in seconds.
+    """
+
+    def __init__(self,
+                 buckets: tuple = DEFAULT_BUCKETS
+                 ) -> None:
+        self.enabled = False
+        self.buckets = tuple(buckets)
+        # Optional OpenTelemetry tracer, every instrumented call becomes a span while set
+        self.tracer = None
+        self._listeners = []
+        # (backend, operation) -> [bucket counts, count, errors, summed seconds]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def enable(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+
+    def add_listener(self, listener: Callable) -> None:
+        """Call listener(backend, operation, seconds, error) after every instrumented call, e.g. to forward to
+        another metrics system
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable) -> None:
+        self._listeners.remove(listener)
+
+    def observe(self, backend: str, operation: str, seconds: float, error: bool = False) -> None:
+        """Record one call
+
+        :param backend: Name of the database class
+        :param operation: Name of the method
+        :param seconds: Time the call took
+        :param error: Whether the call raised
+        :return:
+        """
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get((backend, operation))
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0, 0, 0.0]
+                self._series[(backend, operation)] = series
+            series[0][bucket] += 1
+            series[1] += 1
+            series[2] += error
+            series[3] += seconds
+        for listener in self._listeners:
+            listener(backend, operation, seconds, error)
+
+    def snapshot(self) -> dict:
+        """Copy of everything recorded so far
+
+        :return: Dict of (backend, operation) -> dict of count, errors, seconds and cumulative bucket counts
+        """
+        with self._lock:
+            snapshot = {}
+            for key, (counts, count, errors, seconds) in self._series.items():
+                cumulative = 0
+                buckets = {}
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    buckets[bound] = cumulative
+                snapshot[key] = {"count": count, "errors": errors, "seconds": seconds, "buckets": buckets}
+            return snapshot
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def to_prometheus(self, prefix: str = "vectordb") -> str:
+        """Everything recorded so far in the Prometheus text exposition format
+
+        :param prefix: Prefix of every metric name
+        :return: Text to serve on a /metrics endpoint
+        """
+        lines = [
+            f"# HELP {prefix}_operation_seconds Latency of database operations",
+            f"# TYPE {prefix}_operation_seconds histogram",
+        ]
+        errors = [
+            f"# HELP {prefix}_operation_errors_total Database operations that raised",
+            f"# TYPE {prefix}_operation_errors_total counter",
+        ]
+        for (backend, operation), series in sorted(self.snapshot().items()):
+            labels = f'backend="{backend}",operation="{operation}"'
+            for bound, cumulative in series["buckets"].items():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{prefix}_operation_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{prefix}_operation_seconds_sum{{{labels}}} {series['seconds']}")
+            lines.append(f"{prefix}_operation_seconds_count{{{labels}}} {series['count']}")
+            errors.append(f"{prefix}_operation_errors_total{{{labels}}} {series['errors']}")
+        return "\n".join(lines + errors) + "\n"
+
+
+metrics = Metrics()
+
+
+def enable_opentelemetry(meter_provider=None, tracer_provider=None) -> None:
+    """Forward every instrumented call to OpenTelemetry as a duration histogram, an error counter and a span.
+    Requires the opentelemetry-api package.
+
+    :param meter_provider: MeterProvider to use, the global one if not specified
+    :param tracer_provider: TracerProvider to use, the global one if not specified
+    :return:
+    """
+    from opentelemetry import metrics as otel_metrics
+    from opentelemetry import trace
+
+    meter = (meter_provider or otel_metrics.get_meter_provider()).get_meter(__name__)
+    duration = meter.create_histogram("vectordb.operation.duration", unit="s",
+                                      description="Latency of database operations")
+    failures = meter.create_counter("vectordb.operation.errors", description="Database operations that raised")
+
+    def listener(backend, operation, seconds, error):
+        attributes = {"backend": backend, "operation": operation}
+        duration.record(seconds, attributes)
+        if error:
+            failures.add(1, attributes)
+
+    metrics.add_listener(listener)
+    metrics.tracer = (tracer_provider or trace.get_tracer_provider()).get_tracer(__name__)
+    metrics.enable()
+
+
+def serve_prometheus(port: int = 9100, address: str = "") -> http.server.ThreadingHTTPServer:
+    """Serve to_prometheus() on /metrics from a background thread, and enable metrics
+
+    :param port: Port to listen on
+    :param address: Address to bind, every interface if empty
+    :return: The server, call shutdown() to stop it
+    """
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((address, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    metrics.enable()
+    return server
+
+
+def _enter(database, operation: str) -> Optional[contextvars.Token]:
+    key = (id(database), operation)
+    active = _active.get()
+    if key in active:
+        return None
+    return _active.set(active + (key,))
+
+
+def _span(backend: str, operation: str):
+    tracer = metrics.tracer
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.start_as_current_span(f"{backend}.{operation}")
+
+
+def instrument(method: Callable, operation: str) -> Callable:
+    """Wrap a database method so every call is timed while metrics are enabled
+
+    :param method: Function or coroutine function taking the database as first argument
+    :param operation: Name the calls are recorded under
+    :return: Wrapped method
+    """
+    if getattr(method, "_instrumented", False):
+        return method
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if not metrics.enabled:
+                return await method(self, *args, **kwargs)
+            token = _enter(self, operation)
+            if token is None:
+                return await method(self, *args, **kwargs)
+            backend = type(self).__name__
+            error = False
+            start_time = time.perf_counter()
+            try:
+                with _span(backend, operation):
+                    return await method(self, *args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                metrics.observe(backend, operation, time.perf_counter() - start_time, error)
+                _active.reset(token)
+    else:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not metrics.enabled:
+                return method(self, *args, **kwargs)
+            token = _enter(self, operation)
+            if token is None:
+                return method(self, *args, **kwargs)
+            backend = type(self).__name__
+            error = False
+            start_time = time.perf_counter()
+            try:
+                with _span(backend, operation):
+                    return method(self, *args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                metrics.observe(backend, operation, time.perf_counter() - start_time, error)
+                _active.reset(token)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+def instrument_class(cls) -> None:
+    """Instrument every method in INSTRUMENTED that the class itself defines
+    """
+    for name in INSTRUMENTED:
+        method = cls.__dict__.get(name)
+        if callable(method):
+            setattr(cls, name, instrument(method, name))
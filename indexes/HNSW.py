@@ -0,0 +1,277 @@
+import heapq
+import json
+import math
+import threading
+
+import numpy as np
+
+from indexes.index import Index
+
+
+class HNSWIndex(Index):
+    """Hierarchical Navigable Small World graph (Malkov & Yashunin) written with NumPy, no external service needed.
+    Vectors can be added at any time, every insertion links the new node into the existing graph.
+
+    Args:
+        dimensions (int): Size of the vectors.
+        M (int): Links per node on the upper layers, twice as many on layer 0. Higher for better recall, more memory.
+        ef_construction (int): Size of the candidate list while inserting. Higher for a better graph, slower inserts.
+        ef_search (int): Size of the candidate list while searching. Higher for better recall, slower queries.
+        initial_capacity (int): Amount of vectors to preallocate room for. Doubles whenever it fills up.
+        seed (int): Seed for picking each node's layer.
+    """
+
+    def __init__(self,
+                 dimensions: int,
+                 M: int = 16,
+                 ef_construction: int = 200,
+                 ef_search: int = 64,
+                 initial_capacity: int = 1024,
+                 seed: int = 42
+                 ) -> None:
+        self.dimensions = dimensions
+        self.M = M
+        self.max_links_0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.initial_capacity = initial_capacity
+        self.seed = seed
+        self._level_multiplier = 1 / math.log(M)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self._vectors = np.empty((self.initial_capacity, self.dimensions), dtype=np.float32)
+        # _links[node][level] is the list of neighbours of node on that level
+        self._links = []
+        self._size = 0
+        self._entry_point = None
+        self._max_level = -1
+        self._rng = np.random.default_rng(self.seed)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, amount: int) -> None:
+        needed = self._size + amount
+        capacity = len(self._vectors)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        vectors = np.empty((capacity, self.dimensions), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+
+    def add(self, vectors: np.ndarray) -> None:
+        """Insert vectors one by one into the graph
+
+        :param vectors: 2D array of vectors
+        :return:
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        with self._lock:
+            self._reserve(len(vectors))
+            for vector in vectors:
+                node = self._size
+                self._vectors[node] = vector
+                self._size += 1
+                self._insert(node)
+
+    def update(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """Replace stored vectors. Links are kept as they are, which is fine for small changes to a vector.
+
+        :param rows: Rows to replace
+        :param vectors: New vectors
+        :return:
+        """
+        with self._lock:
+            self._vectors[np.asarray(rows)] = vectors
+
+    def _random_level(self) -> int:
+        return int(-math.log(1.0 - self._rng.random()) * self._level_multiplier)
+
+    def _insert(self, node: int) -> None:
+        query = self._vectors[node]
+        level = self._random_level()
+        self._links.append([[] for _ in range(level + 1)])
+
+        if self._entry_point is None:
+            self._entry_point = node
+            self._max_level = level
+            return
+
+        entry_points = [self._entry_point]
+        # Greedy descent through the layers above the new node's own top layer
+        for layer in range(self._max_level, level, -1):
+            nearest = self._search_layer(query, entry_points, 1, layer)
+            entry_points = [nearest[0][1]]
+
+        for layer in range(min(level, self._max_level), -1, -1):
+            candidates = self._search_layer(query, entry_points, self.ef_construction, layer)
+            max_links = self.max_links_0 if layer == 0 else self.M
+            neighbours = self._select_neighbours(query, candidates, self.M)
+            self._links[node][layer] = neighbours
+            for neighbour in neighbours:
+                links = self._links[neighbour][layer]
+                links.append(node)
+                if len(links) > max_links:
+                    self._shrink(neighbour, layer, max_links)
+            entry_points = [candidate for _, candidate in candidates]
+
+        if level > self._max_level:
+            self._entry_point = node
+            self._max_level = level
+
+    def _shrink(self, node: int, layer: int, max_links: int) -> None:
+        """Trim a node's links back to max_links, keeping the most useful ones
+        """
+        links = self._links[node][layer]
+        scores = self._vectors[links] @ self._vectors[node]
+        candidates = sorted(zip(scores.tolist(), links), reverse=True)
+        self._links[node][layer] = self._select_neighbours(self._vectors[node], candidates, max_links)
+
+    def _select_neighbours(self, query: np.ndarray, candidates: list, amount: int) -> list:
+        """Neighbour selection heuristic. A candidate is skipped when it is closer to an already selected neighbour
+        than to the query, which keeps links spread out in different directions.
+
+        :param query: Vector the neighbours are for
+        :param candidates: (score, node) pairs sorted best first
+        :param amount: Max amount of neighbours
+        :return: Selected nodes
+        """
+        selected = []
+        skipped = []
+        for score, candidate in candidates:
+            if len(selected) >= amount:
+                break
+            if selected:
+                closest_selected = np.max(self._vectors[selected] @ self._vectors[candidate])
+                if closest_selected > score:
+                    skipped.append(candidate)
+                    continue
+            selected.append(candidate)
+        # Fill up with the skipped candidates so sparse regions still get enough links
+        for candidate in skipped:
+            if len(selected) >= amount:
+                break
+            selected.append(candidate)
+        return selected
+
+    def _search_layer(self, query: np.ndarray, entry_points: list, ef: int, layer: int) -> list:
+        """Best first search within a single layer
+
+        :param query: Query vector
+        :param entry_points: Nodes to start from
+        :param ef: Amount of nearest nodes to keep track of
+        :param layer: Layer to search
+        :return: Up to ef (score, node) pairs sorted best first
+        """
+        visited = set(entry_points)
+        scores = (self._vectors[entry_points] @ query).tolist()
+        # Candidates to expand, best first (max heap through negated scores)
+        candidates = [(-score, node) for score, node in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        # Current results, worst first so it can be trimmed to ef
+        results = [(score, node) for score, node in zip(scores, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            negative_score, node = heapq.heappop(candidates)
+            if -negative_score < results[0][0] and len(results) >= ef:
+                break
+            links = self._links[node][layer] if layer < len(self._links[node]) else []
+            fresh = [link for link in links if link not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for score, link in zip((self._vectors[fresh] @ query).tolist(), fresh):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, link))
+                    heapq.heappush(results, (score, link))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def search(self, vector: np.ndarray, top_k: int = 5, vectors=None) -> tuple:
+        """Approximate top_k search
+
+        :param vector: Query vector
+        :param top_k: How many results to return
+        :param vectors: Unused, HNSW keeps its own copy of every vector
+        :return: Tuple of (rows, scores), best first
+        """
+        if self._entry_point is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray(vector, dtype=np.float32)
+        entry_points = [self._entry_point]
+        for layer in range(self._max_level, 0, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, layer)[0][1]]
+        results = self._search_layer(query, entry_points, max(self.ef_search, top_k), 0)[:top_k]
+        rows = np.array([node for _, node in results], dtype=np.int64)
+        scores = np.array([score for score, _ in results], dtype=np.float32)
+        return rows, scores
+
+    def save(self, path: str) -> None:
+        """Write the index to a single .npz file
+
+        :param path: File to write to
+        :return:
+        """
+        with self._lock:
+            counts = []
+            flat = []
+            levels = []
+            for links in self._links:
+                levels.append(len(links))
+                for layer_links in links:
+                    counts.append(len(layer_links))
+                    flat.extend(layer_links)
+            settings = {
+                'dimensions': self.dimensions,
+                'M': self.M,
+                'ef_construction': self.ef_construction,
+                'ef_search': self.ef_search,
+                'seed': self.seed,
+                'entry_point': self._entry_point,
+                'max_level': self._max_level
+            }
+            np.savez(path,
+                     settings=np.array(json.dumps(settings)),
+                     vectors=self._vectors[:self._size],
+                     levels=np.array(levels, dtype=np.int32),
+                     counts=np.array(counts, dtype=np.int32),
+                     links=np.array(flat, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path: str):
+        """Read an index written by save
+
+        :param path: File to read from
+        :return: HNSWIndex
+        """
+        with np.load(path) as data:
+            settings = json.loads(str(data['settings']))
+            index = cls(dimensions=settings['dimensions'], M=settings['M'],
+                        ef_construction=settings['ef_construction'], ef_search=settings['ef_search'],
+                        initial_capacity=max(len(data['vectors']), 1), seed=settings['seed'])
+            index._vectors[:len(data['vectors'])] = data['vectors']
+            index._size = len(data['vectors'])
+            counts = data['counts'].tolist()
+            flat = data['links'].tolist()
+            position = 0
+            count_position = 0
+            for level_count in data['levels'].tolist():
+                links = []
+                for _ in range(level_count):
+                    count = counts[count_position]
+                    links.append(flat[position:position + count])
+                    position += count
+                    count_position += 1
+                index._links.append(links)
+        index._entry_point = settings['entry_point']
+        index._max_level = settings['max_level']
+        return index
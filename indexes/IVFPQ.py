@@ -0,0 +1,317 @@
+import json
+import logging
+import threading
+
+import numpy as np
+
+from indexes.index import Index, top_k_indices
+
+
+def kmeans(data: np.ndarray, clusters: int, iterations: int = 20, seed: int = 42) -> np.ndarray:
+    """Plain Lloyd's k-means, empty clusters are re-seeded with random points
+
+    :param data: 2D float32 array of training points
+    :param clusters: Amount of centroids
+    :param iterations: Amount of refinement passes
+    :param seed: Seed for the initial centroids
+    :return: 2D float32 array of centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=clusters, replace=len(data) < clusters)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(data, centroids)
+        counts = np.bincount(assignments, minlength=clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+    return centroids
+
+
+def nearest_centroids(data: np.ndarray, centroids: np.ndarray, chunk_size: int = 16384) -> np.ndarray:
+    """Index of the closest centroid (euclidean) for every point, computed in chunks to bound memory
+
+    :param data: 2D array of points
+    :param centroids: 2D array of centroids
+    :param chunk_size: Amount of points per chunk
+    :return: 1D int64 array of centroid indices
+    """
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        # ||x - c||^2 = ||x||^2 - 2x.c + ||c||^2, and ||x||^2 does not change the argmin
+        assignments[start:start + chunk_size] = np.argmin(centroid_norms - 2 * chunk @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFPQIndex(Index):
+    """Inverted file index with product quantization. A k-means coarse quantizer splits the vectors into lists, and the
+    residual of every vector to its list centroid is stored as one byte per subvector. At 768 dimensions with 96
+    subvectors each vector costs 96 bytes instead of 3 KB.
+
+    Queries only scan the n_probe closest lists and score codes through per-subvector lookup tables (asymmetric
+    distance computation). Optionally the best candidates are re-ranked with their original vectors, which the
+    database provides, so pair it with MemmapDB to keep the full vectors on disk.
+
+    Vectors added before training are kept uncompressed and searched exactly. Training happens automatically once
+    train_size vectors have been added, or explicitly through train(). Retraining needs the original vectors, since
+    everything already encoded is encoded again.
+
+    Args:
+        dimensions (int): Size of the vectors.
+        n_lists (int): Amount of coarse centroids (inverted lists).
+        n_subvectors (int): Amount of subvectors per vector, must divide dimensions. Equals bytes per vector.
+        n_probe (int): Amount of lists scanned per query. Higher for better recall, slower queries.
+        rerank (int): Amount of candidates re-scored with their original vectors, 0 to disable.
+        train_size (int): Amount of added vectors that triggers automatic training.
+        iterations (int): Amount of k-means passes while training.
+        seed (int): Seed for k-means initialization.
+    """
+
+    codebook_size = 256
+
+    def __init__(self,
+                 dimensions: int,
+                 n_lists: int = 1024,
+                 n_subvectors: int = 96,
+                 n_probe: int = 16,
+                 rerank: int = 0,
+                 train_size: int = 50000,
+                 iterations: int = 20,
+                 seed: int = 42
+                 ) -> None:
+        if dimensions % n_subvectors != 0:
+            raise ValueError(f"n_subvectors ({n_subvectors}) must divide dimensions ({dimensions})")
+        self.dimensions = dimensions
+        self.n_lists = n_lists
+        self.n_subvectors = n_subvectors
+        self.subvector_size = dimensions // n_subvectors
+        self.n_probe = n_probe
+        self.rerank = rerank
+        self.train_size = train_size
+        self.iterations = iterations
+        self.seed = seed
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.centroids = None
+        self.codebooks = None
+        self._pending = []
+        self._codes = np.empty((0, self.n_subvectors), dtype=np.uint8)
+        self._assignments = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self._lists = None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def memory_bytes(self) -> int:
+        """Approximate memory used by the index, excluding vectors still waiting for training
+        """
+        total = self._codes.nbytes + self._assignments.nbytes
+        if self.is_trained:
+            total += self.centroids.nbytes + self.codebooks.nbytes
+        return total
+
+    def train(self, sample: np.ndarray, vectors=None) -> None:
+        """Learn the coarse centroids and the product quantizer codebooks, then encode everything added so far.
+        Retraining an index that already holds encoded vectors encodes them again from their originals, which have
+        to be passed as vectors.
+
+        :param sample: 2D array of representative vectors, ideally several times n_lists and at least 256
+        :param vectors: Source of the original vectors (anything with fetch_vectors(rows)), required when retraining
+        :return:
+        """
+        sample = np.asarray(sample, dtype=np.float32)
+        with self._lock:
+            if self.is_trained and self._size and vectors is None:
+                raise ValueError("IVF-PQ index is already trained, pass vectors to re-encode the vectors it holds")
+            self._train(sample, vectors)
+
+    def _train(self, sample: np.ndarray, vectors=None, chunk_size: int = 65536) -> None:
+        self.logger.info(f"Training IVF-PQ on {len(sample)} vectors")
+        n_lists = min(self.n_lists, len(sample))
+        centroids = kmeans(sample, n_lists, self.iterations, self.seed)
+        residuals = sample - centroids[nearest_centroids(sample, centroids)]
+
+        codebooks = np.empty((self.n_subvectors, self.codebook_size, self.subvector_size), dtype=np.float32)
+        for j in range(self.n_subvectors):
+            subvectors = np.ascontiguousarray(residuals[:, j * self.subvector_size:(j + 1) * self.subvector_size])
+            codebooks[j] = kmeans(subvectors, self.codebook_size, self.iterations, self.seed + j + 1)
+        self.centroids = centroids
+        self.codebooks = codebooks
+
+        if self._pending or not self._size:
+            # Everything added before training gets encoded now
+            pending = np.concatenate(self._pending) if self._pending else np.empty((0, self.dimensions), np.float32)
+            self._pending = []
+            self._codes, self._assignments = self._encode(pending)
+        else:
+            # Retraining, codes from the old quantizer are meaningless now so every row is encoded again
+            encoded = []
+            for start in range(0, self._size, chunk_size):
+                rows = np.arange(start, min(start + chunk_size, self._size))
+                encoded.append(self._encode(np.asarray(vectors.fetch_vectors(rows), dtype=np.float32)))
+            self._codes = np.concatenate([codes for codes, _ in encoded])
+            self._assignments = np.concatenate([assignments for _, assignments in encoded])
+        self._lists = None
+
+    def _encode(self, vectors: np.ndarray) -> tuple:
+        """Coarse assignment and PQ codes of the residuals
+
+        :param vectors: 2D float32 array
+        :return: Tuple of (codes, assignments)
+        """
+        assignments = nearest_centroids(vectors, self.centroids)
+        residuals = vectors - self.centroids[assignments]
+        codes = np.empty((len(vectors), self.n_subvectors), dtype=np.uint8)
+        for j in range(self.n_subvectors):
+            subvectors = residuals[:, j * self.subvector_size:(j + 1) * self.subvector_size]
+            codes[:, j] = nearest_centroids(subvectors, self.codebooks[j])
+        return codes, assignments
+
+    def add(self, vectors: np.ndarray) -> None:
+        """Append vectors, encoding them if the index is trained
+
+        :param vectors: 2D array of vectors
+        :return:
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        with self._lock:
+            self._size += len(vectors)
+            if not self.is_trained:
+                self._pending.append(vectors)
+                if self._size >= self.train_size:
+                    self._train(np.concatenate(self._pending))
+                return
+            codes, assignments = self._encode(vectors)
+            self._codes = np.concatenate([self._codes, codes])
+            self._assignments = np.concatenate([self._assignments, assignments])
+            self._lists = None
+
+    def update(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """Re-encode vectors that were replaced
+
+        :param rows: Rows to replace
+        :param vectors: New vectors
+        :return:
+        """
+        rows = np.asarray(rows)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        with self._lock:
+            if not self.is_trained:
+                pending = np.concatenate(self._pending)
+                pending[rows] = vectors
+                self._pending = [pending]
+                return
+            codes, assignments = self._encode(vectors)
+            self._codes[rows] = codes
+            self._assignments[rows] = assignments
+            self._lists = None
+
+    def _inverted_lists(self) -> list:
+        """Rows belonging to each list, rebuilt lazily after adds
+        """
+        lists = self._lists
+        if lists is None:
+            order = np.argsort(self._assignments, kind="stable")
+            bounds = np.searchsorted(self._assignments[order], np.arange(len(self.centroids) + 1))
+            lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+            self._lists = lists
+        return lists
+
+    def search(self, vector: np.ndarray, top_k: int = 5, vectors=None) -> tuple:
+        """Approximate top_k search over the n_probe closest lists
+
+        :param vector: Query vector
+        :param top_k: How many results to return
+        :param vectors: Source of the original vectors (anything with fetch_vectors(rows)), used for re-ranking
+        :return: Tuple of (rows, scores), best first
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        if not self.is_trained:
+            if not self._pending:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            scores = np.concatenate(self._pending) @ query
+            rows = top_k_indices(scores, top_k)
+            return rows, scores[rows]
+
+        lists = self._inverted_lists()
+        codes = self._codes
+        coarse_scores = self.centroids @ query
+        probes = top_k_indices(coarse_scores, min(self.n_probe, len(self.centroids)))
+
+        # lookup[j, k] = query subvector j . codeword k of subspace j
+        lookup = np.einsum('jks,js->jk', self.codebooks, query.reshape(self.n_subvectors, self.subvector_size))
+        subspaces = np.arange(self.n_subvectors)
+        rows = []
+        scores = []
+        for probe in probes:
+            members = lists[probe]
+            if len(members) == 0:
+                continue
+            rows.append(members)
+            scores.append(coarse_scores[probe] + lookup[subspaces, codes[members]].sum(axis=1))
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate(rows)
+        scores = np.concatenate(scores)
+
+        if self.rerank and vectors is not None:
+            candidates = top_k_indices(scores, max(self.rerank, top_k))
+            rows = rows[candidates]
+            scores = vectors.fetch_vectors(rows) @ query
+        best = top_k_indices(scores, top_k)
+        return rows[best], scores[best].astype(np.float32)
+
+    def save(self, path: str) -> None:
+        """Write the index to a single .npz file. Must be trained.
+
+        :param path: File to write to
+        :return:
+        """
+        if not self.is_trained:
+            raise ValueError("Only trained IVF-PQ indexes can be saved")
+        settings = {
+            'dimensions': self.dimensions,
+            'n_lists': self.n_lists,
+            'n_subvectors': self.n_subvectors,
+            'n_probe': self.n_probe,
+            'rerank': self.rerank,
+            'train_size': self.train_size,
+            'iterations': self.iterations,
+            'seed': self.seed
+        }
+        with self._lock:
+            np.savez(path,
+                     settings=np.array(json.dumps(settings)),
+                     centroids=self.centroids,
+                     codebooks=self.codebooks,
+                     codes=self._codes,
+                     assignments=self._assignments)
+
+    @classmethod
+    def load(cls, path: str):
+        """Read an index written by save
+
+        :param path: File to read from
+        :return: IVFPQIndex
+        """
+        with np.load(path) as data:
+            index = cls(**json.loads(str(data['settings'])))
+            index.centroids = data['centroids']
+            index.codebooks = data['codebooks']
+            index._codes = data['codes']
+            index._assignments = data['assignments']
+        index._size = len(index._codes)
+        return index
+
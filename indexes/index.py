@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k highest scores, best first. Uses argpartition so only the top_k get sorted.
+
+    :param scores: 1D array of scores
+    :param top_k: How many indices to return
+    :return: Indices into scores
+    """
+    if top_k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class Index:
+    """Abstract class for approximate nearest neighbour indexes used by the local databases. Do not use directly.
+    Rows are assigned in the order vectors are added, starting at 0, and must line up with the database's rows.
+    Scores are inner products, so vectors should already be normalized when searching by cosine.
+    """
+
+    def __len__(self) -> int:
+        return 0
+
+    def add(self, vectors: np.ndarray) -> None:
+        """Method to append vectors to the index
+        """
+        pass
+
+    def update(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """Method to replace vectors already in the index
+        """
+        pass
+
+    def search(self, vector: np.ndarray, top_k: int = 5, vectors=None) -> tuple:
+        """Method to search the index
+
+        :param vector: Query vector
+        :param top_k: How many results to return
+        :param vectors: Optional source of the original vectors (anything with fetch_vectors(rows)), for indexes that re-rank
+        :return: Tuple of (rows, scores), best first
+        """
+        pass
+
+    def reset(self) -> None:
+        """Method to remove every vector from the index
+        """
+        pass
+
+    def save(self, path: str) -> None:
+        pass
+
+    @classmethod
+    def load(cls, path: str):
+        pass
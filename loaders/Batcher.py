@@ -0,0 +1,185 @@
+import collections
+import logging
+import time
+from typing import Optional
+
+import numpy as np
+
+from databases.encoder import SharedEncoder
+from loaders.EmbeddingCache import EmbeddingCache
+from loaders.IngestStats import IngestStats
+
+
+class EmbeddingBatcher:
+    """Collects chunks from many documents and encodes them in evenly sized batches.
+    Documents are handed back, in the order they were added, once every one of their chunks has a vector.
+
+    Args:
+        encoder (SharedEncoder): Model used to encode the chunks.
+        batch_size (int): Max amount of chunks per call to the encoder.
+        token_budget (int): If specified, max amount of tokens per call to the encoder. Batches stop growing at whichever limit is hit first.
+        history_size (int): Amount of per-batch throughput records to keep around in history.
+        cache (EmbeddingCache): If specified, chunks already in the cache are not encoded again and new embeddings are added to it.
+        model_name (str): Name of the model, part of the cache key.
+        stats (IngestStats): If specified, every encoded batch is recorded as the embed stage.
+    """
+
+    def __init__(self,
+                 encoder: SharedEncoder,
+                 batch_size: int = 64,
+                 token_budget: Optional[int] = None,
+                 history_size: int = 1000,
+                 cache: Optional[EmbeddingCache] = None,
+                 model_name: str = "all-mpnet-base-v2",
+                 stats: Optional[IngestStats] = None
+                 ) -> None:
+        self.encoder = encoder
+        self.cache = cache
+        self.model_name = model_name
+        self.stats = stats
+        self.batch_size = batch_size
+        self.token_budget = token_budget
+        self.dimensions = encoder.get_sentence_embedding_dimension()
+        self.logger = logging.getLogger(__name__)
+
+        # Documents in the order they were added: key -> [texts, vectors, chunks still missing a vector]
+        self._documents = collections.OrderedDict()
+        # Chunks waiting to be encoded: (key, index within the document, token count)
+        self._waiting = collections.deque()
+        self._waiting_tokens = 0
+
+        self.history = collections.deque(maxlen=history_size)
+        self.totals = {"batches": 0, "chunks": 0, "tokens": 0, "seconds": 0.0}
+
+    def add(self, key, texts: list) -> list:
+        """Queue every chunk of a document for encoding
+
+        :param key: Anything identifying the document, must be unique among pending documents
+        :param texts: Chunks of the document
+        :return: List of (key, texts, vectors) for each document that was fully encoded
+        """
+        vectors = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        missing = list(range(len(texts)))
+        if self.cache is not None and texts:
+            missing = []
+            for i, vector in enumerate(self.cache.get_many(self.model_name, texts)):
+                if vector is None:
+                    missing.append(i)
+                else:
+                    vectors[i] = vector
+
+        self._documents[key] = [texts, vectors, len(missing)]
+        for i, tokens in zip(missing, self._count_tokens([texts[i] for i in missing])):
+            self._waiting.append((key, i, tokens))
+            self._waiting_tokens += tokens
+
+        while self._is_full():
+            self._encode_next()
+        return self._pop_finished()
+
+    def flush(self) -> list:
+        """Encode everything still waiting, no matter how small the final batch is
+
+        :return: List of (key, texts, vectors) for each remaining document
+        """
+        while self._waiting:
+            self._encode_next()
+        return self._pop_finished()
+
+    def discard(self) -> list:
+        """Drop every pending document, used when the encoder fails part way through a batch
+
+        :return: Keys of the dropped documents
+        """
+        keys = list(self._documents)
+        self._documents.clear()
+        self._waiting.clear()
+        self._waiting_tokens = 0
+        return keys
+
+    def _count_tokens(self, texts: list) -> list:
+        """Count tokens for each chunk in a single tokenizer call. Only needed when a token budget is set.
+
+        :param texts: Chunks to count
+        :return: Token count for each chunk, capped to what the model will actually read
+        """
+        if self.token_budget is None:
+            return [0] * len(texts)
+        max_length = self.encoder.max_seq_length
+        encoded = self.encoder.tokenizer(texts, add_special_tokens=True, truncation=True, max_length=max_length)
+        return [len(ids) for ids in encoded['input_ids']]
+
+    def _is_full(self) -> bool:
+        if len(self._waiting) >= self.batch_size:
+            return True
+        return self.token_budget is not None and self._waiting_tokens >= self.token_budget
+
+    def _encode_next(self) -> None:
+        """Encode one batch from the front of the waiting chunks and send the vectors back to their documents
+        """
+        batch = []
+        tokens = 0
+        while self._waiting and len(batch) < self.batch_size:
+            chunk_tokens = self._waiting[0][2]
+            if self.token_budget is not None and batch and tokens + chunk_tokens > self.token_budget:
+                break
+            batch.append(self._waiting.popleft())
+            tokens += chunk_tokens
+        self._waiting_tokens -= tokens
+
+        texts = [self._documents[key][0][i] for key, i, _ in batch]
+        start_time = time.perf_counter()
+        vectors = self.encoder.encode(texts, batch_size=len(texts), show_progress_bar=False)
+        elapsed = time.perf_counter() - start_time
+        if self.cache is not None:
+            self.cache.put_many(self.model_name, texts, vectors)
+
+        for (key, i, _), vector in zip(batch, vectors):
+            document = self._documents[key]
+            document[1][i] = vector
+            document[2] -= 1
+
+        self._record(len(batch), tokens, elapsed)
+
+    def _record(self, chunks: int, tokens: int, elapsed: float) -> None:
+        """Keep track of encoder throughput so the batch size can be tuned per device
+        """
+        chunks_per_second = chunks / elapsed if elapsed > 0 else float("inf")
+        self.history.append({
+            "chunks": chunks,
+            "tokens": tokens,
+            "seconds": elapsed,
+            "chunks_per_second": chunks_per_second
+        })
+        self.totals["batches"] += 1
+        self.totals["chunks"] += chunks
+        self.totals["tokens"] += tokens
+        self.totals["seconds"] += elapsed
+        if self.stats is not None:
+            self.stats.record("embed", elapsed, chunks)
+        self.logger.info(f"Encoded batch of {chunks} chunks ({tokens} tokens) in {elapsed:.4f}s, "
+                         f"{chunks_per_second:.1f} chunks/s")
+
+    def _pop_finished(self) -> list:
+        """Remove documents that have every vector from the front of the queue, keeping insertion order
+        """
+        finished = []
+        while self._documents:
+            key, document = next(iter(self._documents.items()))
+            if document[2] > 0:
+                break
+            del self._documents[key]
+            finished.append((key, document[0], document[1]))
+        return finished
+
+    def throughput(self) -> dict:
+        """Summary of every batch encoded so far
+
+        :return: Dict with totals and average chunks/tokens per second
+        """
+        seconds = self.totals["seconds"]
+        return {
+            **self.totals,
+            "chunks_per_second": self.totals["chunks"] / seconds if seconds > 0 else 0.0,
+            "tokens_per_second": self.totals["tokens"] / seconds if seconds > 0 else 0.0,
+        }
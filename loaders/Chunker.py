@@ -0,0 +1,221 @@
+import json
+import os
+import re
+import threading
+from typing import Optional
+
+# One tokenizer and max_seq_length per model per process, so chunkers pickled into every extraction task don't
+# reload them
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+_max_seq_lengths = {}
+
+# A sentence runs up to terminal punctuation followed by whitespace, a capital letter (newlines are removed by
+# cleaning, so "end.Next" is common) or the end of the text
+_SENTENCE = re.compile(r"\S.*?(?:[.!?]+(?=\s|[A-Z]|\Z)|\Z)", re.S)
+
+
+def _repo_id(model_name: str) -> str:
+    # Sentence Transformer shorthands like all-mpnet-base-v2 live under sentence-transformers/
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def max_seq_length(model_name: str) -> int:
+    """Amount of tokens a Sentence Transformer encodes before truncating. Read from the model's
+    sentence_bert_config.json like SentenceTransformer does, without loading the model.
+
+    :param model_name: Sentence Transformer model name or local directory
+    :return: max_seq_length of the model
+    """
+    length = _max_seq_lengths.get(model_name)
+    if length is None:
+        if os.path.isdir(model_name):
+            path = os.path.join(model_name, "sentence_bert_config.json")
+        else:
+            from huggingface_hub import hf_hub_download
+            path = hf_hub_download(_repo_id(model_name), "sentence_bert_config.json")
+        with open(path, "r") as file:
+            length = json.load(file)["max_seq_length"]
+        _max_seq_lengths[model_name] = length
+    return length
+
+
+def chunk_text(text: str, max_chunk_size: int, chunk_overlap: int) -> list:
+    """Cut down text from a PDF into reasonable chunks
+
+    :param text: Cleaned text of the whole document
+    :param max_chunk_size: Max amount of characters per chunk
+    :param chunk_overlap: Amount of overlap between chunks
+    :return: List of chunk strings
+    """
+    chunked_text = []
+    start_idx = 0
+    while start_idx < len(text):
+        end_idx = start_idx + max_chunk_size
+        chunked_text.append(text[start_idx:end_idx])
+        start_idx = end_idx - chunk_overlap
+    return chunked_text
+
+
+class Chunker:
+    """Splits the cleaned text of a document into the chunks that get embedded. Chunkers run inside the extraction
+    worker processes, so they must be picklable and cheap to pickle.
+    """
+
+    def prepare(self) -> None:
+        """Called once in the main process before the chunker is sent to the extraction workers
+        """
+        pass
+
+    def spans(self, text: str) -> list:
+        """(start, end) character offsets of every chunk within text
+        """
+        pass
+
+    def chunk(self, text: str) -> list:
+        """Chunks of text, each sliced once from its offsets
+
+        :param text: Cleaned text of the whole document
+        :return: List of chunk strings
+        """
+        return [text[start:end] for start, end in self.spans(text)]
+
+
+class CharacterChunker(Chunker):
+    """Fixed size character windows, the original chunking. Ignores the model's token limit, so long chunks are
+    truncated by the encoder.
+
+    Args:
+        max_chunk_size (int): Max amount of characters per chunk.
+        chunk_overlap (int): Amount of characters shared by consecutive chunks.
+    """
+
+    def __init__(self,
+                 max_chunk_size: int = 1000,
+                 chunk_overlap: int = 20
+                 ) -> None:
+        self.max_chunk_size = max_chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def spans(self, text: str) -> list:
+        spans = []
+        start_idx = 0
+        while start_idx < len(text):
+            end_idx = start_idx + self.max_chunk_size
+            spans.append((start_idx, min(end_idx, len(text))))
+            start_idx = end_idx - self.chunk_overlap
+        return spans
+
+    def chunk(self, text: str) -> list:
+        return chunk_text(text, self.max_chunk_size, self.chunk_overlap)
+
+
+class TokenChunker(Chunker):
+    """Packs whole sentences into chunks that fit the model's token limit, so every chunk is encoded in full.
+    Sentences are tokenized in batches with the model's own (fast) tokenizer, and chunks are tracked as character
+    offsets into the document. Sentences longer than the limit are split on token boundaries.
+    Consecutive chunks share trailing sentences worth up to overlap_tokens.
+
+    Args:
+        model_name (str): Sentence Transformer model whose tokenizer is used.
+        max_tokens (int): Max tokens the encoder reads per chunk. If not specified it is the model's max_seq_length (384 for all-mpnet-base-v2). Special tokens are subtracted from it.
+        overlap_tokens (int): Max amount of tokens shared by consecutive chunks.
+        batch_size (int): Amount of sentences tokenized per tokenizer call.
+    """
+
+    def __init__(self,
+                 model_name: str = "all-mpnet-base-v2",
+                 max_tokens: Optional[int] = None,
+                 overlap_tokens: int = 32,
+                 batch_size: int = 256
+                 ) -> None:
+        if max_tokens is not None and overlap_tokens >= max_tokens:
+            raise ValueError(f"overlap_tokens ({overlap_tokens}) must be smaller than max_tokens ({max_tokens})")
+        self.model_name = model_name
+        self._max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.batch_size = batch_size
+
+    @property
+    def max_tokens(self) -> int:
+        """Max tokens the encoder reads per chunk, the model's max_seq_length unless specified
+        """
+        if self._max_tokens is None:
+            self._max_tokens = max_seq_length(self.model_name)
+        return self._max_tokens
+
+    def prepare(self) -> None:
+        # Look the limit up once here instead of in every worker process
+        _ = self.max_tokens
+
+    @property
+    def tokenizer(self):
+        """Fast tokenizer of the model, loaded once per process
+        """
+        tokenizer = _tokenizers.get(self.model_name)
+        if tokenizer is None:
+            with _tokenizers_lock:
+                tokenizer = _tokenizers.get(self.model_name)
+                if tokenizer is None:
+                    from transformers import AutoTokenizer
+                    tokenizer = AutoTokenizer.from_pretrained(_repo_id(self.model_name), use_fast=True)
+                    _tokenizers[self.model_name] = tokenizer
+        return tokenizer
+
+    @property
+    def budget(self) -> int:
+        """Tokens available for text once the model's special tokens are added
+        """
+        budget = self.max_tokens - self.tokenizer.num_special_tokens_to_add()
+        # Long sentences are split in steps of budget - overlap_tokens, which has to stay positive
+        if self.overlap_tokens >= budget:
+            raise ValueError(f"overlap_tokens ({self.overlap_tokens}) must be smaller than the {budget} tokens left "
+                             f"for text once {self.model_name}'s special tokens are added")
+        return budget
+
+    def _units(self, text: str) -> list:
+        """Sentences as (start, end, tokens), with sentences over the budget split into overlapping windows
+        """
+        sentences = [match.span() for match in _SENTENCE.finditer(text)]
+        budget = self.budget
+        step = budget - self.overlap_tokens
+        units = []
+        for first in range(0, len(sentences), self.batch_size):
+            batch = sentences[first:first + self.batch_size]
+            offsets = self.tokenizer([text[start:end] for start, end in batch], add_special_tokens=False,
+                                     return_offsets_mapping=True)["offset_mapping"]
+            for (start, end), tokens in zip(batch, offsets):
+                if len(tokens) <= budget:
+                    if tokens:
+                        units.append((start, end, len(tokens)))
+                    continue
+                for window in range(0, len(tokens), step):
+                    window_tokens = tokens[window:window + budget]
+                    units.append((start + window_tokens[0][0], start + window_tokens[-1][1], len(window_tokens)))
+                    if window + budget >= len(tokens):
+                        break
+        return units
+
+    def spans(self, text: str) -> list:
+        budget = self.budget
+        spans = []
+        current = []
+        tokens = 0
+        for unit in self._units(text):
+            if current and tokens + unit[2] > budget:
+                spans.append((current[0][0], current[-1][1]))
+                # Carry the last sentences over into the next chunk, as many as fit in overlap_tokens
+                kept = 0
+                keep = len(current)
+                while keep > 0 and kept + current[keep - 1][2] <= self.overlap_tokens:
+                    keep -= 1
+                    kept += current[keep][2]
+                current = current[keep:]
+                tokens = kept
+                while current and tokens + unit[2] > budget:
+                    tokens -= current.pop(0)[2]
+            current.append(unit)
+            tokens += unit[2]
+        if current:
+            spans.append((current[0][0], current[-1][1]))
+        return spans
@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Persistent cache of chunk embeddings stored in SQLite, keyed by model name and a hash of the chunk text.
+    Re-ingesting the same corpus only encodes chunks that actually changed. Least recently used entries are
+    evicted once the cache holds more than max_entries.
+
+    Args:
+        filename (str): SQLite file to keep the cache in.
+        max_entries (int): Max amount of cached embeddings.
+    """
+
+    # SQLite limits the amount of parameters per statement
+    _lookup_size = 500
+
+    def __init__(self,
+                 filename: str = "embedding_cache.sqlite",
+                 max_entries: int = 1_000_000
+                 ) -> None:
+        self.filename = filename
+        self.max_entries = max_entries
+        self.logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash BLOB NOT NULL,
+                vector BLOB NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (model, hash)
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+        self._count = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, model_name: str, texts: list) -> list:
+        """Look up the embeddings of several chunks at once
+
+        :param model_name: Model the embeddings were made with
+        :param texts: Chunks to look up
+        :return: float32 vector for each chunk, None where it is not cached
+        """
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self._lookup_size):
+                lookup = keys[start:start + self._lookup_size]
+                rows = self._connection.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(lookup))})",
+                    [model_name, *lookup]
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time_ns()
+                self._connection.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                                             [(now, model_name, key) for key in found])
+                self._connection.commit()
+            hits = sum(key in found for key in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+    def put_many(self, model_name: str, texts: list, vectors) -> None:
+        """Store freshly encoded embeddings, evicting the least recently used ones if the cache is full
+
+        :param model_name: Model the embeddings were made with
+        :param texts: Chunks that were encoded
+        :param vectors: Embedding of each chunk
+        :return:
+        """
+        now = time.time_ns()
+        rows = [(model_name, self.key(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)", rows)
+            self._count += self._connection.total_changes - before
+            if self._count > self.max_entries:
+                overflow = self._count - self.max_entries
+                self._connection.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,))
+                self._count -= overflow
+                self.evictions += overflow
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def stats(self) -> dict:
+        """Hit/miss counters since the cache was opened
+
+        :return: Dict of hits, misses, evictions, hit rate and size
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._count
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM embeddings")
+            self._connection.commit()
+            self._count = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
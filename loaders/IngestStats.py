@@ -0,0 +1,102 @@
+import contextlib
+import threading
+import time
+
+
+class IngestStats:
+    """Per-stage timings, throughput counters and queue depths of one ingestion run. Thread safe, and cheap enough
+    to stay on all the time (a perf_counter call and a lock per document or batch).
+
+    Stage times are busy time summed over every worker running that stage, so a stage with several workers can
+    report more seconds than the wall time of the run. Stages: parse, clean, chunk (extraction processes),
+    embed (encoding threads) and upload (uploader).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Start a new run, dropping everything recorded so far
+        """
+        with self._lock:
+            # stage -> [calls, items, seconds, slowest call]
+            self._stages = {}
+            self._counters = {"documents": 0, "failed": 0, "chunks": 0, "bytes": 0}
+            # queue -> [samples, summed depth, max depth]
+            self._queues = {}
+            self.started_at = time.perf_counter()
+            self.finished_at = None
+
+    def record(self, stage: str, seconds: float, items: int = 1) -> None:
+        """Add one call of a stage
+
+        :param stage: Name of the stage
+        :param seconds: Time the call took
+        :param items: Amount of documents, chunks or vectors the call handled
+        :return:
+        """
+        with self._lock:
+            entry = self._stages.setdefault(stage, [0, 0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += items
+            entry[2] += seconds
+            entry[3] = max(entry[3], seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage: str, items: int = 1):
+        """Time the body of a with block as one call of a stage
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start_time, items)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def sample_queue(self, name: str, depth: int) -> None:
+        """Record how many items are waiting in a queue right now
+        """
+        with self._lock:
+            entry = self._queues.setdefault(name, [0, 0, 0])
+            entry[0] += 1
+            entry[1] += depth
+            entry[2] = max(entry[2], depth)
+
+    def finish(self) -> None:
+        self.finished_at = time.perf_counter()
+
+    def summary(self) -> dict:
+        """Throughput of the whole run and the breakdown per stage
+
+        :return: Dict of wall time, counters, documents/chunks/bytes per second, stages and queue depths
+        """
+        with self._lock:
+            wall = (self.finished_at or time.perf_counter()) - self.started_at
+            per_second = lambda amount: round(amount / wall, 2) if wall > 0 else None
+            busy = sum(entry[2] for entry in self._stages.values())
+            return {
+                "wall_seconds": round(wall, 4),
+                **self._counters,
+                "documents_per_second": per_second(self._counters["documents"]),
+                "chunks_per_second": per_second(self._counters["chunks"]),
+                "bytes_per_second": per_second(self._counters["bytes"]),
+                "stages": {
+                    stage: {
+                        "calls": calls,
+                        "items": items,
+                        "seconds": round(seconds, 4),
+                        "mean_ms": round(seconds / calls * 1000, 4),
+                        "max_ms": round(slowest * 1000, 4),
+                        "share": round(seconds / busy, 4) if busy else 0.0,
+                    }
+                    for stage, (calls, items, seconds, slowest) in self._stages.items()
+                },
+                "queues": {
+                    name: {"mean": round(total / samples, 2), "max": largest}
+                    for name, (samples, total, largest) in self._queues.items()
+                },
+            }
@@ -1,35 +1,131 @@
-import asyncio
 import concurrent.futures
-import gc
+import itertools
 import logging
+import multiprocessing
 import os
-import re
+import queue
+import threading
 import time
-from typing import Optional
+from typing import Iterable, Iterator, Optional, Union
 
 import PyPDF2
-import pandas as pd
-import torch
-from sentence_transformers import SentenceTransformer
+import numpy as np
 from tqdm import tqdm
 
+from databases.batch import VectorBatch, rebatch
+from databases.encoder import SharedEncoder
+from loaders.Batcher import EmbeddingBatcher
+from loaders.Chunker import CharacterChunker, Chunker, TokenChunker
+from loaders.EmbeddingCache import EmbeddingCache
+from loaders.IngestStats import IngestStats
+from loaders.Metadata import CSVMetadata, MetadataProvider
+from loaders.TextNormalizer import TextNormalizer, normalize_text
+from loaders.Uploader import AsyncUploader
+
+# Marks the end of a stage's output in the pipeline queues
+_DONE = object()
+# Marks a document the extraction stage failed on
+_FAILED = object()
+
+
+def clean_text(text: str) -> str:
+    """Function to help remove garbage characters from text. Module level so extraction processes can use it.
+
+    :param text: String to clean
+    :return: Cleaned string
+    """
+    return normalize_text(text)
+
+
+def batched(iterable: Iterable, batch_size: int) -> Iterator[list]:
+    """Group any iterable into lists of batch_size without holding more than one batch in memory
+
+    :param iterable: Items to group
+    :param batch_size: Max amount of items per batch
+    :return: Generator of batches, the last one may be smaller
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def extract_pdf(file_path: str, chunker: Chunker) -> Optional[list]:
+    """Extraction stage of the loading pipeline. Reads, cleans and chunks a single PDF.
+    Runs inside a worker process so PyPDF2 parsing, the cleaning regexes and tokenization do not hold the encoder's GIL.
+
+    :param file_path: Full path to the PDF
+    :param chunker: Chunker splitting the cleaned text
+    :return: List of chunk strings, None if no text could be detected
+    """
+    return extract_pdf_timed(file_path, chunker)[0]
+
+
+def extract_pdf_timed(file_path: str, chunker: Chunker) -> tuple:
+    """Same as extract_pdf, also timing each step. Timings are returned rather than recorded because this runs in
+    a worker process.
+
+    :param file_path: Full path to the PDF
+    :param chunker: Chunker splitting the cleaned text
+    :return: Tuple of (chunks or None, dict of parse/clean/chunk seconds, size of the file in bytes)
+    """
+    timings = {"parse": 0.0, "clean": 0.0}
+    normalizer = TextNormalizer()
+    found_text = False
+    with open(file_path, "rb") as pdf_file:
+        size = os.fstat(pdf_file.fileno()).st_size
+        start_time = time.perf_counter()
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+
+        # Extract and clean text page by page
+        for page in pdf_reader.pages:
+            text = page.extract_text()
+            parsed_time = time.perf_counter()
+            timings["parse"] += parsed_time - start_time
+            found_text = found_text or len(text) > 0
+            normalizer.feed(text)
+            start_time = time.perf_counter()
+            timings["clean"] += start_time - parsed_time
+
+    if not found_text:
+        return None, timings, size
+    start_time = time.perf_counter()
+    cleaned = normalizer.finish()
+    timings["clean"] += time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    chunks = chunker.chunk(cleaned)
+    timings["chunk"] = time.perf_counter() - start_time
+    return chunks, timings, size
+
+
 class MacLoader:
     """Multithreading directory file loading & encoding
 
     Args:
         device (str): Selected device to encode. If not specified it will pick CUDA if available, cpu if not.
         model_name (str): Sentence Transformer model to use.
-        max_workers_num (int): Max amount of workers/threads to run at the same time. If not specified it will default to amount of threads your CPU supports.
-        max_chunk_size (int): Max amount of characters per every chunk of data. Higher for greater context, lower for less context but more specific data. If descreased, make sure k search param is increased.
-        chunk_overlap (int): Amount of overlap between chunks.
+        max_workers_num (int): Amount of encoding threads. They share one Sentence Transformer with every database using the same model.
+        max_chunk_size (int): Max amount of characters per chunk if chunker is "characters". Higher for greater context, lower for less context but more specific data. If descreased, make sure k search param is increased.
+        chunk_overlap (int): Amount of overlap between chunks if chunker is "characters".
+        chunker (Chunker): How documents are split into chunks. Defaults to a TokenChunker packing whole sentences up to the model's token limit. "characters" gives the old fixed size character windows of max_chunk_size.
         data_directory (str): Directory where all data is found.
         JSONFilename (str): Name of file to write JSON data to if applicable.
         metadata_file (str): If applicable, file where metadata information is found.
+        metadata_provider (MetadataProvider): Where document metadata comes from. Defaults to a CSVMetadata index of metadata_file, read once.
+        extraction_workers (int): Amount of processes used to read, clean and chunk PDFs. If not specified it will default to amount of threads your CPU supports. They are spawned, so scripts using the loader need an if __name__ == "__main__" guard.
+        queue_size (int): Max amount of documents waiting between two pipeline stages before the earlier stage blocks.
+        encode_batch_size (int): Amount of chunks, collected across documents, sent to the encoder at once.
+        token_budget (int): If specified, max amount of tokens sent to the encoder at once.
+        embedding_cache (EmbeddingCache): If specified, chunks embedded by a previous run are taken from the cache instead of being encoded again.
+
+    Per-stage timings, throughput and queue depths of the last encode_docs run are kept in stats (IngestStats).
     """
 
     def __init__(
             self,
-            device: str = 'cuda' if torch.cuda.is_available() else 'cpu',
+            device: Optional[str] = None,
             model_name: str = "all-mpnet-base-v2",
             multithreading: bool = True,
             max_workers_num: int = 1,
@@ -37,28 +133,50 @@ class MacLoader:
             chunk_overlap: int = 20,
             data_directory: str = "data",
             JSONFilename: str = "data",
-            metadata_file: str = "metadata.csv"
+            metadata_file: str = "metadata.csv",
+            extraction_workers: Optional[int] = None,
+            queue_size: int = 16,
+            encode_batch_size: int = 64,
+            token_budget: Optional[int] = None,
+            embedding_cache: Optional[EmbeddingCache] = None,
+            metadata_provider: Optional[MetadataProvider] = None,
+            chunker: Optional[Union[Chunker, str]] = None
     ) -> None:
-        self.device = device
         self.model_name = model_name
         self.multithreading = multithreading
         self.max_workers_num = max_workers_num
         self.max_chunk_size = max_chunk_size
         self.chunk_overlap = chunk_overlap
+        if chunker == "characters":
+            chunker = CharacterChunker(max_chunk_size=max_chunk_size, chunk_overlap=chunk_overlap)
+        self.chunker = chunker or TokenChunker(model_name=model_name)
         self.data_directory = data_directory
         self.JSONFilename = JSONFilename
         self.metadata_file = metadata_file
+        self.metadata_provider = metadata_provider or CSVMetadata(metadata_file)
+        self.extraction_workers = extraction_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.encode_batch_size = encode_batch_size
+        self.token_budget = token_budget
+        self.embedding_cache = embedding_cache
         self.doc_count = 0
+        self._doc_count_lock = threading.Lock()
+        self.stats = IngestStats()
 
         self.logger = logging.getLogger(__name__)
-        if device == 'cuda':
-            self.embeddings = []
-            for i in range(max_workers_num):
-                self.embeddings.append(SentenceTransformer(model_name_or_path=model_name, device=device))
-        else:
-            self.embeddings = SentenceTransformer(model_name_or_path=model_name, device=device)
-        self.encoder = lambda num: self.embeddings if self.device == 'cpu' else self.embeddings[
-            num % self.max_workers_num]
+        # Shared with every database using the same model, only loaded once something is encoded
+        self.embeddings = SharedEncoder(model_name=model_name, device=device)
+        self.encoder = lambda num: self.embeddings
+
+    @property
+    def device(self) -> str:
+        return self.embeddings.device
+
+    def close(self) -> None:
+        """Release the loader's handle on the shared encoder and close the metadata provider
+        """
+        self.embeddings.release()
+        self.metadata_provider.close()
 
     def _clean_text(self, text: str):
         """Method to help remove garbage characters from text
@@ -66,192 +184,327 @@ class MacLoader:
         :param text: String to clean
         :return: Cleaned string
         """
-        fixed = text.replace("  ", " ")
-        # Recursive method to reduce junk whitespace
-        if "  " in fixed:
-            return self._clean_text(fixed)
-        else:
-            # Remove line skipping associated with PDF loading
-            fixed = fixed.replace("\n", "").replace(".,", ".").replace("\t", "")
-
-            # Remove hyphens between two words where it should not exist due to PDF loading
-            fixed = re.sub(r'\b(\w+)-(\w+)\b', r'\1\2', fixed)
-
-            # Forgot what this one removes
-            fixed = re.sub(r'\(cid:\d+\)', ' ', fixed)
-            if "  " in fixed:
-                return self._clean_text(fixed)
-
-            # Remove starting whitespace
-            if fixed.startswith(" "):
-                fixed = fixed[1:]
-            return fixed
+        return clean_text(text)
 
     def encode_docs(self,
                     database: any = None,
                     max_num_files: Optional[int] = None,
-                    batch_size: int = 500
-                    ) -> None:
+                    batch_size: int = 500,
+                    max_in_flight: Optional[int] = None
+                    ) -> dict:
         """Main method for encoding and loading docs
         :params:
             database (any): Selected database to send data to. Options: JSON, Pinecone, Milvus, QDrant
             max_num_files (int): Max number of files to load & read from.
-            batch_size (int): Number of accumulated batches until an upload is triggered
-        :return:
+            batch_size (int): Number of accumulated chunks until an upload is triggered, uploaded as one VectorBatch
+            max_in_flight (int): Max amount of batches uploading while the next ones are encoded. Defaults to the database's upload_concurrency.
+        :return: Summary of the run, see IngestStats.summary
         """
         self.logger.info(f"""Using device {self.device} for embedding 
-                     Using {self.max_workers_num} workers
-                     Using batches of {self.max_chunk_size} with a max of {max_num_files} files
-                     Model Name={self.model_name}, data directory={self.data_directory}, max chunk size={self.max_chunk_size}, overlap={self.chunk_overlap}""")
-        starting_time = time.time()
+                     Using {self.max_workers_num} encoding workers and {self.extraction_workers} extraction workers
+                     Using a max of {max_num_files} files
+                     Model Name={self.model_name}, data directory={self.data_directory}, chunker={type(self.chunker).__name__}({vars(self.chunker)})""")
+        self.stats.reset()
 
         # Faster uploading for applicable databases
         database.indexing(False)
 
-        # Get current path
+        batched_files = self._list_files(max_num_files)
+        dir_length = len(batched_files)
+        pbar = tqdm(total=dir_length, desc=f"Encoding files")
+
+        self.logger.info(f"Encoding documents...")
+        # Uploads run on their own event loop, encoding only waits once max_in_flight batches are still uploading
+        with AsyncUploader(database, max_in_flight=max_in_flight, stats=self.stats) as uploader:
+            for batch in rebatch(self.stream_documents(batched_files, pbar=pbar), batch_size):
+                uploader.submit(batch)
+
+        self.stats.finish()
+        summary = self.stats.summary()
+        self.logger.info(f"Encoded {dir_length} documents in {summary['wall_seconds']} seconds")
+        self.logger.info(f"Ingestion stats: {summary}")
+        pbar.close()
+        database.indexing(True)
+        self.doc_count = 0
+        return summary
+
+    def _list_files(self, max_num_files: Optional[int] = None) -> list:
+        """List the files in the data directory that should be loaded
+
+        :param max_num_files: Max number of files to load, 0 or None for all of them
+        :return: Filenames within the data directory
+        """
+        directory = os.listdir(os.getcwd() + f"/{self.data_directory}/")
+        if max_num_files:
+            return directory[:max_num_files]
+        return directory
+
+    def stream_documents(self, filenames: Optional[list] = None, pbar: Optional[tqdm] = None) -> Iterator[VectorBatch]:
+        """Stream encoded PDFs one at a time, each as a VectorBatch of its chunks. Documents are extracted, cleaned
+        and encoded as the generator is consumed, so memory stays flat no matter how large the data directory is.
+
+        :param filenames: Files within the data directory to load, every file if not specified
+        :param pbar: Progress bar to update once per finished file
+        :return: Generator of batches ready to upload, see databases.batch.rebatch to group them
+        """
+        if filenames is None:
+            filenames = self._list_files()
+        results = self._pipeline(filenames) if self.multithreading else self._sequential(filenames)
+        for result in results:
+            if pbar is not None:
+                pbar.update(1)
+            if result:
+                self.stats.count("documents")
+                self.stats.count("chunks", len(result))
+                yield result
+            else:
+                self.stats.count("failed")
+
+    def stream_chunks(self, filenames: Optional[list] = None, pbar: Optional[tqdm] = None) -> Iterator[dict]:
+        """Stream encoded chunks one at a time as {'id', 'values', 'metadata'} dicts. Far heavier than
+        stream_documents since every vector becomes a list of floats, only meant for code expecting that format.
+
+        :param filenames: Files within the data directory to load, every file if not specified
+        :param pbar: Progress bar to update once per finished file
+        :return: Generator of documents ready to upload
+        """
+        for document in self.stream_documents(filenames, pbar=pbar):
+            yield from document.to_documents()
+
+    def _pipeline(self, filenames: list):
+        """Two stage loading pipeline. A process pool extracts and chunks PDFs while one thread per encoder
+        embeds whatever is ready. Both stages are joined by bounded queues so neither can run away from the other.
+
+        :param filenames: Files within the data directory to load
+        :return: Generator with one VectorBatch of encoded chunks per file (None if the file failed)
+        """
+        encoders = [self.encoder(i) for i in range(self.max_workers_num)]
+        extracted = queue.Queue(maxsize=self.queue_size)
+        encoded = queue.Queue(maxsize=self.queue_size)
+
+        threads = [threading.Thread(target=self._extract_stage, args=(filenames, extracted, len(encoders)),
+                                    name="pdf-extraction", daemon=True)]
+        for i, encoder in enumerate(encoders):
+            threads.append(threading.Thread(target=self._encode_stage, args=(encoder, extracted, encoded),
+                                            name=f"pdf-encoding-{i}", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        finished = 0
+        while finished < len(encoders):
+            self.stats.sample_queue("extracted", extracted.qsize())
+            self.stats.sample_queue("encoded", encoded.qsize())
+            result = encoded.get()
+            if result is _DONE:
+                finished += 1
+                continue
+            yield result
+
+        for thread in threads:
+            thread.join()
+
+    def _extract_stage(self, filenames: list, extracted: queue.Queue, consumers: int) -> None:
+        """First pipeline stage. Keeps the process pool busy and hands finished documents to the encoders.
+
+        :param filenames: Files within the data directory to load
+        :param extracted: Queue the encoding stage reads from
+        :param consumers: Number of encoding threads waiting on the queue
+        :return:
+        """
         directory_path = os.getcwd() + f"/{self.data_directory}/"
-        directory = os.listdir(directory_path)
+        max_pending = self.extraction_workers * 2
 
-        dir_length = len(directory)
+        def hand_off(future, filename):
+            try:
+                extracted.put((filename, self._record_extraction(*future.result())))
+            except Exception as e:
+                self.logger.error(f"An error occurred: {e}")
+                extracted.put((filename, _FAILED))
 
-        if max_num_files != 0 and dir_length > max_num_files:
-            dir_length = max_num_files
+        try:
+            self.chunker.prepare()
+            # Spawned, not forked: by now the encoder threads run and torch/tokenizers hold locks a fork would copy
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.extraction_workers,
+                                                        mp_context=multiprocessing.get_context("spawn")) as executor:
+                pending = {}
+                for filename in filenames:
+                    future = executor.submit(extract_pdf_timed, directory_path + filename, self.chunker)
+                    pending[future] = filename
+
+                    # Only keep a few documents per process queued up, the rest wait for the encoders to catch up
+                    if len(pending) >= max_pending:
+                        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for finished in done:
+                            hand_off(finished, pending.pop(finished))
+
+                for future in concurrent.futures.as_completed(pending):
+                    hand_off(future, pending[future])
+        except Exception as e:
+            self.logger.critical(f"Extraction stage failed. See error: {e}")
+        finally:
+            for _ in range(consumers):
+                extracted.put(_DONE)
 
-        pbar = tqdm(total=dir_length, desc=f"Encoding files")
+    def _encode_stage(self, encoder: SharedEncoder, extracted: queue.Queue, encoded: queue.Queue) -> None:
+        """Second pipeline stage. Feeds chunks from the extraction stage to this thread's batcher.
 
-        self.logger.info(f"Encoding documents...")
-        batched_files = directory[:dir_length]
-        batched = []
-
-        if self.multithreading:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers_num) as executor:
-                futures = [executor.submit(self.process_pdf, filename=filename, encoder=self.encoder(i)) for i, filename
-                           in enumerate(batched_files)]
-                for future in concurrent.futures.as_completed(futures):
-                    result = future.result()
-                    if result is None or result is []:
-                        continue
-                    batched.extend(result)
-
-                    # Loops batched and uploads for each batch size
-                    while len(batched) >= batch_size:
-                        tmp = batched[:batch_size]
-                        batched = batched[batch_size:]
-                        try:
-                            asyncio.run(database.upload(tmp))
-                        except Exception as e:
-                            self.logger.critical(f"Failed to upload, skipping batch! See batch:\n")
-                            self.logger.exception(e)
-                            break
-                    gc.collect()
-                    pbar.update(1)
-        else:
-            for i, filename in enumerate(batched_files):
-                result = self.process_pdf(filename=filename, encoder=self.encoder(i))
-                if result is None or result is []:
+        :param encoder: Encoder used by this thread
+        :param extracted: Queue filled by the extraction stage
+        :param encoded: Queue of finished chunks read by encode_docs
+        :return:
+        """
+        batcher = self._new_batcher(encoder)
+        try:
+            while True:
+                item = extracted.get()
+                if item is _DONE:
+                    break
+                filename, chunked_text = item
+                if chunked_text is _FAILED:
+                    encoded.put(None)
                     continue
-                batched.extend(result)
-                while len(batched) >= batch_size:
-                    tmp = batched[:batch_size]
-                    batched = batched[batch_size:]
-                    try:
-                        asyncio.run(database.upload(tmp))
-                    except Exception as e:
-                        self.logger.critical(f"Failed to upload, skipping batch! See batch:\n")
-                        self.logger.exception(e)
-                        break
-                pbar.update(1)
-
+                for result in self._batch_document(batcher, filename, chunked_text):
+                    encoded.put(result)
+            for result in self._flush_batcher(batcher):
+                encoded.put(result)
+        finally:
+            encoded.put(_DONE)
+
+    def _sequential(self, filenames: list):
+        """Single threaded version of the pipeline, still batching chunks across documents
+
+        :param filenames: Files within the data directory to load
+        :return: Generator with one VectorBatch of encoded chunks per file (None if the file failed)
+        """
+        directory_path = os.getcwd() + f"/{self.data_directory}/"
+        batcher = self._new_batcher(self.encoder(0))
+        for filename in filenames:
+            try:
+                chunked_text = self._record_extraction(*extract_pdf_timed(directory_path + filename, self.chunker))
+            except Exception as e:
+                self.logger.error(f"An error occurred: {e}")
+                yield None
+                continue
+            yield from self._batch_document(batcher, filename, chunked_text)
+        yield from self._flush_batcher(batcher)
+
+    def _record_extraction(self, chunked_text: Optional[list], timings: dict, size: int) -> Optional[list]:
+        """Add the timings of one extracted document to stats
+
+        :return: The chunks, unchanged
+        """
+        for stage, seconds in timings.items():
+            self.stats.record(stage, seconds)
+        self.stats.count("bytes", size)
+        return chunked_text
+
+    def _new_batcher(self, encoder: SharedEncoder) -> EmbeddingBatcher:
+        return EmbeddingBatcher(encoder=encoder, batch_size=self.encode_batch_size, token_budget=self.token_budget,
+                                cache=self.embedding_cache, model_name=self.model_name, stats=self.stats)
+
+    def _batch_document(self, batcher: EmbeddingBatcher, filename: str, chunked_text: Optional[list]) -> list:
+        """Hand a document's chunks to the batcher
+
+        :param batcher: Batcher of the current encoding thread
+        :param filename: Name of the PDF the chunks came from
+        :param chunked_text: Chunks produced by the extraction stage, None if the PDF had no text
+        :return: Results for every document the batcher finished, None for each document that failed
+        """
+        if chunked_text is None:
+            self._mark_for_deletion(filename)
+            return [None]
         try:
-            asyncio.run(database.upload(batched[:batch_size]))
+            finished = batcher.add(filename, chunked_text)
         except Exception as e:
-            self.logger.critical(f"Failed to upload, skipping batch! See batch:\n")
-            self.logger.exception(e)
+            self.logger.error(f"An error occurred: {e}")
+            return [None] * len(batcher.discard())
+        return [self._build_chunks(*document) for document in finished]
 
-        self.logger.info(f"Encoded {dir_length} documents in {time.time() - starting_time} seconds")
-        pbar.close()
-        database.indexing(True)
-        self.doc_count = 0
+    def _flush_batcher(self, batcher: EmbeddingBatcher) -> list:
+        try:
+            finished = batcher.flush()
+        except Exception as e:
+            self.logger.error(f"An error occurred: {e}")
+            return [None] * len(batcher.discard())
+        self.logger.info(f"Encoder throughput: {batcher.throughput()}")
+        if self.embedding_cache is not None:
+            self.logger.info(f"Embedding cache: {self.embedding_cache.stats()}")
+        return [self._build_chunks(*document) for document in finished]
+
+    def _mark_for_deletion(self, filename: str) -> None:
+        self.logger.warning(f"PDF with filename {filename} did not detect any text. Deleting")
+        with open("delete.txt", "a") as file:
+            file.write(f"{filename}\n")
+
+    def _next_ids(self, amount: int) -> int:
+        """Reserve a range of document IDs, safe to call from several encoding threads
+
+        :param amount: Number of IDs to reserve
+        :return: First reserved ID
+        """
+        with self._doc_count_lock:
+            first = self.doc_count
+            self.doc_count = self.doc_count + amount
+        return first
+
+    def _build_chunks(self, filename: str, chunked_text: list, vectorized_chunks) -> Optional[VectorBatch]:
+        """Attach metadata and embeddings to the chunks of a single document
+
+        :param filename: Name of the PDF the chunks came from
+        :param chunked_text: Chunks produced by the extraction stage
+        :param vectorized_chunks: float32 matrix with the embedding of every chunk, used without copying
+        :return: VectorBatch of the chunks ready to upload, None if the document could not be processed
+        """
+        try:
+            # Extract metadata
+            metadata = self.get_file_metadata(filename)
+            # Stored as an int whenever possible so size can be filtered on with ranges
+            metadata_size = int(metadata['size']) if str(metadata['size']).isdigit() else str(metadata['size'])
+            metadata_created_at = metadata['created_at']
+        except Exception as e:
+            self.logger.error(f"An error occurred: {e}")
+            return None
+
+        first_id = self._next_ids(len(chunked_text))
+        return VectorBatch.from_arrays(
+            ids=np.arange(first_id, first_id + len(chunked_text), dtype=np.int64),
+            vectors=vectorized_chunks,
+            texts=chunked_text,
+            metadata={
+                'filename': filename,
+                'size': metadata_size,
+                'created_at': metadata_created_at
+            },
+            chunks=np.arange(1, len(chunked_text) + 1)
+        )
 
     def get_file_metadata(self, filename: str) -> Optional[dict]:
-        # Scan metadata.csv for associated data
-        df = pd.read_csv(self.metadata_file)
+        # Look up associated data, the provider indexes its source once instead of scanning it per file
         filename = filename.replace(".pdf", "").replace(self.data_directory, "").replace('\\', "")
-        located = df.loc[df['digest'] == filename]
-        if located.empty:
-            self.logger.error(f"Could not find {filename} in metadata.csv")
+        metadata = self.metadata_provider.get(filename)
+        if metadata is None:
+            self.logger.error(f"Could not find {filename} in {self.metadata_file}")
             return {}
-        return {
-            'filename': filename,
-            'size': str(located['file_size'].iloc[0]),
-            # Has to be str or int for some reason, was not working before. # Size is in bytes
-            'created_at': located['date'].iloc[0][:10]
-        }
+        return metadata
 
     def process_pdf(self, filename, encoder):
-        text = ""
+        """Extract and encode a single PDF without the pipeline
+
+        :param filename: Name of the PDF within the data directory
+        :param encoder: Sentence Transformer to encode with
+        :return: VectorBatch of the chunks ready to upload, None if the file failed
+        """
         directory_path = os.getcwd() + f"/{self.data_directory}/"
-        file_path = directory_path + filename
 
         try:
-            with open(file_path, "rb") as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-
-                # Extract text from each page
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text()
-
-                if len(text) == 0:
-                    self.logger.warning(f"PDF with filename {filename} did not detect any text. Deleting")
-                    with open("delete.txt", "a") as file:
-                        file.write(f"{filename}\n")
-                        file.close()
-                    return {}
-                pdf_file.close()
-
-                # Extract metadata
-                metadata = self.get_file_metadata(filename)
-                metadata_size = str(metadata['size'])  # Has to be str or int for some reason, was not working
-                metadata_created_at = metadata['created_at']
-
-                text = self._clean_text(text)
-
-                # Cut down text from PDF into reasonable chunks
-                chunks = []
-                chunked_text = []
-                start_idx = 0
-                count = 0
-                while start_idx < len(text):
-                    count += 1
-                    end_idx = start_idx + self.max_chunk_size
-                    if end_idx >= len(text):
-                        tmp = text[start_idx:]
-                    else:
-                        tmp = text[start_idx:end_idx]
-
-                    chunks.append({
-                        'id': str(self.doc_count),
-                        'metadata': {
-                            'filename': filename,
-                            'size': metadata_size,
-                            'created_at': metadata_created_at,
-                            'chunk': count
-                        }
-                    })
-                    chunked_text.append(tmp)
-                    self.doc_count = self.doc_count + 1
-                    start_idx = end_idx - self.chunk_overlap
-
-                vectorized_chunks = encoder.encode(chunked_text, show_progress_bar=False)
-                for i, chunk in enumerate(chunks):
-                    chunk['values'] = vectorized_chunks[i].tolist()
-                    chunk['metadata']['text'] = chunked_text[i]
-
-                return chunks
+            chunked_text = extract_pdf(directory_path + filename, self.chunker)
+            if chunked_text is None:
+                self._mark_for_deletion(filename)
+                return None
+            return self._build_chunks(filename, chunked_text, encoder.encode(chunked_text, show_progress_bar=False))
         except Exception as e:
             self.logger.error(f"An error occurred: {e}")
-            return {}
+            return None
 
     def updateWorkers(self, newValue: int) -> None:
         """Method to safely update the number of workers
@@ -259,13 +512,5 @@ class MacLoader:
         :param newValue: New num of workers
         :return:
         """
+        # Every worker shares the same encoder, so nothing has to be loaded or dropped here
         self.max_workers_num = newValue
-        if self.device == 'cuda':
-
-            # If the array already has more values than needed, cut them. Else add them until satisfied.
-            # Saves time as each SentenceTransformer can take a moment, Rarely will affect a lot but important to consider.
-            if len(self.embeddings) > newValue:
-                self.embeddings = self.embeddings[:newValue]
-            else:
-                while newValue > len(self.embeddings):
-                    self.embeddings.append(SentenceTransformer(model_name_or_path=self.model_name, device=self.device))
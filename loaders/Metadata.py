@@ -0,0 +1,159 @@
+import csv
+import io
+import logging
+import mmap
+import os
+import threading
+from typing import Optional
+
+
+class MetadataProvider:
+    """Source of per-document metadata for MacLoader. Subclass it to support another metadata format, get() is the
+    only method that has to be implemented. Providers are shared by every encoding thread and must be picklable so
+    they can be handed to worker processes.
+    """
+
+    def get(self, digest: str) -> Optional[dict]:
+        """Metadata of one document
+
+        :param digest: Name of the PDF without the .pdf extension
+        :return: Dict of filename, size (str, bytes) and created_at (str, YYYY-MM-DD), None if unknown
+        """
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class DictMetadata(MetadataProvider):
+    """Metadata already in memory
+
+    Args:
+        metadata (dict): digest -> dict with size and created_at.
+    """
+
+    def __init__(self,
+                 metadata: dict
+                 ) -> None:
+        self.metadata = metadata
+
+    def get(self, digest: str) -> Optional[dict]:
+        entry = self.metadata.get(digest)
+        if entry is None:
+            return None
+        return {'filename': digest, 'size': str(entry['size']), 'created_at': str(entry['created_at'])[:10]}
+
+
+class CSVMetadata(MetadataProvider):
+    """Metadata from a CSV file such as metadata.csv, indexed by digest the first time it is used.
+    Files up to in_memory_limit are parsed into a dict. Larger ones are memory mapped and only the byte offset of every
+    row is kept, rows are parsed when looked up. Lookups are O(1) either way and safe from any thread.
+    If a digest appears more than once the first row wins.
+
+    Args:
+        filename (str): CSV file to read.
+        key_column (str): Column holding the digest of each PDF.
+        size_column (str): Column holding the file size in bytes.
+        date_column (str): Column holding the creation date, only the first 10 characters are kept.
+        in_memory_limit (int): Files larger than this many bytes are indexed by offset instead of loaded. Rows must not contain line breaks then.
+    """
+
+    def __init__(self,
+                 filename: str = "metadata.csv",
+                 key_column: str = "digest",
+                 size_column: str = "file_size",
+                 date_column: str = "date",
+                 in_memory_limit: int = 256 * 1024 * 1024
+                 ) -> None:
+        self.filename = filename
+        self.key_column = key_column
+        self.size_column = size_column
+        self.date_column = date_column
+        self.in_memory_limit = in_memory_limit
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        # digest -> (size, created_at) when loaded, digest -> byte offset when memory mapped
+        self._index = None
+        self._columns = None
+        self._file = None
+        self._mmap = None
+
+    def __getstate__(self) -> dict:
+        # Each process builds its own index the first time it needs one
+        state = self.__dict__.copy()
+        del state['_lock']
+        del state['logger']
+        state.update(_index=None, _columns=None, _file=None, _mmap=None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _load(self) -> dict:
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    if os.path.getsize(self.filename) > self.in_memory_limit:
+                        self._index = self._index_offsets()
+                    else:
+                        self._index = self._index_rows()
+                    self.logger.info(f"Indexed {len(self._index)} rows of {self.filename}")
+                index = self._index
+        return index
+
+    def _index_rows(self) -> dict:
+        with open(self.filename, newline="", encoding="utf-8") as file:
+            reader = csv.reader(file)
+            columns = self._read_header(next(reader))
+            index = {}
+            for row in reader:
+                if row:
+                    index.setdefault(row[columns[0]], (row[columns[1]], row[columns[2]]))
+            return index
+
+    def _index_offsets(self) -> dict:
+        self._file = open(self.filename, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self._mmap.readline()
+        self._columns = self._read_header(self._parse(header))
+        index = {}
+        offset = self._mmap.tell()
+        for line in iter(self._mmap.readline, b""):
+            if line.strip():
+                index.setdefault(self._parse(line)[self._columns[0]], offset)
+            offset += len(line)
+        return index
+
+    def _read_header(self, header: list) -> tuple:
+        header = [column.strip() for column in header]
+        return tuple(header.index(column) for column in (self.key_column, self.size_column, self.date_column))
+
+    @staticmethod
+    def _parse(line: bytes) -> list:
+        return next(csv.reader(io.StringIO(line.decode("utf-8"))))
+
+    def get(self, digest: str) -> Optional[dict]:
+        entry = self._load().get(digest)
+        if entry is None:
+            return None
+        if self._mmap is not None:
+            end = self._mmap.find(b"\n", entry)
+            row = self._parse(self._mmap[entry:end if end != -1 else len(self._mmap)])
+            entry = (row[self._columns[1]], row[self._columns[2]])
+        return {'filename': digest, 'size': str(entry[0]), 'created_at': entry[1][:10]}
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def close(self) -> None:
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._file.close()
+            self._reset()
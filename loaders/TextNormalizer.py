@@ -0,0 +1,115 @@
+import re
+from typing import Iterable
+
+_CID = re.compile(r"\(cid:\d+\)")
+# Hyphens between two word characters. Starting the pattern with the literal hyphen lets the regex engine skip
+# straight to candidates instead of trying every word.
+_HYPHEN = re.compile(r"-(?=\w)(?<=\w-)")
+_WORD = re.compile(r"\w+")
+_SPACES = re.compile(r"  +")
+
+
+def remove_hyphens(text: str) -> str:
+    """Join words split across lines, same output as the old cleaner's re.sub(r"\\b(\\w+)-(\\w+)\\b", r"\\1\\2", text).
+    Its matches don't overlap, so of a chain of hyphenated words only every other hyphen goes: "a-b-c-d" -> "ab-cd".
+
+    :param text: Text to join words in
+    :return: Text without those hyphens
+    """
+    previous = -1
+    removed = False
+
+    def replace(match) -> str:
+        nonlocal previous, removed
+        position = match.start()
+        # The word before this hyphen already ended the last match if it sits between the two hyphens
+        chained = previous >= 0 and _WORD.fullmatch(text, previous + 1, position) is not None
+        removed = not (chained and removed)
+        previous = position
+        return "" if removed else "-"
+
+    return _HYPHEN.sub(replace, text)
+
+
+def clean_pass(text: str) -> str:
+    """One run of the old cleaner's steps, in its order
+
+    :param text: Text to clean
+    :return: Cleaned text, may still contain double spaces
+    """
+    text = _SPACES.sub(" ", text)
+    text = text.replace("\n", "").replace(".,", ".").replace("\t", "")
+    text = remove_hyphens(text)
+    return _CID.sub(" ", text)
+
+
+class TextNormalizer:
+    """Replacement for the old recursive text cleaner with the same output. Feed it the text of one page at a time,
+    each page is cleaned as it arrives with the old cleaner's steps, in its order:
+        - runs of spaces collapse into one
+        - newlines are removed, then ".," becomes ".", then tabs are removed
+        - hyphens between two words are removed ("exam-ple" -> "example", "a-b-c-d" -> "ab-cd")
+        - (cid:N) glyph placeholders become spaces
+
+    The old cleaner ran these steps again over the whole document as long as they left double spaces anywhere,
+    then dropped a leading space. finish() does the same on the joined pages, in a loop instead of by recursion.
+    Usually only one more run is needed, e.g. for the spaces left around a removed newline.
+
+    The last word of every page is held back until the next one arrives, so a word or placeholder split across
+    pages is still cleaned as a whole.
+    """
+
+    def __init__(self) -> None:
+        self._pending = ""
+        self._cleaned = []
+
+    def feed(self, text: str) -> None:
+        """Add and clean the next piece of text
+
+        :param text: Raw text, e.g. one page
+        """
+        pending = self._pending + text
+        # Everything up to the last run of spaces can't be affected by what comes next
+        cut = pending.rstrip(" ").rfind(" ")
+        if cut <= 0:
+            self._pending = pending
+            return
+        cut = len(pending[:cut].rstrip(" "))
+        self._pending = pending[cut:]
+        self._cleaned.append(clean_pass(pending[:cut]))
+
+    def finish(self) -> str:
+        """Clean whatever is held back and return the whole cleaned text. The normalizer can be reused afterwards.
+
+        :return: Cleaned text
+        """
+        self._cleaned.append(clean_pass(self._pending))
+        text = "".join(self._cleaned)
+        self._pending = ""
+        self._cleaned = []
+        while "  " in text:
+            text = clean_pass(text)
+        if text.startswith(" "):
+            text = text[1:]
+        return text
+
+
+def normalize_pages(pages: Iterable[str]) -> str:
+    """Clean the text of a whole document, one page at a time
+
+    :param pages: Raw text of every page
+    :return: Cleaned text
+    """
+    normalizer = TextNormalizer()
+    for page in pages:
+        normalizer.feed(page)
+    return normalizer.finish()
+
+
+def normalize_text(text: str) -> str:
+    """Clean a single string
+
+    :param text: Raw text
+    :return: Cleaned text
+    """
+    return normalize_pages([text])
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+from loaders.IngestStats import IngestStats
+
+
+class AsyncUploader:
+    """Uploads batches to a database from a dedicated event loop, keeping several batches in flight at once.
+    submit() blocks once the in-flight limit is reached, which holds the encoder back instead of queueing batches in memory.
+
+    Args:
+        database (Database): Database to upload to.
+        max_in_flight (int): Max amount of batches being uploaded at the same time. Defaults to the database's upload_concurrency.
+        stats (IngestStats): If specified, every upload is recorded as the upload stage, along with the amount of batches in flight.
+    """
+
+    def __init__(self,
+                 database: any,
+                 max_in_flight: Optional[int] = None,
+                 stats: Optional[IngestStats] = None
+                 ) -> None:
+        self.database = database
+        self.stats = stats
+        self.max_in_flight = max_in_flight or getattr(database, 'upload_concurrency', 4)
+        self.logger = logging.getLogger(__name__)
+
+        self.uploaded = 0
+        self.failed = 0
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._idle = threading.Condition()
+        self._in_flight = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-uploader", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def submit(self, batch) -> None:
+        """Start uploading a batch, waiting first if max_in_flight batches are already being uploaded
+
+        :param batch: Batch to upload
+        :return:
+        """
+        self._slots.acquire()
+        with self._idle:
+            self._in_flight += 1
+            in_flight = self._in_flight
+        if self.stats is not None:
+            self.stats.sample_queue("uploads_in_flight", in_flight)
+        future = asyncio.run_coroutine_threadsafe(self._upload(batch), self._loop)
+        future.add_done_callback(self._finished)
+
+    async def _upload(self, batch) -> None:
+        start_time = time.perf_counter()
+        await self.database.upload(batch)
+        elapsed = time.perf_counter() - start_time
+        if self.stats is not None:
+            self.stats.record("upload", elapsed, len(batch))
+        self.logger.debug(f"Batch of {len(batch)} uploaded in {elapsed}")
+
+    def _finished(self, future) -> None:
+        error = future.exception()
+        if error is None:
+            self.uploaded += 1
+        else:
+            self.failed += 1
+            self.logger.critical(f"Failed to upload, skipping batch! See error: {error}", exc_info=error)
+        with self._idle:
+            self._in_flight -= 1
+            self._idle.notify_all()
+        self._slots.release()
+
+    def join(self) -> None:
+        """Wait for every submitted batch to finish uploading
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: self._in_flight == 0)
+
+    def close(self) -> None:
+        """Wait for every submitted batch and stop the event loop
+        """
+        self.join()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self.logger.info(f"Uploaded {self.uploaded} batches, {self.failed} failed")